@@ -1,18 +1,19 @@
+import os
 import dash
 from dash import html
 from dash import dcc
-from dash.dependencies import Input, Output
-import pandas as pd
+from dash import Patch
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import numpy as np
-import xarray as xr
-import netCDF4 as netcdf
-from plots import get_coords
-import plotly.express as px
-
-data = pd.read_csv("avocado.csv")
-data = data.query("type == 'Conventional' and region == 'Albany'")
-data["Date"] = pd.to_datetime(data["Date"], format="%Y-%m-%d")
-data.sort_values("Date", inplace=True)
+from geopy.exc import GeopyError
+from get_coords import normalize_city, get_coords, get_coords_batch
+from cache_utils import memoize, file_fingerprint
+from gazetteer import get_gazetteer
+from point_store import open_point_store, extract_points
+from load_data import to_celsius
+from tiles import FIELDS, install_tiles, prerender
+import lod
 
 external_stylesheets = [
     {
@@ -23,18 +24,45 @@ external_stylesheets = [
 ]
 app = dash.Dash(__name__)
 app.title = "City Temperatures"
+server = app.server
 
 # retrieve data
-DATA_FN = "hadgem3_gc31_ll_ssp5_8_5_data.nc"
+MODEL = "hadgem3_gc31_ll"
+SCENARIOS = {"ssp5_8_5": "SSP5-8.5", "ssp1_2_6": "SSP1-2.6"}
+DATA_FNS = {scenario: f"{MODEL}_{scenario}_data.nc" for scenario in SCENARIOS}
+AGGREGATIONS = {
+    "auto": "Auto", "monthly": "Monthly", "seasonal": "Seasonal mean",
+    "annual": "Annual mean", "decadal": "Decadal mean",
+}
 CITY = "London"
-ncset = netcdf.Dataset(DATA_FN, mode="r")
-ncset.set_auto_mask(False)
-ds = xr.open_dataset(DATA_FN)
+FIRST_YEAR, LAST_YEAR = 2015, 2099
+MAP_FIELDS = {"temperature": "Temperature (°C)", "difference": f"Change since {FIRST_YEAR} (°C)", "trend": "Trend (°C/decade)"}
+
+# optional figure cache shared by every server process (e.g. gunicorn workers)
+CACHE_DB = os.environ.get("DASHBOARD_CACHE_DB")
+
+
+def get_store(scenario):
+    # time-major copy of ts, so each city series is one contiguous read;
+    # the dashboard needs nothing else from the NetCDF file
+    return open_point_store(DATA_FNS[scenario])
 
-# extract individual variables
-temp = ds.variables["ts"]
-lat, lon = ds.variables["lat"], ds.variables["lon"]
-time = ds.variables["time"]
+
+def preload_stores(max_zoom=1):
+    # map every scenario's store before the server forks its workers, so they
+    # all share one read-only copy through the page cache, and render the
+    # tiles of the first map view, so no request thread reads the NetCDF
+    # file for them
+    for scenario, data_fn in DATA_FNS.items():
+        if os.path.exists(data_fn):
+            get_store(scenario)
+            for field in FIELDS:
+                prerender(data_fn, field, times=(year_index(scenario, FIRST_YEAR),), max_zoom=max_zoom)
+
+
+# pre-rendered map tiles of every scenario, built on first request and then
+# served from disk: /tiles/<scenario>/<field>/<time>/<z>/<x>/<y>.png
+install_tiles(server, DATA_FNS)
 
 
 ALLOWED_TYPES = (
@@ -61,11 +89,32 @@ app.layout = html.Div(
 
         html.Div(
             children=[
-                dcc.Input(
-                    id="text-input",
-                    type="text",
-                    placeholder="enter city here",
-                )
+                # the cities on the chart: type to search, pick any number
+                dcc.Dropdown(
+                    id="city-select",
+                    options=[],
+                    value=[],
+                    multi=True,
+                    placeholder="enter cities here",
+                ),
+                html.Button("Clear", id="clear-cities"),
+                # cities that could not be looked up
+                html.P(id="city-message", className="city-message"),
+                # cities currently drawn, in trace order
+                dcc.Store(id="cities", data=[]),
+                dcc.Dropdown(
+                    id="scenario",
+                    options=[{"label": label, "value": value} for value, label in SCENARIOS.items()],
+                    value="ssp5_8_5",
+                    clearable=False,
+                ),
+                dcc.RadioItems(
+                    id="aggregation",
+                    options=[{"label": label, "value": value} for value, label in AGGREGATIONS.items()],
+                    value="auto",
+                ),
+                # visible [x0, x1] range of the chart, None when zoomed out
+                dcc.Store(id="view", data=None),
             ],
             className="text-input",
         ),
@@ -76,7 +125,22 @@ app.layout = html.Div(
                     children=dcc.Graph(
                         id="temp-chart", config={"displayModeBar": False}),
                     className="card",
-                )
+                ),
+                html.Div(
+                    children=[
+                        dcc.RadioItems(
+                            id="map-field",
+                            options=[{"label": label, "value": value} for value, label in MAP_FIELDS.items()],
+                            value="temperature",
+                        ),
+                        dcc.Slider(
+                            id="map-year", min=FIRST_YEAR, max=LAST_YEAR, step=1, value=FIRST_YEAR,
+                            marks={year: str(year) for year in range(FIRST_YEAR, LAST_YEAR + 1, 10)},
+                        ),
+                        dcc.Graph(id="temp-map", config={"displayModeBar": False, "scrollZoom": True}),
+                    ],
+                    className="card",
+                ),
             ],
             className="wrapper",
         ),
@@ -85,47 +149,227 @@ app.layout = html.Div(
 
 
 @app.callback(
-    [Output("temp-chart", "figure")],
-    [Input("text-input", "text")],
+    Output("city-select", "options"),
+    [Input("city-select", "search_value")],
+    [State("city-select", "value")],
 )
-def update_charts(city):
+def update_suggestions(text, selected):
+
+    # as-you-type suggestions from the offline gazetteer, no network calls.
+    # The typed text itself is offered too, for places the gazetteer lacks
+    if not text:
+        raise PreventUpdate
+    selected = selected or []
+    gazetteer = get_gazetteer()
+    names = gazetteer.suggest(text) if gazetteer is not None and len(text) >= 2 else []
+    options = list(dict.fromkeys(selected + names + [text]))
+    return [{"label": name, "value": name} for name in options]
+
 
-    # get temperatures at closest coords to city
-    coords = get_coords(city)
-    temp_closest_coords = (
-        ds.ts.sel(lon=coords[0], lat=coords[1], method="nearest") - 273.15).values
-    timevals = time[:]
+def locate_cities(cities):
 
     '''
-    df = pd.DataFrame({"Year": timevals, "Temperature": temp_closest_coords})
-    temp_chart = {px.line(
-        df, x="Year", y="Temperature", title=f"Predicted Temperature for {city}")}
+    Split cities into those that can be geocoded and those that cannot.
+    Coordinates are cached, so this costs nothing for cities already seen.
+    returns
+            ---> found, missing: lists of city names, in the given order
+    '''
+
+    found, missing = [], []
+    for city in cities:
+        try:
+            get_coords(city)
+        except (ValueError, GeopyError):
+            # not found, or the geocoding service is unreachable
+            missing.append(city)
+        else:
+            found.append(city)
+    return found, missing
+
+
+@memoize(
+    maxsize=1024, disk_path=CACHE_DB,
+    key=lambda city, scenario, level: (
+        normalize_city(city), scenario, level, file_fingerprint(DATA_FNS[scenario])),
+)
+def city_series(city, scenario, level):
+    '''y values (degC) of one city at one level of the store's pyramid'''
+    store = get_store(scenario)
+    temps = extract_points([store], *get_coords_batch([city]), level=level)[0, 0]
+    return to_celsius(temps, store.var_units).tolist()
+
 
-    return temp_chart
+def cities_series(cities, scenario, level):
+
+    '''
+    x (fractional years) and one y list per city, at one level of the store's
+    pyramid. Each city is cached on its own, so changing the selection only
+    reads the cities that are new to it.
     '''
 
-    price_chart_figure = {
-        "data": [
-            {
-                "x": timevals,
-                "y": temp_closest_coords,
-                "type": "lines",
-                # "hovertemplate": "$%{y:.2f}<extra></extra>",
-            },
-        ],
+    store = get_store(scenario)
+    return store.level_x[level].tolist(), [city_series(city, scenario, level) for city in cities]
+
+
+def city_traces(cities, scenario, aggregation, view=None):
+
+    # only the points the chart can show: the visible range of each series,
+    # at the finest level that fits when aggregation is "auto", downsampled
+    # to at most lod.MAX_POINTS
+    if not cities:
+        return []
+    x0, x1 = view or (None, None)
+    level = aggregation
+    if aggregation == "auto":
+        level = lod.choose_level(get_store(scenario).level_x, x0, x1)
+    x, temps = cities_series(cities, scenario, level)
+
+    traces = []
+    for city, y in zip(cities, temps):
+        timevals, temp_closest_coords = lod.view(x, y, x0, x1)
+        traces.append({
+            "x": timevals.tolist(),
+            "y": temp_closest_coords.tolist(),
+            "type": "lines",
+            "name": city,
+            "hovertemplate": "%{y:.1f}°C<extra></extra>",
+        })
+    return traces
+
+
+def temperature_figure(cities, scenario, aggregation, view=None):
+
+    xaxis = {"range": view} if view else {"autorange": True}
+    return {
+        "data": city_traces(cities, scenario, aggregation, view),
         "layout": {
             "title": {
-                "text": "Average Price of Avocados",
+                "text": f"Predicted temperature ({SCENARIOS[scenario]})",
                 "x": 0.05,
                 "xanchor": "left",
             },
-            "xaxis": {"fixedrange": True},
-            "yaxis": {"tickprefix": "$", "fixedrange": True},
-            "colorway": ["#17B897"],
+            "xaxis": dict(xaxis, fixedrange=False),
+            "yaxis": {"ticksuffix": "°C", "fixedrange": True},
+            "showlegend": True,
         },
     }
 
-    return price_chart_figure
+
+@app.callback(
+    Output("temp-chart", "figure"),
+    [Input("scenario", "value"), Input("aggregation", "value")],
+    [State("cities", "data"), State("view", "data")],
+)
+def update_charts(scenario, aggregation, cities, view):
+
+    # a new scenario or aggregation changes every trace: full redraw.
+    # Series are cached per (city, scenario, level) and invalidated
+    # when the scenario's data file changes
+    return temperature_figure(cities, scenario, aggregation, view)
+
+
+@app.callback(
+    [Output("temp-chart", "figure", allow_duplicate=True), Output("view", "data")],
+    [Input("temp-chart", "relayoutData")],
+    [State("cities", "data"), State("scenario", "value"), State("aggregation", "value")],
+    prevent_initial_call=True,
+)
+def zoom(relayout, cities, scenario, aggregation):
+
+    # zooming or panning refetches the visible range of every trace, at a
+    # finer level when it now fits; the axis range itself stays in the browser
+    relayout = relayout or {}
+    if relayout.get("xaxis.autorange"):
+        view = None
+    elif "xaxis.range[0]" in relayout:
+        view = [float(relayout["xaxis.range[0]"]), float(relayout["xaxis.range[1]"])]
+    elif "xaxis.range" in relayout:
+        view = [float(x) for x in relayout["xaxis.range"]]
+    else:
+        raise PreventUpdate
+
+    figure = Patch()
+    for k, trace in enumerate(city_traces(cities, scenario, aggregation, view)):
+        figure["data"][k]["x"] = trace["x"]
+        figure["data"][k]["y"] = trace["y"]
+    return figure, view
+
+
+@app.callback(
+    [Output("temp-chart", "figure", allow_duplicate=True), Output("cities", "data", allow_duplicate=True),
+     Output("city-select", "value", allow_duplicate=True), Output("city-message", "children")],
+    [Input("city-select", "value")],
+    [State("cities", "data"), State("scenario", "value"), State("aggregation", "value"), State("view", "data")],
+    prevent_initial_call=True,
+)
+def select_cities(selected, cities, scenario, aggregation, view):
+
+    # fires when a city is picked or removed, not on every keystroke.
+    # Picking cities only sends their traces and removing one only drops its
+    # trace: the figure is patched in the browser. A city that cannot be
+    # geocoded is dropped from the selection rather than left to fail again
+    selected, missing = locate_cities(list(dict.fromkeys(selected or [])))
+    value = selected if missing else dash.no_update
+    message = f"Could not look up {', '.join(missing)}" if missing else ""
+    if selected == cities:
+        if not missing:
+            raise PreventUpdate
+        return dash.no_update, dash.no_update, value, message
+    if selected[:len(cities)] == cities:
+        figure = Patch()
+        for trace in city_traces(selected[len(cities):], scenario, aggregation, view):
+            figure["data"].append(trace)
+    elif len(selected) == len(cities) - 1 and all(city in cities for city in selected):
+        figure = Patch()
+        removed = next(k for k, city in enumerate(cities) if city not in selected)
+        del figure["data"][removed]
+    else:
+        figure = temperature_figure(selected, scenario, aggregation, view)
+    return figure, selected, value, message
+
+
+@app.callback(
+    Output("city-select", "value"),
+    [Input("clear-cities", "n_clicks")],
+    prevent_initial_call=True,
+)
+def clear_cities(n_clicks):
+    return []
+
+
+def year_index(scenario, year):
+    # first time step of a year
+    years = np.array([d.year for d in get_store(scenario).dates])
+    return int(min(np.searchsorted(years, year), len(years) - 1))
+
+
+@app.callback(
+    Output("temp-map", "figure"),
+    [Input("scenario", "value"), Input("map-field", "value"), Input("map-year", "value")],
+)
+def update_map(scenario, field, year):
+
+    # the map is a raster layer of tiles from /tiles: panning and zooming
+    # only fetch tiles, and uirevision keeps the view when the layer changes
+    time = 0 if field == "trend" else year_index(scenario, year)
+    url = app.get_relative_path(f"/tiles/{scenario}/{field}/{time}/") + "{z}/{x}/{y}.png"
+    vmin, vmax, _ = FIELDS[field]
+    return {
+        "data": [{"type": "scattermapbox", "lon": [], "lat": []}],
+        "layout": {
+            "title": {"text": f"{MAP_FIELDS[field]}, {SCENARIOS[scenario]}"
+                              + ("" if field == "trend" else f", {year}")
+                              + f" [{vmin:g} to {vmax:g}]"},
+            "mapbox": {
+                "style": "white-bg",
+                "center": {"lon": 0, "lat": 20},
+                "zoom": 0.5,
+                "layers": [{"sourcetype": "raster", "source": [url], "below": "traces"}],
+            },
+            "margin": {"l": 0, "r": 0, "t": 40, "b": 0},
+            "uirevision": "map",
+        },
+    }
 
 
 if __name__ == "__main__":
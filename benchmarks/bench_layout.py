@@ -0,0 +1,65 @@
+'''
+Map and point-query latency of a NetCDF file before and after optimize_layout,
+without and with compression.
+
+    python benchmarks/bench_layout.py hadgem3_gc31_ll_ssp5_8_5_data.nc
+
+A map query reads one time step of ts; a point query reads the full series of
+one grid cell. Each query opens the file afresh so the netCDF chunk cache does
+not carry over between queries (the OS page cache still does).
+'''
+
+import os
+import sys
+import time
+import numpy as np
+import netCDF4 as netcdf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from optimize_layout import optimize_layout
+
+
+def time_queries(data_fn, queries, variable='ts'):
+    '''Median latency in ms of each query kind'''
+    results = {}
+    for kind, index_list in queries.items():
+        latencies = []
+        for index in index_list:
+            t0 = time.perf_counter()
+            with netcdf.Dataset(data_fn, mode='r') as ncset:
+                ncset[variable][index]
+            latencies.append(1000*(time.perf_counter() - t0))
+        results[kind] = np.median(latencies)
+    return results
+
+
+def main(src_fn, n=50, seed=0, complevels=(None, 4)):
+    with netcdf.Dataset(src_fn, mode='r') as ncset:
+        nt, nlat, nlon = ncset['ts'].shape
+        chunks, zlib = ncset['ts'].chunking(), ncset['ts'].filters().get('zlib')
+    print(f'source: chunks {chunks}, {"zlib" if zlib else "uncompressed"}')
+
+    rng = np.random.default_rng(seed)
+    queries = {
+        'map': [(int(k), slice(None), slice(None)) for k in rng.integers(0, nt, n)],
+        'point': [(slice(None), int(i), int(j)) for i, j in zip(rng.integers(0, nlat, n), rng.integers(0, nlon, n))],
+    }
+    # a first pass warms the page cache, so every layout is timed alike
+    time_queries(src_fn, queries)
+    before = time_queries(src_fn, queries)
+
+    for complevel in complevels:
+        dst_fn = os.path.splitext(src_fn)[0] + '_optimized.nc'
+        t0 = time.perf_counter()
+        optimize_layout(src_fn, dst_fn, complevel=complevel)
+        print(f'optimize_layout(complevel={complevel}): {time.perf_counter() - t0:.1f} s, '
+              f'{os.path.getsize(src_fn)/1e6:.0f} MB -> {os.path.getsize(dst_fn)/1e6:.0f} MB')
+        time_queries(dst_fn, queries)
+        after = time_queries(dst_fn, queries)
+        for kind in queries:
+            print(f'{kind:>6} query: {before[kind]:8.2f} ms -> {after[kind]:8.2f} ms')
+        os.remove(dst_fn)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,56 @@
+'''
+Time to compute and render the 4x3 monthly-trends panel, with the original
+per-panel xarray plots and with plots.plot_monthly_trends.
+
+    python benchmarks/bench_monthly_trends.py hadgem3_gc31_ll_ssp5_8_5_data.nc
+
+Each run builds the figure and draws it once on the Agg canvas, so both the
+data reads and the rendering are counted.
+'''
+
+import os
+import sys
+import time
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from load_data import load_data
+from plots import plot_monthly_trends, MONTHS
+
+
+def legacy_monthly_trends(ds):
+    '''the 12 panels as they were drawn before: one difference, plot and colorbar each'''
+    fig, axes = plt.subplots(4, 3, figsize=(19, 15))
+    fig.subplots_adjust(hspace=0.3, wspace=0.1)
+    for i, ax in enumerate(axes.flat):
+        (ds.ts.isel(time=i+40*12)-ds.ts.isel(time=i)).plot(ax=ax, vmin=-3, vmax=3, extend='both', zorder=-3)
+        ax.set_title(MONTHS[i])
+    return fig
+
+
+def time_render(make_figure, repeat):
+    '''Median time in ms to build and draw a figure'''
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fig = make_figure()
+        fig.canvas.draw()
+        latencies.append(1000*(time.perf_counter() - t0))
+        plt.close(fig)
+    return np.median(latencies)
+
+
+def main(data_fn, repeat=5):
+    with load_data(data_fn) as data:
+        ds = data.ds
+        datevar = data.datevar
+        before = time_render(lambda: legacy_monthly_trends(ds), repeat)
+        after = time_render(lambda: plot_monthly_trends(ds, datevar), repeat)
+    print(f'monthly trends panel: {before:8.1f} ms -> {after:8.1f} ms')
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,141 @@
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class LRUCache:
+    '''In-process least-recently-used cache with an optional time-to-live in seconds'''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                created, value = self._data[key]
+            except KeyError:
+                return default
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteStore:
+    '''
+    Persistent key/value store in a SQLite file, shared between processes.
+    Values are stored as JSON. Entries older than ttl seconds are treated as
+    missing, and the least recently used entries are evicted beyond max_entries.
+    '''
+
+    def __init__(self, path, table='cache', ttl=None, max_entries=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        with self._connect() as con:
+            con.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                        '(key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)')
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def get(self, key, allow_stale=False):
+        '''Stored value for key, or None. allow_stale also returns expired entries.'''
+        with self._connect() as con:
+            row = con.execute(f'SELECT value, created FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if not allow_stale and self.ttl is not None and time.time() - created > self.ttl:
+                return None
+            con.execute(f'UPDATE {self.table} SET accessed = ? WHERE key = ?', (time.time(), key))
+        return json.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connect() as con:
+            con.execute(f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)',
+                        (key, json.dumps(value), now, now))
+            if self.max_entries is not None:
+                con.execute(f'DELETE FROM {self.table} WHERE key IN '
+                            f'(SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                            (self.max_entries,))
+
+    def clear(self):
+        with self._connect() as con:
+            con.execute(f'DELETE FROM {self.table}')
+
+
+def file_fingerprint(fn):
+    '''Size and modification time of a file, to invalidate cache entries derived from it'''
+    stat = os.stat(fn)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def memoize(maxsize=256, ttl=None, disk_path=None, key=None):
+
+    '''
+    Decorator caching a function's JSON-serializable results in an in-process
+    LRUCache and, if disk_path is given, in a SqliteStore shared by every
+    process using that file (e.g. gunicorn workers).
+    key: function of the call arguments returning the (JSON-serializable) cache key
+    '''
+
+    def decorator(fn):
+        memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        store = SqliteStore(disk_path, table=fn.__name__, ttl=ttl) if disk_path else None
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            k = json.dumps(key(*args) if key is not None else args)
+            value = memory.get(k)
+            if value is None and store is not None:
+                value = store.get(k)
+                if value is not None:
+                    memory.set(k, value)
+            if value is None:
+                value = fn(*args)
+                memory.set(k, value)
+                if store is not None:
+                    store.set(k, value)
+            return value
+
+        def cache_clear():
+            memory.clear()
+            if store is not None:
+                store.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
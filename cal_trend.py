@@ -1,56 +1,277 @@
-def cal_trend(start_year, num_years, start_month, num_months, nx, ny, var):
+import os
+import sys
+from multiprocessing import Pool, resource_tracker, shared_memory
+from multiprocessing.util import Finalize
+import numpy as np
+import scipy.stats as stats
+from load_data import read_nan
 
-    import numpy as np
-    import scipy.stats as stats
+
+# default working-memory budget for tiled trend computation, in bytes
+TILE_BUDGET = 256 * 1024**2
+
+
+def linregress_nd(x, y):
+
+    '''
+    Least-squares fit of y against x along the first axis of y, for every
+    remaining index at once. Closed-form equivalent of scipy.stats.linregress.
+    x: 1D array of length n
+    y: array of shape (n, ...)
+    returns
+            ---> slope, intercept, r, prob, stderr, each of shape y.shape[1:]
+    '''
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = x.shape[0]
+    df = n - 2
+
+    xmean = x.mean()
+    ymean = y.mean(axis=0)
+    xd = (x - xmean).reshape((n,) + (1,) * (y.ndim - 1))
+    yd = y - ymean
+
+    ssxm = np.sum(xd * xd)
+    ssym = np.sum(yd * yd, axis=0)
+    ssxym = np.sum(xd * yd, axis=0)
+
+    # constant series have r = 0, as in linregress
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = ssxym / np.sqrt(ssxm * ssym)
+    r = np.where(ssym == 0.0, 0.0, r)
+    r = np.clip(r, -1.0, 1.0)
+
+    slope = ssxym / ssxm
+    intercept = ymean - slope * xmean
+
+    # two-sided p-value for a slope of zero, with linregress's TINY guard
+    TINY = 1.0e-20
+    t = r * np.sqrt(df / ((1.0 - r + TINY) * (1.0 + r + TINY)))
+    prob = 2 * stats.t.sf(np.abs(t), df)
+    stderr = np.sqrt((1 - r**2) * ssym / ssxm / df)
+
+    return slope, intercept, r, prob, stderr
+
+
+def _trend_maps(var, num_years, num_months):
+    '''Trend maps for a (year, month, lat, lon) block already cut to the years of interest'''
+
+    years = np.arange(num_years)
+
+    # Monthly averaged: all months and grid cells in one pass
+    slope, intercept, r, prob, stderr = linregress_nd(years, var[:, :num_months])
+    trend_ym = slope
+    sig_a_ym = 100*(1-prob)
+    r_a_ym = r
+    int_a_ym = intercept
+
+    # Yearly averaged
+    var_y = np.mean(var, 1)
+    slope, intercept, r, prob, stderr = linregress_nd(years, var_y)
+    trend = slope
+    sig_a = 100*(1-prob)
+    r_a = r
+    int_a = intercept
+
+    return trend, trend_ym, sig_a, sig_a_ym, r_a, r_a_ym, int_a, int_a_ym
+
+
+def cal_trend(start_year, num_years, start_month, num_months, nx, ny, var, processes=1, tile_budget=TILE_BUDGET):
 
     '''
     Function to calculate the spatial mean of one field and write the trends in .dat files
+    processes: number of worker processes fitting lat/lon tiles in parallel
+               (1 = serial, None = all cores)
     returns
             ---> trend_time[year]
             ---> trend_space[x,y]
     Similar code by Alek Petty
     '''
 
-    # Initialize
-    x = nx
-    y = ny
+    var = var[start_year:start_year+num_years, :, :nx, :ny]
 
     ##################
     # Maps of trends
     ##################
 
-    # Monthly averaged
-    num_years
-    years = np.arange(num_years)
-    trend_ym = np.zeros((num_months, x, y))
-    sig_a_ym = np.zeros((num_months, x, y))
-    r_a_ym = np.zeros((num_months, x, y))
-    int_a_ym = np.zeros((num_months, x, y))
-
-    for month in range(num_months):
-            print (month)
-            var_y = np.mean(var,1)
-            for i in range(x):
-                    for j in range(y):
-                            slope, intercept, r, prob, stderr = stats.linregress(years,var[start_year:start_year+num_years, month, i, j])
-                            trend_ym[month, i, j] = slope
-                            sig_a_ym[month, i, j] = 100*(1-prob)
-                            r_a_ym[month, i, j] = r
-                            int_a_ym[month, i, j] = intercept
+    if processes == 1:
+        return _trend_maps(var, num_years, num_months)
+    return _trend_maps_parallel(var, num_years, num_months, processes, tile_budget)
 
-    # Yearly averaged
-    years = np.arange(num_years)
-    trend = np.zeros((x, y))
-    sig_a = np.zeros((x, y))
-    r_a = np.zeros((x, y))
-    int_a = np.zeros((x, y))
-
-    for i in range(x):
-            for j in range(y):
-                    slope, intercept, r, prob, stderr = stats.linregress(years,var_y[start_year:start_year+num_years, i, j])
-                    trend[i, j] = slope
-                    sig_a[i, j] = 100*(1-prob)
-                    r_a[i, j] = r
-                    int_a[i, j] = intercept
+
+def tile_shape(nt, nx, ny, tile_budget=TILE_BUDGET):
+    '''
+    Largest (lat, lon) tile whose full time series fits in tile_budget bytes,
+    allowing for the float64 temporaries of linregress_nd. Whole rows are
+    preferred since they are contiguous in the (time, lat, lon) file layout.
+    '''
+    cells = max(1, tile_budget // (nt * 8 * 4))
+    if cells >= ny:
+        return (min(nx, cells // ny), ny)
+    return (1, cells)
+
+
+def iter_tiles(nx, ny, shape):
+    '''Yield (lat, lon) slice pairs covering an nx by ny grid in tiles of the given shape'''
+    tx, ty = shape
+    for i in range(0, nx, tx):
+        for j in range(0, ny, ty):
+            yield slice(i, min(i + tx, nx)), slice(j, min(j + ty, ny))
+
+
+def cal_trend_tiled(data_fn, start_year, num_years, start_month, num_months, tile_budget=TILE_BUDGET, variable='ts'):
+
+    '''
+    Same maps as cal_trend, but streams lat/lon tiles of monthly data from the
+    NetCDF file instead of needing the whole variable in memory.
+    Peak memory is bounded by tile_budget (bytes) rather than the grid size.
+    Cells with fill values come out as NaN.
+    returns
+            ---> trend, trend_ym, sig_a, sig_a_ym, r_a, r_a_ym, int_a, int_a_ym
+    '''
+
+    import netCDF4 as netcdf
+
+    with netcdf.Dataset(data_fn, mode='r') as ncset:
+        var = ncset[variable]
+        nt, nx, ny = var.shape
+        months_per_year = 12
+        t0 = start_year*months_per_year
+        t1 = (start_year+num_years)*months_per_year
+
+        trend = np.empty((nx, ny))
+        sig_a = np.empty((nx, ny))
+        r_a = np.empty((nx, ny))
+        int_a = np.empty((nx, ny))
+        trend_ym = np.empty((num_months, nx, ny))
+        sig_a_ym = np.empty((num_months, nx, ny))
+        r_a_ym = np.empty((num_months, nx, ny))
+        int_a_ym = np.empty((num_months, nx, ny))
+
+        for si, sj in iter_tiles(nx, ny, tile_shape(t1 - t0, nx, ny, tile_budget)):
+            tile = read_nan(var, (slice(t0, t1), si, sj))
+            tile = tile.reshape((num_years, months_per_year) + tile.shape[1:])
+            out = _trend_maps(tile, num_years, num_months)
+            trend[si, sj], trend_ym[:, si, sj], sig_a[si, sj], sig_a_ym[:, si, sj], \
+                r_a[si, sj], r_a_ym[:, si, sj], int_a[si, sj], int_a_ym[:, si, sj] = out
+
+    return trend, trend_ym, sig_a, sig_a_ym, r_a, r_a_ym, int_a, int_a_ym
+
+
+def cal_rate_tiled(data_fn, scale=120.0, tile_budget=TILE_BUDGET, variable='ts'):
+
+    '''
+    Linear trend of every grid cell against time step, streamed in lat/lon tiles.
+    Works for any time resolution (no reshape into years and months).
+    scale: time steps per output unit, e.g. 120 months for K/decade
+    returns
+            ---> rate[lat, lon]
+    '''
+
+    import netCDF4 as netcdf
+
+    with netcdf.Dataset(data_fn, mode='r') as ncset:
+        var = ncset[variable]
+        nt, nx, ny = var.shape
+        steps = np.arange(1, nt+1)
+
+        rate = np.empty((nx, ny))
+        for si, sj in iter_tiles(nx, ny, tile_shape(nt, nx, ny, tile_budget)):
+            rate[si, sj] = linregress_nd(steps, read_nan(var, (slice(None), si, sj)))[0]*scale
+
+    return rate
+
+
+# shared (year, month, lat, lon) block seen by each worker process
+_shared_mem = None
+_shared_var = None
+
+
+def _attach_shared(name, shape, dtype):
+
+    '''
+    Pool initializer: map the parent's shared memory block without copying it.
+    Only the parent owns (and unlinks) the block: the worker attaches without
+    registering it with the resource tracker and closes its mapping when it exits.
+    '''
+
+    global _shared_mem, _shared_var
+    if sys.version_info >= (3, 13):
+        _shared_mem = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        # before Python 3.13 attaching always registers the block, and workers
+        # share the parent's tracker, so a later unregister would drop the
+        # parent's own entry: skip the registration instead. This runs in the
+        # worker's initializer, before any other thread of the worker exists
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            _shared_mem = shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+    _shared_var = np.ndarray(shape, dtype=dtype, buffer=_shared_mem.buf)
+    _shared_var.flags.writeable = False
+    Finalize(None, _detach_shared, exitpriority=10)
+
+
+def _detach_shared():
+    '''Release the worker's view and mapping of the shared block'''
+    global _shared_mem, _shared_var
+    _shared_var = None
+    if _shared_mem is not None:
+        _shared_mem.close()
+        _shared_mem = None
+
+
+def _fit_shared_tile(args):
+    si, sj, num_years, num_months = args
+    return si, sj, _trend_maps(_shared_var[:, :, si, sj], num_years, num_months)
+
+
+def _trend_maps_parallel(var, num_years, num_months, processes, tile_budget):
+
+    '''
+    _trend_maps over lat/lon tiles on a process pool. var is copied once into
+    shared memory, and workers read their tiles from it directly.
+    '''
+
+    if processes is None:
+        processes = os.cpu_count()
+    nx, ny = var.shape[2:]
+
+    # enough tiles to keep every worker busy, but within the memory budget.
+    # Tiles are whole rows: numpy then reduces every cell in the same order
+    # as the serial fit over the full grid, so the maps are bit-identical
+    tx, _ = tile_shape(num_years * var.shape[1], nx, ny, tile_budget)
+    tx = max(1, min(tx, -(-nx // (4 * processes))))
+    ty = ny
+
+    shm = shared_memory.SharedMemory(create=True, size=var.nbytes)
+    try:
+        shared = np.ndarray(var.shape, dtype=var.dtype, buffer=shm.buf)
+        shared[:] = var
+
+        trend = np.empty((nx, ny))
+        sig_a = np.empty((nx, ny))
+        r_a = np.empty((nx, ny))
+        int_a = np.empty((nx, ny))
+        trend_ym = np.empty((num_months, nx, ny))
+        sig_a_ym = np.empty((num_months, nx, ny))
+        r_a_ym = np.empty((num_months, nx, ny))
+        int_a_ym = np.empty((num_months, nx, ny))
+
+        tasks = [(si, sj, num_years, num_months) for si, sj in iter_tiles(nx, ny, (tx, ty))]
+        with Pool(processes, initializer=_attach_shared, initargs=(shm.name, var.shape, var.dtype)) as pool:
+            for si, sj, out in pool.imap_unordered(_fit_shared_tile, tasks):
+                trend[si, sj], trend_ym[:, si, sj], sig_a[si, sj], sig_a_ym[:, si, sj], \
+                    r_a[si, sj], r_a_ym[:, si, sj], int_a[si, sj], int_a_ym[:, si, sj] = out
+            # let the workers exit normally (rather than be terminated) so they detach
+            pool.close()
+            pool.join()
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
 
     return trend, trend_ym, sig_a, sig_a_ym, r_a, r_a_ym, int_a, int_a_ym
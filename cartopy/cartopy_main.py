@@ -9,7 +9,6 @@ Key analysis is performed on the SSP5-8.5 data with a brief comparison with SSP1
 
 # Import required libraries
 
-from netCDF4 import Dataset as netcdf
 from scipy import signal
 from pylab import *
 import numpy as np
@@ -33,7 +32,12 @@ import xarray as xr
 from retrieve_data import retrieve_data
 from math import floor, ceil
 from plots import all_data_plate_carree, all_data_rotated_pole, multiple_projections, diff_between_dates, plot_monthly_trends, plot_average_diff
-from cal_trend import cal_trend
+from cal_trend import cal_trend, cal_trend_tiled, cal_rate_tiled, TILE_BUDGET
+from load_data import celsius, load_data
+from products import get_product
+from regrid import regrid
+from regions import regional_means_file, subset, time_slice
+from lod import decimal_years
 
 
 
@@ -52,44 +56,26 @@ DATE = '2015-01-01/2099-12-31'
 
 # retrieve data
 data_fn = retrieve_data(TEMP_RES, EXPERIMENT, VARIABLE, MODEL, DATE)
-ncset = netcdf(data_fn, mode='r')
+climate = load_data(data_fn)
 
 
 # check which variables are in the netcdf file
-print(ncset.variables)
-ncset.set_auto_mask(False)
+print(climate.ncset.variables)
 
 
-# read variables
-lon = ncset['lon'][:]
-lat = ncset['lat'][:]
-t = ncset['time'][:]
-ts = ncset['ts'][:]
-nctime = ncset.variables['time'][:]
-t_unit = ncset.variables['time'].units
-ncset.close()
-
-try:
-    t_cal = ncset.variables['time'].calendar
-    t_cal = nctime.calendar
-except AttributeError:
-    t_cal = u"360_day"
-
-datevar = cftime.num2date(nctime, units=t_unit, calendar=t_cal)
-
-
-# lon lat on a grid
-[lon, lat] = np.meshgrid(lon, lat)
+# read variables: ts stays on disk and is read slice by slice when indexed
+ts = climate.ts_var
+datevar = climate.datevar
 
 # print first and last dates, for later reference
 print(datevar[0])
 print(datevar[-1])
 
-# load data
-ds = xr.open_dataset(data_fn)
+# load data (shares the file handle opened above)
+ds = climate.ds
 lat = ds.lat
 lon = ds.lon
-ds_y = ds.groupby('time.year').mean(dim='time')
+ds_y = climate.annual
 
 
 
@@ -135,37 +121,19 @@ ax2.set_title('Temperature standard deviation 2015-2099')
 
 # Plotting trend maps with significance using hatchingg
 
-# Putting the data in the right format for the cal_trend function:
+# Trend maps computed tile by tile straight from the file:
 start_year=2015-2015
 num_years=85
 start_month=0
 num_months=12
 
-ts_ym=ts.reshape(num_years,num_months,144,192)
-
-nx=ts_ym.shape[2]
-ny=ts_ym.shape[3]
-ts_trend, ts_trend_ym, ts_sig_a, ts_sig_a_ym, ts_r_a, ts_r_a_ym, ts_int_a, int_a_ym = cal_trend(start_year, num_years, start_month, num_months, nx, ny, ts_ym)
+ts_trend, ts_trend_ym, ts_sig_a, ts_sig_a_ym, ts_r_a, ts_r_a_ym, ts_int_a, int_a_ym = cal_trend_tiled(data_fn, start_year, num_years, start_month, num_months, tile_budget=TILE_BUDGET)
 
 
-# Faster way to calculate trends but does not provide significance (i.e. p-value):
+# Faster way to calculate trends but does not provide significance (i.e. p-value).
+# The file is streamed in lat/lon tiles so memory stays within TILE_BUDGET:
 
-nt, nlat, nlon = ts.shape
-ngrd = nlon*nlat
-
-#Linear trend calculation
-ts_grd  = ts.reshape((nt, ngrd), order='F')
-x       = np.linspace(1,nt,nt)
-ts_rate = np.empty((ngrd,1))
-ts_rate[:,:] = np.nan
-
-for i in range(ngrd):
-    y = ts_grd[:,i]
-    if(not np.ma.is_masked(y)):
-        z = np.polyfit(x, y, 1)
-        ts_rate[i,0] = z[0]*120.0
-
-ts_rate = ts_rate.reshape((nlat,nlon), order='F')
+ts_rate = cal_rate_tiled(data_fn, scale=120.0, tile_budget=TILE_BUDGET)
 
 
 # Plot the trends directly from the newly created numpy.array:
@@ -263,26 +231,18 @@ plt.colorbar(ax=ax,shrink=0.4)
 # Subset and plot data for the sea around Iceland. This area was chosen as it is the only area of the world that is predicted by the model to become slightly cooler over the examined time period.
 
 
-# Get indices of time, lat and lon over the area
-years = np.array([idx.year for idx in datevar])
-
-idx_lat_region  = (lat>=-90) * (lat<=90.0)
-idx_lon_region  = (lon>=0) * (lon<=360)
-idx_tim_region = (years>=2015) * (years<=2099)
-# time: 2015-2099
+# Cut the box around Iceland (regions.REGIONS['iceland'], 40-80N, 40W-20E) for 2015-2099
+# in one indexing step: only the box is read from disk, with no intermediate copies
 
-lat_region = lat[idx_lat_region]
-lon_region = lon[idx_lon_region]
-dates_region  = datevar[idx_tim_region]
-
-
-
-# Mask the original arrays (ts) and create a new smaller array (ts_region):
-
-ts_region = ts[idx_tim_region, :, :][:, idx_lat_region, :][:, :, idx_lon_region]
+tim_region = time_slice(datevar, 2015, 2099)
+lon_region, lat_region, ts_region = subset(ts, lon, lat, 'iceland', tim_region)
+dates_region = datevar[tim_region]
 print(ts_region.shape)
 print(dates_region.shape)
 
+# area-weighted (cos lat) mean series (degC) of the box and of the globe, in one pass over the file
+region_ts = regional_means_file(data_fn, ['iceland', 'global'])
+
 
 # plot subsetted region
 
@@ -298,6 +258,11 @@ ax.set_extent([lon1, lon2, lat1, lat2], crs=ccrs.PlateCarree())
 plt.colorbar(ax=ax,shrink=0.4)
 plt.title('Surface Temperature of North Atlantic/Arctic Ocean around Iceland (K)')
 
+plt.figure()
+plt.plot(decimal_years(datevar), region_ts)
+plt.legend(['iceland', 'global'], loc='lower right')
+plt.title('SSP5_8.5 area-weighted mean temperature, Iceland box and globe (degC)')
+
 
 ### 8) Analysing timeseries near selected cities, localities etc
 
@@ -305,39 +270,36 @@ plt.title('Surface Temperature of North Atlantic/Arctic Ocean around Iceland (K)
 
 #https://github.com/geopy/geopy
 #https://developers.google.com/maps/documentation/geocoding/overview
-from geopy.geocoders import Nominatim
-geolocator = Nominatim(user_agent="Google Geocoding API (V3)")
-location = geolocator.geocode("London")
-print(location.address)
-print(geolocator.geocode("London").longitude,geolocator.geocode("London").latitude)
+# get_coords caches lookups in memory and on disk, so each city is geocoded once
+from get_coords import get_coords, get_coords_batch
+from grid_index import GridIndex
+print(get_coords("London"))
 
 
 # Get coords of cities
 location_1 = "Jerusalem"
 location_2 = "Cincinnati"
 location_3 = "Stockholm"
-lon1,lat1=geolocator.geocode(location_1).longitude,geolocator.geocode(location_1).latitude
-lon2,lat2=geolocator.geocode(location_2).longitude,geolocator.geocode(location_2).latitude
-lon3,lat3=geolocator.geocode(location_3).longitude,geolocator.geocode(location_3).latitude
+# every analysis below reads all cities with one pointwise selection
+cities = [location_1, location_2, location_3]
+lon_cities, lat_cities = get_coords_batch(cities)
+grid = GridIndex.from_dataset(ds)
+
+
+def select_cities(da):
+    return grid.select(da, lon_cities, lat_cities, dim='city', labels=cities)
 
 
 # Get data for coords and plot
-(ds.ts.sel(lon=lon1, lat=lat1, method = 'nearest')-273.15).plot(x="time")
-(ds.ts.sel(lon=lon2, lat=lat2, method = 'nearest')-273.15).plot(x="time")
-(ds.ts.sel(lon=lon3, lat=lat3, method = 'nearest')-273.15).plot(x="time")
+celsius(select_cities(ds.ts)).plot.line(x="time", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.legend(labels,loc='lower right')
 plt.title('Compare SSP5_8.5 temperature record for ' + labels[0] +', '+ labels[1]+ ', and ' +labels[2])
 
 
-# plot temperature anomaly data for selected cities
-def remove_time_mean(x):
-    return x - x.mean(dim='time')
-
-monthly_annual_anom = ds.ts.groupby('time.month').apply(remove_time_mean)
-monthly_annual_anom.sel(lon=lon1, lat=lat1, method = 'nearest').plot.line(x="time")
-monthly_annual_anom.sel(lon=lon2, lat=lat2, method = 'nearest').plot.line(x="time")
-monthly_annual_anom.sel(lon=lon3, lat=lat3, method = 'nearest').plot.line(x="time")
+# plot temperature anomaly data for selected cities (anomaly cube computed once and cached)
+monthly_annual_anom = climate.product('anomaly')
+select_cities(monthly_annual_anom).plot.line(x="time", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.legend(labels,loc='lower right')
 plt.title('Compare SSP5_8.5 temperature anomaly record for ' + labels[0] +', '+ labels[1]+ ', and ' +labels[2])
@@ -347,10 +309,8 @@ plt.title('Compare SSP5_8.5 temperature anomaly record for ' + labels[0] +', '+
 
 
 # timeseries for yearly averages
-year_annual = (ds['ts']-273.15).groupby('time.year').mean(dim='time')
-year_annual.sel(lon=lon1, lat=lat1, method = 'nearest').plot.line(x="year")
-year_annual.sel(lon=lon2, lat=lat2, method = 'nearest').plot.line(x="year")
-year_annual.sel(lon=lon3, lat=lat3, method = 'nearest').plot.line(x="year")
+year_annual = celsius(climate.product('annual'))
+select_cities(year_annual).plot.line(x="year", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.legend(labels,loc='lower right')
 plt.title('Yearly trends for ' + labels[0] +', '+ labels[1]+ ', and ' +labels[2])
@@ -362,9 +322,7 @@ plt.title('Yearly trends for ' + labels[0] +', '+ labels[1]+ ', and ' +labels[2]
 # timeseries for a given month
 month=8 #9:September
 month_name = 'September'
-(ds.ts.sel(lon=lon1, lat=lat1,time=ds['time.month']==month, method = 'nearest')-273.15).plot.line(x="time")
-(ds.ts.sel(lon=lon2, lat=lat2,time=ds['time.month']==month, method = 'nearest')-273.15).plot.line(x="time")
-(ds.ts.sel(lon=lon3, lat=lat3,time=ds['time.month']==month, method = 'nearest')-273.15).plot.line(x="time")
+celsius(select_cities(ds.ts.sel(time=ds['time.month']==month))).plot.line(x="time", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.legend(labels,loc='lower right')
 plt.title(month_name + ' trends for ' + labels[0] +', '+ labels[1]+ ', and ' +labels[2])
@@ -375,10 +333,8 @@ plt.title(month_name + ' trends for ' + labels[0] +', '+ labels[1]+ ', and ' +la
 
 # timeseries for a given season
 season_str='JJA' #('DJF','MAM','JJA','SON')
-season_annual = ds['ts'].where(ds['ts']['time.season'] == season_str).groupby('time.year').mean(dim='time')
-season_annual.sel(lon=lon1, lat=lat1, method = 'nearest').plot.line(x="year")
-season_annual.sel(lon=lon2, lat=lat2, method = 'nearest').plot.line(x="year")
-season_annual.sel(lon=lon3, lat=lat3, method = 'nearest').plot.line(x="year")
+season_annual = climate.product('seasonal', season=season_str)
+select_cities(season_annual).plot.line(x="year", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.legend(labels,loc='lower right')
 plt.title('Compare seasonal trends ('+ season_str+')')
@@ -397,19 +353,15 @@ fig.subplots_adjust(hspace=0.1, wspace=0.1)
 ylimits = (5, 30)
 
 ax1 = fig.add_subplot(121, ylim = ylimits)
-year_annual126 = (ds['ts']-273.15).groupby('time.year').mean(dim='time')
-year_annual126.sel(lon=lon1, lat=lat1, method = 'nearest').plot.line(ax = ax1, x="year")
-year_annual126.sel(lon=lon2, lat=lat2, method = 'nearest').plot.line(ax = ax1, x="year")
-year_annual126.sel(lon=lon3, lat=lat3, method = 'nearest').plot.line(ax = ax1, x="year")
+year_annual126 = celsius(climate.product('annual'))
+select_cities(year_annual126).plot.line(ax = ax1, x="year", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.title('SSP5_8.5 Yearly Trends')
 plt.legend(labels,loc='lower right')
 
 ax2 = fig.add_subplot(122, ylim = ylimits)
-year_annual = (ds126['ts']-273.15).groupby('time.year').mean(dim='time')
-year_annual.sel(lon=lon1, lat=lat1, method = 'nearest').plot.line(ax = ax2, x="year")
-year_annual.sel(lon=lon2, lat=lat2, method = 'nearest').plot.line(ax = ax2, x="year")
-year_annual.sel(lon=lon3, lat=lat3, method = 'nearest').plot.line(ax = ax2, x="year")
+year_annual = celsius(get_product(ds126, 'annual'))
+select_cities(year_annual).plot.line(ax = ax2, x="year", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.title('SSP1_2.6 Yearly Trends')
 
@@ -423,14 +375,16 @@ num_years=85
 start_month=0
 num_months=12
 
-ts126_ym=ts126.reshape(num_years,num_months,144,192)
+ts126_ym=ts126.reshape((num_years,num_months)+ts126.shape[1:])
 
 nx126=ts126_ym.shape[2]
 ny126=ts126_ym.shape[3]
 ts126_trend, ts126_trend_ym, ts126_sig_a, ts126_sig_a_ym, ts126_r_a, ts126_r_a_ym, ts126_int_a, int126_a_ym = cal_trend(start_year, num_years, start_month, num_months, nx126, ny126, ts126_ym)
 
-data126=ts126_trend
-ds126_trend = xr.DataArray(data126, coords=[ds126.lat,ds126.lon], dims=["longitude","latitude"])
+# put the SSP1_2.6 trend on the SSP5_8.5 grid so the two maps compare cell by cell
+# (the weights are built once per pair of grids and reused from disk)
+data126=regrid(ts126_trend, ds126.lon.values, ds126.lat.values, ds.lon.values, ds.lat.values, method='conservative')
+ds126_trend = xr.DataArray(data126, coords=[ds.lat,ds.lon], dims=["longitude","latitude"])
 
 
 # plot trend in global temperature change as predicted by SSP5_8.5 and SSP1_2.6
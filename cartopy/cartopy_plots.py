@@ -1,14 +1,112 @@
 from matplotlib import pyplot as plt
 import cartopy.crs as ccrs
+import hashlib
+import numpy as np
 from math import floor, ceil
+from plots import monthly_differences, plot_month_grid
+
+
+# projected grids and coastlines, reused by every map drawn in this process
+_grids = {}
+_coastlines = {}
+
+
+def _crs_key(crs):
+    return crs.proj4_init
+
+
+def projected_grid(lon, lat, projection, extent=None):
+
+    '''
+    Cell centres of a lon/lat grid in the coordinates of a projection, transformed
+    once per (grid, projection, extent) and then served from memory.
+    extent: optional (lon0, lon1, lat0, lat1) to keep only the cells inside it
+    returns
+            ---> x, y: (lat, lon) arrays of projected coordinates, or lon/lat
+                 if some cells fall outside the projection or the projected
+                 rows are cut by a seam
+            ---> index: indexes the (lat, lon) data matching x and y
+            ---> projected: whether x and y are projected coordinates
+    '''
+
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    grid = hashlib.sha1(lon.tobytes() + lat.tobytes()).hexdigest()
+    key = (grid, _crs_key(projection), tuple(extent) if extent is not None else None)
+    if key not in _grids:
+        # columns ordered -180..180, so projected x does not jump back
+        # in the middle of the grid
+        lon180 = (lon + 180.0) % 360.0 - 180.0
+        jj = np.argsort(lon180, kind='stable')
+        ii = np.arange(len(lat))
+        if extent is not None:
+            lon0, lon1, lat0, lat1 = extent
+            jj = jj[(lon180[jj] >= min(lon0, lon1)) & (lon180[jj] <= max(lon0, lon1))]
+            ii = ii[(lat >= min(lat0, lat1)) & (lat <= max(lat0, lat1))]
+        lon2d, lat2d = np.meshgrid(lon180[jj], lat[ii])
+        xyz = projection.transform_points(ccrs.PlateCarree(), lon2d, lat2d)
+        x, y = xyz[..., 0], xyz[..., 1]
+        dx = np.diff(x, axis=1)
+        projected = bool(np.isfinite(x).all() and np.isfinite(y).all()
+                         and ((dx > 0).all() or (dx < 0).all()))
+        if not projected:
+            # part of the grid is outside the projection (e.g. the far side
+            # of an Orthographic globe), or a seam cuts the rows (e.g.
+            # RotatedPole): leave it to cartopy's own transform
+            x, y = lon2d, lat2d
+        _grids[key] = (x, y, np.ix_(ii, jj), projected)
+    return _grids[key]
+
+
+def projected_coastlines(projection, extent=None, resolution='110m'):
+
+    '''
+    Natural Earth coastlines projected once per (projection, extent, resolution).
+    extent: optional (lon0, lon1, lat0, lat1) to keep only the coastlines crossing it
+    '''
+
+    key = (_crs_key(projection), tuple(extent) if extent is not None else None, resolution)
+    if key not in _coastlines:
+        import cartopy.feature as cfeature
+
+        feature = cfeature.COASTLINE.with_scale(resolution)
+        geometries = feature.intersecting_geometries(extent) if extent is not None else feature.geometries()
+        _coastlines[key] = [projection.project_geometry(geometry, feature.crs) for geometry in geometries]
+    return _coastlines[key]
+
+
+def add_coastlines(ax, extent=None, resolution='110m', **kwargs):
+    '''ax.coastlines() from the projected coastline cache'''
+    kwargs.setdefault('edgecolor', 'black')
+    return ax.add_geometries(projected_coastlines(ax.projection, extent, resolution),
+                             crs=ax.projection, facecolor='none', **kwargs)
+
+
+def plot_field(ax, lon, lat, values, extent=None, method='pcolormesh', **kwargs):
+
+    '''
+    Draw a (lat, lon) field on a cartopy GeoAxes through the projected grid
+    cache, so only the first map of a projection pays for transforming the grid.
+    method: 'pcolormesh' or 'contourf'; contours are drawn on the lon/lat
+            grid and projected by cartopy, which cuts them at the seams
+    '''
+
+    if method == 'pcolormesh':
+        kwargs.setdefault('shading', 'auto')
+        x, y, index, projected = projected_grid(lon, lat, ax.projection, extent)
+    else:
+        x, y, index, projected = projected_grid(lon, lat, ccrs.PlateCarree(), extent)
+    values = np.asarray(values)[index]
+    transform = ax.projection if projected and method == 'pcolormesh' else ccrs.PlateCarree()
+    return getattr(ax, method)(x, y, values, transform=transform, **kwargs)
 
 
 def all_data_plate_carree(lon, lat, ts, title):
     ''' Plot data and coastlines on Plate Carree projection'''
     ax = plt.axes(projection=ccrs.PlateCarree())
     ax.set_global()
-    ax.coastlines()
-    ax.contourf(lon, lat, ts[0], vmin=250, vmax=290, zorder=-3)
+    add_coastlines(ax)
+    plot_field(ax, lon, lat, ts[0], method='contourf', vmin=250, vmax=290, zorder=-3)
     ax.set_title(title)
 
 def all_data_rotated_pole(lon, lat, ts, title):
@@ -16,8 +114,8 @@ def all_data_rotated_pole(lon, lat, ts, title):
     projection = ccrs.RotatedPole(pole_longitude=-177.5, pole_latitude=37.5)
     ax = plt.axes(projection=projection)
     ax.set_global()
-    ax.coastlines()
-    ax.contourf(lon,lat,ts[0],vmin=250,vmax=290, transform=ccrs.PlateCarree(), zorder = -3)
+    add_coastlines(ax)
+    plot_field(ax, lon, lat, ts[0], method='contourf', vmin=250, vmax=290, zorder=-3)
     ax.set_title('Global Temperature - Rotated Pole Projection')
 
 
@@ -31,10 +129,10 @@ def multiple_projections(projections, ds):
     for proj in projections:
         plt.figure()
         ax = plt.axes(projection=proj)
-        ax.coastlines()
+        add_coastlines(ax)
         ax.gridlines()
-        ts_test.plot(ax=ax, transform=ccrs.PlateCarree(),
-                vmin=250, vmax=290, cbar_kwargs={'shrink': 0.4}, zorder=-1)
+        mesh = plot_field(ax, ds.lon, ds.lat, ts_test, vmin=250, vmax=290, zorder=-1)
+        plt.colorbar(mesh, ax=ax, shrink=0.4, label=ts_test.attrs.get('units'))
         ax.set_title(f'{type(proj)}')
 
 def diff_between_dates(ds, datevar):
@@ -46,60 +144,47 @@ def diff_between_dates(ds, datevar):
         ts_test = ds.ts.sel(time=year, method='nearest')
         fig = plt.figure(figsize=(9,6))
         ax = plt.axes(projection=ccrs.Mercator())
-        ax.coastlines()
+        add_coastlines(ax)
         ax.gridlines()
-        ts_test.plot(ax=ax, transform=ccrs.PlateCarree(),
-                vmin=250, vmax=290, cbar_kwargs={'shrink': 0.4}, zorder=-3)
+        mesh = plot_field(ax, ds.lon, ds.lat, ts_test, vmin=250, vmax=290, zorder=-3)
+        plt.colorbar(mesh, ax=ax, shrink=0.4)
+        ax.set_title(str(year))
 
     ts_test_2 = ds.ts.sel(time=date_years[1], method='nearest')
     ts_test_1 = ds.ts.sel(time=date_years[0], method='nearest')
     fig = plt.figure(figsize=(9,6))
     ax = plt.axes(projection=ccrs.Mercator())
-    ax.coastlines()
+    add_coastlines(ax)
     ax.gridlines()
     ax.set_title('difference')
-    (ts_test_2-ts_test_1).plot(ax=ax, transform=ccrs.PlateCarree(),
-            vmin=-3, vmax=3, cbar_kwargs={'shrink': 0.4}, zorder=-3)
+    mesh = plot_field(ax, ds.lon, ds.lat, ts_test_2-ts_test_1, vmin=-3, vmax=3, zorder=-3)
+    plt.colorbar(mesh, ax=ax, shrink=0.4)
     plt.title('difference: '+str(datevar[0])+' vs '+str(datevar[-1]))
 
 
-def plot_monthly_trends(ds, datevar):
-    '''plot monthly trends'''
+def plot_monthly_trends(ds, datevar, year_offset=40, start_year=0, projection=None):
+    '''plot monthly trends: change of each month over year_offset years, with coastlines'''
 
-    fig, (ax1, ax2, ax3, ax4) = plt.subplots(4, 3, figsize=(19, 15))
-    fig.subplots_adjust(hspace=0.3, wspace=0.1)
-    list_months=['January','February','March','April','May','June','July','August','September','October','November','December']
-
-    for i in range(3):
-        ax=ax1[i]
-        (ds.ts.isel(time=i+40*12)-ds.ts.isel(time=i)).plot(ax=ax,vmin=-3,vmax=3,extend='both', zorder=-3)
-        ax.set_title(list_months[i])
-
-    for i in range(3):
-        ax=ax2[i]
-        (ds.ts.isel(time=i+3+40*12)-ds.ts.isel(time=i+3)).plot(ax=ax2[i],vmin=-3,vmax=3,extend='both', zorder=-3)
-        ax.set_title(list_months[i+3])
-
-    for i in range(3):
-        ax=ax3[i]
-        (ds.ts.isel(time=i+6+40*12)-ds.ts.isel(time=i+6)).plot(ax=ax,vmin=-3,vmax=3,extend='both', zorder=-3)
-        ax.set_title(list_months[i+6])
-
-    for i in range(3):
-        ax=ax4[i]
-        (ds.ts.isel(time=i+9+40*12)-ds.ts.isel(time=i+9)).plot(ax=ax4[i],vmin=-3,vmax=3,extend='both', zorder=-3)
-        ax.set_title(list_months[i+9])
-
-    fig.suptitle('Monthly trends: '+str(datevar[0])+' to '+str(datevar[-1]))
+    projection = projection or ccrs.PlateCarree()
+    diffs = monthly_differences(ds.ts, year_offset, start_year)
+    x, y, index, projected = projected_grid(ds.lon, ds.lat, projection)
+    fig, axes = plot_month_grid(diffs[(slice(None),) + index], x, y, label=ds.ts.attrs.get('units'),
+                                subplot_kw={'projection': projection},
+                                transform=projection if projected else ccrs.PlateCarree())
+    for ax in axes.flat:
+        add_coastlines(ax)
+    fig.suptitle('Monthly trends: '+str(datevar[start_year*12])+' to '+str(datevar[(start_year+year_offset)*12+11]))
+    return fig
 
 
 def plot_average_diff(ds_y):
     '''plot difference between average data for 2015 and 2099'''
     fig = plt.figure(figsize=(9,6))
     ax = plt.axes(projection=ccrs.Mercator())
-    ax.coastlines()
+    add_coastlines(ax)
     ax.gridlines()
-    (ds_y.ts.sel(year=2099)-ds_y.ts.sel(year=2015)).plot(ax=ax, zorder=-1, transform=ccrs.PlateCarree(), vmin=-3,vmax=3,extend='both', cbar_kwargs={'shrink': 0.4})
+    mesh = plot_field(ax, ds_y.lon, ds_y.lat, ds_y.ts.sel(year=2099)-ds_y.ts.sel(year=2015), zorder=-1, vmin=-3, vmax=3)
+    plt.colorbar(mesh, ax=ax, shrink=0.4, extend='both')
     plt.title('difference: 2015 vs 2099')
 
 
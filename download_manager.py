@@ -0,0 +1,259 @@
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks (e.g. Windows): concurrent runs of one request are not serialized
+    fcntl = None
+
+
+# local content-addressed store for downloaded datasets
+STORE_DIR = 'data_store'
+CHUNK_SIZE = 1024*1024
+
+DataRequest = namedtuple('DataRequest', ['temp_res', 'experiment', 'variable', 'model', 'date'])
+
+
+def request_matrix(models, experiments, variables=('surface_temperature',), dates=('2015-01-01/2099-12-31',), temp_res='monthly'):
+    '''Every (model, experiment, variable, date) combination as a list of DataRequests'''
+    return [DataRequest(temp_res, experiment, variable, model, date)
+            for model, experiment, variable, date in itertools.product(models, experiments, variables, dates)]
+
+
+def cds_request(req):
+    '''Request body for the 'projections-cmip6' dataset of the Climate Data Store'''
+    return {
+        'format': 'zip',
+        'temporal_resolution': req.temp_res,
+        'experiment': req.experiment,
+        'level': 'single_levels',
+        'variable': req.variable,
+        'model': req.model,
+        'date': req.date,
+    }
+
+
+def request_key(req):
+    return hashlib.sha256(json.dumps(cds_request(req), sort_keys=True).encode()).hexdigest()[:20]
+
+
+def _default_client():
+    import cdsapi
+    return cdsapi.Client()
+
+
+def _write_json(fn, obj):
+    tmp_fn = fn + '.tmp'
+    with open(tmp_fn, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_fn, fn)
+
+
+def _read_json(fn):
+    if not os.path.exists(fn):
+        return None
+    with open(fn) as f:
+        return json.load(f)
+
+
+def _download(url, part_fn, size=None):
+
+    '''
+    Download url into part_fn, resuming from whatever part_fn already holds.
+    Servers that ignore the Range header restart the download from the beginning.
+    Callers must hold the job lock, part_fn being shared by every run of a request.
+    '''
+
+    done = os.path.getsize(part_fn) if os.path.exists(part_fn) else 0
+    if size is not None and done == size:
+        return
+    headers = {'Range': f'bytes={done}-'} if done else {}
+    try:
+        with urlopen(Request(url, headers=headers)) as response:
+            resumed = done and getattr(response, 'status', None) == 206
+            with open(part_fn, 'ab' if resumed else 'wb') as f:
+                shutil.copyfileobj(response, f, CHUNK_SIZE)
+    except HTTPError as e:
+        # 416: nothing left past the end, the part file is already complete
+        if e.code != 416 or not done:
+            raise
+    if size is not None and os.path.getsize(part_fn) != size:
+        raise IOError(f'Incomplete download of {url}: {os.path.getsize(part_fn)} of {size} bytes')
+
+
+@contextmanager
+def _job_lock(lock_fn):
+
+    '''
+    Exclusive lock on a request, held across processes and threads while it is
+    fetched. The lock file lives next to the job directory, never inside it,
+    so removing a finished job cannot pull the lock from under a waiting run.
+    '''
+
+    with open(lock_fn, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def ingest_zip(zip_fn, store_dir, source=None):
+
+    '''
+    Stream the .nc member of a CDS zip straight into the content-addressed store.
+    The member is decompressed, checksummed and written in one sequential pass;
+    other members are never extracted. Each ingest appends a manifest entry.
+    A zip holding several .nc files (e.g. a record split in date ranges) is
+    refused rather than stored in part.
+    returns
+            ---> (sha256, path of the stored object)
+    '''
+
+    objects_dir = os.path.join(store_dir, 'objects')
+    os.makedirs(objects_dir, exist_ok=True)
+
+    with zipfile.ZipFile(zip_fn, 'r') as zip_ref:
+        members = [m for m in zip_ref.infolist() if m.filename.endswith('.nc')]
+        if not members:
+            raise ValueError(f'No NetCDF file in {zip_fn}')
+        if len(members) > 1:
+            raise ValueError(f'{len(members)} NetCDF files in {zip_fn}, expected one: '
+                             f'{[m.filename for m in members]}')
+        member = members[0]
+
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_fn = tempfile.mkstemp(suffix='.part', dir=objects_dir)
+        try:
+            with zip_ref.open(member) as src, os.fdopen(fd, 'wb') as dst:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    dst.write(chunk)
+                    size += len(chunk)
+            digest = sha.hexdigest()
+            object_fn = os.path.join(objects_dir, digest + '.nc')
+            os.replace(tmp_fn, object_fn)
+        except BaseException:
+            os.remove(tmp_fn)
+            raise
+
+    _append_manifest(store_dir, {
+        'sha256': digest, 'size': size, 'path': object_fn,
+        'member': member.filename, 'source': source, 'ingested': time.time()})
+    return digest, object_fn
+
+
+_manifest_lock = threading.Lock()
+
+
+def _append_manifest(store_dir, entry):
+    with _manifest_lock, open(os.path.join(store_dir, 'manifest.jsonl'), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def verify_store(store_dir=STORE_DIR):
+
+    '''
+    Re-hash every object listed in the manifest.
+    returns
+            ---> list of manifest entries whose file is missing or does not match
+    '''
+
+    bad = []
+    with open(os.path.join(store_dir, 'manifest.jsonl')) as f:
+        for line in f:
+            entry = json.loads(line)
+            sha = hashlib.sha256()
+            try:
+                with open(entry['path'], 'rb') as obj:
+                    for chunk in iter(lambda: obj.read(CHUNK_SIZE), b''):
+                        sha.update(chunk)
+            except FileNotFoundError:
+                bad.append(entry)
+                continue
+            if sha.hexdigest() != entry['sha256']:
+                bad.append(entry)
+    return bad
+
+
+def fetch(req, store_dir=STORE_DIR, client_factory=_default_client):
+
+    '''
+    Download one DataRequest into the store, unless it is already there.
+    All work happens in a per-request job directory, so concurrent requests
+    never share files. The job directory remembers the CDS result location,
+    so an interrupted transfer resumes instead of being requested again.
+    returns
+            ---> path of the NetCDF file in the store
+    '''
+
+    key = request_key(req)
+    ref_fn = os.path.join(store_dir, 'refs', key + '.json')
+    ref = _read_json(ref_fn)
+    if ref is not None and os.path.exists(ref['path']):
+        return ref['path']
+
+    job_dir = os.path.join(store_dir, 'jobs', key)
+    job_fn = os.path.join(job_dir, 'job.json')
+    part_fn = os.path.join(job_dir, 'download.zip.part')
+    os.makedirs(os.path.dirname(job_dir), exist_ok=True)
+
+    # concurrent runs of the same request take turns on the job directory
+    # (and its resumable part file); the later ones find the finished ref
+    with _job_lock(job_dir + '.lock'):
+        ref = _read_json(ref_fn)
+        if ref is not None and os.path.exists(ref['path']):
+            return ref['path']
+        os.makedirs(job_dir, exist_ok=True)
+
+        for attempt in range(2):
+            job = _read_json(job_fn)
+            if job is None:
+                result = client_factory().retrieve('projections-cmip6', cds_request(req))
+                job = {'location': result.location, 'size': getattr(result, 'content_length', None)}
+                _write_json(job_fn, job)
+            try:
+                _download(job['location'], part_fn, job['size'])
+                break
+            except HTTPError as e:
+                # an expired result cannot be resumed: request it again
+                if attempt or e.code not in (404, 410):
+                    raise
+                os.remove(job_fn)
+                if os.path.exists(part_fn):
+                    os.remove(part_fn)
+
+        digest, path = ingest_zip(part_fn, store_dir, source=key)
+        os.makedirs(os.path.dirname(ref_fn), exist_ok=True)
+        _write_json(ref_fn, {'request': req._asdict(), 'sha256': digest, 'path': path})
+        shutil.rmtree(job_dir)
+    return path
+
+
+def download_all(requests, store_dir=STORE_DIR, max_workers=4, client_factory=_default_client):
+
+    '''
+    Fetch many DataRequests concurrently, at most max_workers at a time.
+    returns
+            ---> {DataRequest: path of the NetCDF file in the store}
+    '''
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {req: pool.submit(fetch, req, store_dir, client_factory) for req in requests}
+    return {req: future.result() for req, future in futures.items()}
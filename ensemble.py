@@ -0,0 +1,243 @@
+import glob
+import os
+import re
+from collections import namedtuple
+import numpy as np
+from cal_trend import TILE_BUDGET
+from regrid import apply_weights, weights
+
+
+# one model run of one experiment
+Member = namedtuple('Member', ['model', 'experiment', 'data_fn', 'variable'])
+
+# {model}_{experiment}_data.nc, as written by retrieve_data
+DATA_FN_PATTERN = re.compile(r'(?P<model>.+)_(?P<experiment>ssp\d_\d_\d|historical)_data\.nc$')
+
+
+class _Regridder:
+
+    '''
+    Lazy regridding of one member's (time, lat, lon) blocks onto the target
+    grid with a cached regrid weight matrix, applied to blocks as they are
+    read. Identity when the grids already match.
+    '''
+
+    def __init__(self, lon, lat, target_lon, target_lat, method='bilinear'):
+        self.identity = (np.array_equal(lon, target_lon) and np.array_equal(lat, target_lat))
+        if not self.identity:
+            self.matrix = weights(lon, lat, target_lon, target_lat, method)
+            self.shape = (len(target_lat), len(target_lon))
+
+    def __call__(self, block):
+        if self.identity:
+            return block
+        return apply_weights(self.matrix, block, self.shape)
+
+
+class Ensemble:
+
+    '''
+    Registry of model runs (members) for several experiments, summarized on a
+    common grid without ever holding more than one time block of the
+    ensemble in memory.
+    target: (lon, lat) of the common grid, by default the first member's grid
+    method: regridding method onto the target grid, 'bilinear' or 'conservative'
+    '''
+
+    def __init__(self, target=None, method='bilinear'):
+        self.registry = {}
+        self.target = target
+        self.method = method
+        self._regridders = {}
+
+    def add(self, model, experiment, data_fn=None, variable='ts'):
+        '''Register a member, by default the file retrieve_data writes for it'''
+        if data_fn is None:
+            data_fn = f'{model}_{experiment}_data.nc'
+        member = Member(model, experiment, data_fn, variable)
+        self.registry[(model, experiment)] = member
+        return member
+
+    def discover(self, directory='.', variable='ts'):
+        '''Register every {model}_{experiment}_data.nc file in a directory'''
+        found = []
+        for fn in sorted(glob.glob(os.path.join(directory, '*_data.nc'))):
+            match = DATA_FN_PATTERN.match(os.path.basename(fn))
+            if match:
+                found.append(self.add(match['model'], match['experiment'], fn, variable))
+        return found
+
+    def members(self, experiment=None, model=None):
+        return [m for (mod, exp), m in sorted(self.registry.items())
+                if (experiment is None or exp == experiment) and (model is None or mod == model)]
+
+    @property
+    def models(self):
+        return sorted({model for model, _ in self.registry})
+
+    @property
+    def experiments(self):
+        return sorted({experiment for _, experiment in self.registry})
+
+    def _target_grid(self):
+        if self.target is None:
+            import netCDF4 as netcdf
+            first = next(iter(sorted(self.registry.values())))
+            with netcdf.Dataset(first.data_fn, mode='r') as ncset:
+                self.target = (np.ma.getdata(ncset['lon'][:]), np.ma.getdata(ncset['lat'][:]))
+        return self.target
+
+    def _open(self, members):
+
+        '''
+        Open every member and check they cover the same months.
+        returns
+                ---> list of (ncset, variable, regridder), the shared time variable, the common length
+        '''
+
+        import netCDF4 as netcdf
+        import cftime
+
+        if not members:
+            raise ValueError('No members registered for this selection')
+        target_lon, target_lat = self._target_grid()
+        opened = []
+        starts = set()
+        for member in members:
+            ncset = netcdf.Dataset(member.data_fn, mode='r')
+            var = ncset[member.variable]
+            time = ncset['time']
+            start = cftime.num2date(time[0], units=time.units, calendar=getattr(time, 'calendar', '360_day'))
+            starts.add((start.year, start.month))
+            key = member.data_fn
+            if key not in self._regridders:
+                self._regridders[key] = _Regridder(np.ma.getdata(ncset['lon'][:]), np.ma.getdata(ncset['lat'][:]),
+                                                   target_lon, target_lat, self.method)
+            opened.append((ncset, var, self._regridders[key]))
+        if len(starts) > 1:
+            for ncset, _, _ in opened:
+                ncset.close()
+            raise ValueError(f'Members start in different months: {sorted(starts)}')
+        nt = min(var.shape[0] for _, var, _ in opened)
+        return opened, opened[0][0]['time'], nt
+
+    def _blocks(self, opened, nt, block):
+        '''
+        (t0, t1, [member blocks in degC on the target grid]) for each time
+        block, one member at a time, missing values as NaN
+        '''
+        from load_data import read_nan, to_celsius
+        for t0 in range(0, nt, block):
+            t1 = min(t0 + block, nt)
+            yield t0, t1, (regrid(to_celsius(read_nan(var, slice(t0, t1)), getattr(var, 'units', 'K')))
+                           for _, var, regrid in opened)
+
+    def _output(self, out_fn, time, nt, names, extra_dims=()):
+        '''arrays (or NetCDF variables of out_fn) to write the summaries into, block by block'''
+        target_lon, target_lat = self._target_grid()
+        shape = (nt, len(target_lat), len(target_lon))
+        if out_fn is None:
+            return None, {name: np.empty(shape[:1] + tuple(len(v) for _, v in extra_dims) + shape[1:], dtype=np.float32)
+                          for name in names}
+
+        import netCDF4 as netcdf
+        out = netcdf.Dataset(out_fn + '.tmp', mode='w', format='NETCDF4')
+        out.createDimension('time', nt)
+        out.createDimension('lat', len(target_lat))
+        out.createDimension('lon', len(target_lon))
+        for dim, values in extra_dims:
+            out.createDimension(dim, len(values))
+            out.createVariable(dim, 'f8', (dim,))[:] = values
+        out.createVariable('lon', 'f8', ('lon',))[:] = target_lon
+        out.createVariable('lat', 'f8', ('lat',))[:] = target_lat
+        t = out.createVariable('time', time.dtype, ('time',))
+        t.setncatts({k: time.getncattr(k) for k in time.ncattrs()})
+        t[:] = time[:nt]
+        dims = ('time',) + tuple(dim for dim, _ in extra_dims) + ('lat', 'lon')
+        variables = {}
+        for name in names:
+            variables[name] = out.createVariable(name, 'f4', dims, zlib=True, complevel=4,
+                                                 chunksizes=(1,) + tuple(len(v) for _, v in extra_dims) + shape[1:])
+            variables[name].units = 'degC'
+        return out, variables
+
+    def _finish(self, out, out_fn, arrays, opened):
+        for ncset, _, _ in opened:
+            ncset.close()
+        if out is None:
+            return arrays
+        out.close()
+        os.replace(out_fn + '.tmp', out_fn)
+        return out_fn
+
+    def mean_spread(self, experiment, out_fn=None, block=12, ddof=1):
+
+        '''
+        Ensemble mean and spread (standard deviation) of one experiment, with a
+        one-pass Welford update per member: memory is one time block of the
+        accumulators and one member, however many members there are. Each cell
+        counts only the members that are not missing there.
+        out_fn: write 'mean' and 'spread' to a NetCDF file instead of returning arrays
+        returns
+                ---> {'mean': (time, lat, lon), 'spread': (time, lat, lon)}, or out_fn
+        '''
+
+        opened, time, nt = self._open(self.members(experiment))
+        out, arrays = self._output(out_fn, time, nt, ('mean', 'spread'))
+        for t0, t1, blocks in self._blocks(opened, nt, block):
+            n = mean = m2 = None
+            for x in blocks:
+                if n is None:
+                    n, mean, m2 = np.zeros(x.shape), np.zeros(x.shape), np.zeros(x.shape)
+                valid = np.isfinite(x)
+                n += valid
+                delta = np.where(valid, x - mean, 0.0)
+                mean += np.divide(delta, n, out=np.zeros_like(delta), where=valid)
+                m2 += delta * np.where(valid, x - mean, 0.0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                arrays['mean'][t0:t1] = np.where(n > 0, mean, np.nan)
+                arrays['spread'][t0:t1] = np.where(n > ddof, np.sqrt(m2 / (n - ddof)), np.nan)
+        return self._finish(out, out_fn, arrays, opened)
+
+    def percentiles(self, experiment, q=(5, 50, 95), out_fn=None, budget=TILE_BUDGET):
+
+        '''
+        Ensemble percentiles of one experiment, exact, computed chunk by chunk:
+        each time chunk of all members is stacked and reduced, with chunks
+        sized so the stack fits in budget bytes. Missing members of a cell are
+        left out, as np.nanpercentile does.
+        returns
+                ---> {'percentile': (time, q, lat, lon)}, or out_fn
+        '''
+
+        members = self.members(experiment)
+        opened, time, nt = self._open(members)
+        target_lon, target_lat = self._target_grid()
+        block = max(1, budget // (len(members) * len(target_lat) * len(target_lon) * 8))
+        out, arrays = self._output(out_fn, time, nt, ('percentile',), extra_dims=(('q', np.asarray(q, dtype=np.float64)),))
+        # linear interpolation between order statistics, as np.percentile does,
+        # from one sort along the (short) member axis; NaN sorts last, so the
+        # order statistics of each cell are its first n sorted members
+        q = np.asarray(q, dtype=np.float64)[:, None, None, None]
+        for t0, t1, blocks in self._blocks(opened, nt, block):
+            stack = np.sort(np.stack(list(blocks)), axis=0)
+            n = np.isfinite(stack).sum(axis=0)
+            pos = q / 100.0 * np.maximum(n - 1, 0)
+            lo = np.floor(pos).astype(int)
+            hi = np.minimum(lo + 1, np.maximum(n - 1, 0))
+            frac = pos - lo
+            values = (np.take_along_axis(stack, lo, axis=0) * (1 - frac)
+                      + np.take_along_axis(stack, hi, axis=0) * frac)
+            values[:, n == 0] = np.nan
+            arrays['percentile'][t0:t1] = np.moveaxis(values, 0, 1)
+        return self._finish(out, out_fn, arrays, opened)
+
+
+if __name__ == "__main__":
+    import sys
+    ensemble = Ensemble()
+    ensemble.discover(sys.argv[1] if len(sys.argv) > 1 else '.')
+    for experiment in ensemble.experiments:
+        print(experiment, [m.model for m in ensemble.members(experiment)])
+        ensemble.mean_spread(experiment, out_fn=f'ensemble_{experiment}_mean_spread.nc')
+        ensemble.percentiles(experiment, out_fn=f'ensemble_{experiment}_percentiles.nc')
@@ -0,0 +1,202 @@
+import bisect
+import difflib
+import io
+import os
+import unicodedata
+import zipfile
+import numpy as np
+
+
+# offline place index, built from a GeoNames dump with retrieve_gazetteer
+GAZETTEER_FN = 'gazetteer.npz'
+GEONAMES_URL = 'https://download.geonames.org/export/dump/cities500.zip'
+
+
+def normalize_name(name):
+    '''Index key for a place name: case-folded, accents stripped, whitespace collapsed'''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.split()).casefold()
+
+
+def _pack(strings):
+    '''Pack strings into one utf-8 byte array plus offsets'''
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def build_gazetteer(geonames_fn, out_fn=GAZETTEER_FN):
+
+    '''
+    Build the compact gazetteer index from a GeoNames cities*.txt/.zip dump.
+    Each place is indexed under its name and ASCII name; keys are sorted so
+    exact and prefix lookups are binary searches over packed arrays.
+    '''
+
+    if geonames_fn.endswith('.zip'):
+        with zipfile.ZipFile(geonames_fn) as zip_ref:
+            member = [n for n in zip_ref.namelist() if n.endswith('.txt')][0]
+            with zip_ref.open(member) as f:
+                rows = io.TextIOWrapper(f, encoding='utf-8').read().splitlines()
+    else:
+        with open(geonames_fn, encoding='utf-8') as f:
+            rows = f.read().splitlines()
+
+    names, lons, lats, pops, countries = [], [], [], [], []
+    keys = []
+    for row in rows:
+        fields = row.split('\t')
+        place = len(names)
+        names.append(fields[1])
+        lats.append(float(fields[4]))
+        lons.append(float(fields[5]))
+        countries.append(fields[8])
+        pops.append(int(fields[14] or 0))
+        for key in {normalize_name(fields[1]), normalize_name(fields[2])}:
+            if key:
+                keys.append((key, place))
+
+    pops = np.array(pops, dtype=np.int64)
+    # sort keys alphabetically, most populous place first within a key
+    keys.sort(key=lambda k: (k[0], -pops[k[1]]))
+
+    key_blob, key_offsets = _pack([k for k, _ in keys])
+    name_blob, name_offsets = _pack(names)
+    np.savez_compressed(
+        out_fn,
+        key_blob=key_blob, key_offsets=key_offsets,
+        key_place=np.array([p for _, p in keys], dtype=np.int32),
+        name_blob=name_blob, name_offsets=name_offsets,
+        lon=np.array(lons, dtype=np.float32), lat=np.array(lats, dtype=np.float32),
+        population=pops, country=np.array(countries, dtype='U2'))
+    return out_fn
+
+
+def retrieve_gazetteer(url=GEONAMES_URL, out_fn=GAZETTEER_FN):
+    '''Download a GeoNames populated-places dump and build the gazetteer from it'''
+    from urllib.request import urlretrieve
+
+    zip_fn = f'./download_{os.path.basename(url)}'
+    urlretrieve(url, zip_fn)
+    try:
+        build_gazetteer(zip_fn, out_fn)
+    finally:
+        os.remove(zip_fn)
+    return out_fn
+
+
+class _Keys:
+    '''Sequence view of the packed key strings, for bisect'''
+
+    def __init__(self, blob, offsets):
+        self.blob = blob.tobytes()
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i+1]].decode('utf-8')
+
+
+class Gazetteer:
+    '''
+    Array-backed index of populated places with exact, prefix and fuzzy search.
+    Lookups return place ids; coords, name and population describe a place id.
+    '''
+
+    def __init__(self, fn=GAZETTEER_FN):
+        with np.load(fn) as data:
+            arrays = {k: data[k] for k in data.files}
+        self._keys = _Keys(arrays['key_blob'], arrays['key_offsets'])
+        self._key_place = arrays['key_place']
+        self._names = _Keys(arrays['name_blob'], arrays['name_offsets'])
+        self.lon = arrays['lon']
+        self.lat = arrays['lat']
+        self.population = arrays['population']
+        self.country = arrays['country']
+
+    def __len__(self):
+        return len(self.lon)
+
+    def _range(self, prefix):
+        lo = bisect.bisect_left(self._keys, prefix)
+        hi = bisect.bisect_left(self._keys, prefix + '\U0010ffff', lo)
+        return lo, hi
+
+    def _places(self, lo, hi, limit):
+        '''Distinct places for key positions lo:hi, most populous first'''
+        places = np.unique(self._key_place[lo:hi])
+        places = places[np.argsort(-self.population[places], kind='stable')]
+        return [int(p) for p in places[:limit]]
+
+    def exact(self, name, limit=10):
+        key = normalize_name(name)
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_right(self._keys, key, lo)
+        return self._places(lo, hi, limit)
+
+    def prefix(self, text, limit=10):
+        return self._places(*self._range(normalize_name(text)), limit)
+
+    def fuzzy(self, text, limit=5, cutoff=0.6, max_candidates=20000):
+        '''
+        Closest keys by difflib ratio. Candidates share the first two letters
+        of the query (or only the first, if that gives too few keys).
+        '''
+        key = normalize_name(text)
+        lo, hi = 0, 0
+        for n in range(min(len(key), 2), 0, -1):
+            lo, hi = self._range(key[:n])
+            if hi - lo >= limit:
+                break
+        hi = min(hi, lo + max_candidates)
+        candidates = {self._keys[i]: i for i in range(lo, hi)}
+        matches = difflib.get_close_matches(key, list(candidates), n=limit, cutoff=cutoff)
+        places = []
+        for match in matches:
+            for p in self.exact(match, 1):
+                if p not in places:
+                    places.append(p)
+        return places[:limit]
+
+    def name(self, place):
+        return f'{self._names[place]}, {self.country[place]}'
+
+    def coords(self, place):
+        return (float(self.lon[place]), float(self.lat[place]))
+
+    def lookup(self, name):
+        '''
+        (lon, lat) of the most populous exact match for name, or None.
+        A trailing country code, as in the suggestions ("London, GB"), restricts the match.
+        '''
+        base, _, country = name.rpartition(',')
+        country = country.strip().upper()
+        if base and len(country) == 2:
+            places = [p for p in self.exact(base, None) if self.country[p] == country]
+        else:
+            places = self.exact(name, 1)
+        return self.coords(places[0]) if places else None
+
+    def suggest(self, text, limit=10):
+        '''Display names for as-you-type suggestions: prefix matches, else fuzzy ones'''
+        places = self.prefix(text, limit) or self.fuzzy(text, limit)
+        return [self.name(p) for p in places]
+
+
+_gazetteer = None
+
+
+def get_gazetteer(fn=GAZETTEER_FN):
+    '''Shared Gazetteer instance, or None if the index has not been built'''
+    global _gazetteer
+    if _gazetteer is None and os.path.exists(fn):
+        _gazetteer = Gazetteer(fn)
+    return _gazetteer
+
+
+if __name__ == "__main__":
+    retrieve_gazetteer()
@@ -1,8 +1,92 @@
 from geopy.geocoders import Nominatim
+from geopy.exc import GeopyError
+from cache_utils import LRUCache, SqliteStore
+from gazetteer import get_gazetteer
+
+
+# geocoding cache settings
+GEOCODE_DB = 'geocode_cache.sqlite'
+GEOCODE_TTL = 90*24*3600
+GEOCODE_MAX_ENTRIES = 100000
+# names the geocoder could not find are remembered for a shorter time
+GEOCODE_MISS_TTL = 24*3600
+
+_memory = LRUCache(maxsize=4096, ttl=GEOCODE_TTL)
+_misses = LRUCache(maxsize=4096, ttl=GEOCODE_MISS_TTL)
+_stores = {}
+_geolocator = None
+
+
+def normalize_city(city):
+    '''Cache key for a city name: case-folded, with whitespace collapsed'''
+    return ' '.join(city.split()).casefold()
+
+
+def _get_store(table='geocode', ttl=GEOCODE_TTL):
+    if table not in _stores:
+        _stores[table] = SqliteStore(GEOCODE_DB, table=table, ttl=ttl, max_entries=GEOCODE_MAX_ENTRIES)
+    return _stores[table]
+
+
+def _get_geolocator():
+    global _geolocator
+    if _geolocator is None:
+        _geolocator = Nominatim(user_agent="Google Geocoding API (V3)")
+    return _geolocator
+
 
 def get_coords(city):
-    '''Get coordinates for selected cities'''
-    geolocator = Nominatim(user_agent="Google Geocoding API (V3)")
-    coords = (geolocator.geocode(city).longitude, geolocator.geocode(city).latitude)
+    '''
+    Get (lon, lat) coordinates for selected cities.
+    The offline gazetteer is tried first, if it has been built. Network lookups
+    are cached in memory and in GEOCODE_DB, so a repeated city never leaves the
+    process; so are names that were not found, for GEOCODE_MISS_TTL. If the
+    geocoder is unreachable an expired entry is used.
+    '''
+    key = normalize_city(city)
+    coords = _memory.get(key)
+    if coords is not None:
+        return coords
+
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        coords = gazetteer.lookup(city)
+        if coords is not None:
+            _memory.set(key, coords)
+            return coords
+
+    store = _get_store()
+    coords = store.get(key)
+    if coords is None:
+        misses = _get_store('geocode_miss', GEOCODE_MISS_TTL)
+        if _misses.get(key) or misses.get(key):
+            _misses.set(key, True)
+            raise ValueError(f'Could not find coordinates for {city}')
+        try:
+            location = _get_geolocator().geocode(city)
+        except GeopyError:
+            coords = store.get(key, allow_stale=True)
+            if coords is None:
+                raise
+        else:
+            if location is None:
+                _misses.set(key, True)
+                misses.set(key, True)
+                raise ValueError(f'Could not find coordinates for {city}')
+            coords = (location.longitude, location.latitude)
+            store.set(key, coords)
+
+    coords = tuple(coords)
+    _memory.set(key, coords)
     return coords
 
+
+def get_coords_batch(cities):
+    '''
+    (lon, lat) coordinates of several cities, as two arrays ready for the
+    batched point extraction of GridIndex and point_store.extract_points
+    '''
+    import numpy as np
+
+    coords = np.array([get_coords(city) for city in cities], dtype=np.float64).reshape(-1, 2)
+    return coords[:, 0], coords[:, 1]
@@ -0,0 +1,186 @@
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    '''Great-circle distance in km between points given in degrees'''
+    lon1, lat1, lon2, lat2 = map(np.deg2rad, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2-lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2-lon1)/2)**2
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _take(data, i, j):
+    '''data[..., i, j] with pointwise (not orthogonal) indexing, for numpy or xarray input'''
+    if hasattr(data, 'isel'):
+        import xarray as xr
+        dims = [f'point_{k}' for k in range(i.ndim)]
+        lat_dim, lon_dim = data.dims[-2:]
+        return data.isel({lat_dim: xr.DataArray(i, dims=dims), lon_dim: xr.DataArray(j, dims=dims)}).values
+    return np.asarray(data[..., i, j])
+
+
+class GridIndex:
+
+    '''
+    Precomputed index of a rectilinear lon/lat grid, mapping batches of
+    (lon, lat) points to (i, j) = (lat, lon) cell indices in one vectorized call.
+    Longitudes are wrapped onto the grid's convention, so -180..180 input
+    works on a 0..360 grid and vice versa.
+    '''
+
+    _cache = {}
+
+    def __init__(self, lon, lat):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        self.nlon = len(lon)
+        self.nlat = len(lat)
+        self.lon = lon
+        self.lat = lat
+
+        # work on ascending latitudes and map indices back at the end
+        self._lat_flip = self.nlat > 1 and lat[0] > lat[-1]
+        self._lat = lat[::-1] if self._lat_flip else lat
+        self._lon = lon
+
+        # a global grid wraps around in longitude
+        dlon = np.median(np.diff(lon)) if self.nlon > 1 else 360.0
+        self.periodic = bool(np.isclose(lon[-1] - lon[0] + dlon, 360.0, atol=1e-3*dlon))
+
+    @classmethod
+    def from_dataset(cls, ds):
+        '''GridIndex for an xarray dataset, built once per distinct lon/lat grid'''
+        lon = np.asarray(ds['lon'].values)
+        lat = np.asarray(ds['lat'].values)
+        key = (lon.tobytes(), lat.tobytes())
+        if key not in cls._cache:
+            cls._cache[key] = cls(lon, lat)
+        return cls._cache[key]
+
+    def _wrap(self, lon):
+        return (np.asarray(lon, dtype=np.float64) - self._lon[0]) % 360.0 + self._lon[0]
+
+    def _lat_index(self, i):
+        return self.nlat - 1 - i if self._lat_flip else i
+
+    def _lon_neighbours(self, lon):
+        '''Grid columns either side of each wrapped longitude'''
+        j1 = np.searchsorted(self._lon, lon)
+        if self.periodic:
+            j0 = (j1 - 1) % self.nlon
+            j1 = j1 % self.nlon
+        else:
+            j1 = np.clip(j1, 0, self.nlon - 1)
+            j0 = np.clip(j1 - 1, 0, self.nlon - 1)
+        return j0, j1
+
+    def _lat_neighbours(self, lat):
+        i1 = np.clip(np.searchsorted(self._lat, lat), 0, self.nlat - 1)
+        i0 = np.clip(i1 - 1, 0, self.nlat - 1)
+        return i0, i1
+
+    def _lon_dist(self, lon, j):
+        d = np.abs(lon - self._lon[j])
+        return np.minimum(d, 360.0 - d) if self.periodic else d
+
+    def nearest(self, lon, lat, great_circle=False):
+
+        '''
+        Nearest grid cell for each point.
+        great_circle: choose among the four surrounding cells by great-circle
+                      distance rather than by separate lon and lat distance
+        returns
+                ---> i (lat index), j (lon index), arrays shaped like the input
+        '''
+
+        lon = self._wrap(lon)
+        lat = np.asarray(lat, dtype=np.float64)
+        j0, j1 = self._lon_neighbours(lon)
+        i0, i1 = self._lat_neighbours(lat)
+
+        if not great_circle:
+            j = np.where(self._lon_dist(lon, j0) <= self._lon_dist(lon, j1), j0, j1)
+            i = np.where(np.abs(lat - self._lat[i0]) <= np.abs(lat - self._lat[i1]), i0, i1)
+            return self._lat_index(i), j
+
+        ii = np.stack([i0, i0, i1, i1])
+        jj = np.stack([j0, j1, j0, j1])
+        dist = haversine(lon, lat, self._lon[jj], self._lat[ii])
+        k = np.argmin(dist, axis=0)
+        i = np.take_along_axis(ii, k[None], 0)[0]
+        j = np.take_along_axis(jj, k[None], 0)[0]
+        return self._lat_index(i), j
+
+    def bilinear(self, lon, lat):
+
+        '''
+        Bilinear interpolation stencil for each point.
+        returns
+                ---> i, j: (..., 4) lat/lon indices of the surrounding cells
+                ---> w: (..., 4) weights summing to 1
+        '''
+
+        lon = self._wrap(lon)
+        lat = np.asarray(lat, dtype=np.float64)
+        j0, j1 = self._lon_neighbours(lon)
+        i0, i1 = self._lat_neighbours(lat)
+
+        dlon = (self._lon[j1] - self._lon[j0]) % 360.0 if self.periodic else self._lon[j1] - self._lon[j0]
+        off = (lon - self._lon[j0]) % 360.0 if self.periodic else lon - self._lon[j0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fx = np.where(dlon > 0, off / dlon, 0.0)
+            fy = np.where(i1 > i0, (lat - self._lat[i0]) / (self._lat[i1] - self._lat[i0]), 0.0)
+        fx = np.clip(fx, 0.0, 1.0)
+        fy = np.clip(fy, 0.0, 1.0)
+
+        i = np.stack([i0, i0, i1, i1], axis=-1)
+        j = np.stack([j0, j1, j0, j1], axis=-1)
+        w = np.stack([(1-fx)*(1-fy), fx*(1-fy), (1-fx)*fy, fx*fy], axis=-1)
+        return self._lat_index(i), j, w
+
+    def extract(self, data, lon, lat, method='nearest'):
+
+        '''
+        Values of a (..., lat, lon) array at a batch of points.
+        method: 'nearest', 'great_circle' or 'bilinear'
+        returns
+                ---> array of shape (..., npoints)
+        '''
+
+        lon = np.atleast_1d(lon)
+        lat = np.atleast_1d(lat)
+        if method == 'bilinear':
+            i, j, w = self.bilinear(lon, lat)
+            return np.sum(_take(data, i, j) * w, axis=-1)
+        i, j = self.nearest(lon, lat, great_circle=(method == 'great_circle'))
+        return _take(data, i, j)
+
+    def select(self, data, lon, lat, method='nearest', dim='point', labels=None):
+
+        '''
+        Like extract, for a (..., lat, lon) xarray DataArray, keeping its other
+        coordinates: one pointwise isel for the whole batch of points.
+        labels: optional coordinate values of the new dimension, e.g. city names
+        returns
+                ---> DataArray of shape (..., npoints), lat and lon replaced by dim
+        '''
+
+        import xarray as xr
+
+        lon = np.atleast_1d(lon)
+        lat = np.atleast_1d(lat)
+        lat_dim, lon_dim = data.dims[-2:]
+        if method == 'bilinear':
+            i, j, w = self.bilinear(lon, lat)
+            dims = (dim, 'corner')
+            stencil = data.isel({lat_dim: xr.DataArray(i, dims=dims), lon_dim: xr.DataArray(j, dims=dims)})
+            result = (stencil * xr.DataArray(w, dims=dims)).sum('corner', keep_attrs=True)
+            result = result.drop_vars([lat_dim, lon_dim], errors='ignore')
+        else:
+            i, j = self.nearest(lon, lat, great_circle=(method == 'great_circle'))
+            result = data.isel({lat_dim: xr.DataArray(i, dims=dim), lon_dim: xr.DataArray(j, dims=dim)})
+        if labels is not None:
+            result = result.assign_coords({dim: list(labels)})
+        return result
@@ -0,0 +1,17 @@
+# gunicorn settings for the dashboard: gunicorn -c gunicorn.conf.py wsgi:server
+import multiprocessing
+import os
+
+bind = os.environ.get("DASHBOARD_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# one request at a time per worker: netCDF4/HDF5 is not thread-safe. Reads
+# that can happen in a request (tiles, point-store builds) are serialized by
+# load_data.NETCDF_LOCK, so more threads are safe but mostly wait on it
+threads = int(os.environ.get("DASHBOARD_THREADS", 1))
+
+# import the app (and map the point stores) once in the master, then fork:
+# workers share the read-only memory-mapped arrays instead of loading copies
+preload_app = True
+
+# one figure cache for all workers
+os.environ.setdefault("DASHBOARD_CACHE_DB", "dashboard_cache.sqlite")
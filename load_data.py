@@ -0,0 +1,118 @@
+import threading
+from functools import cached_property
+import numpy as np
+
+
+CELSIUS_UNITS = ('degC', 'deg_C', 'C', 'celsius', 'Celsius')
+
+# netCDF4/HDF5 is not thread-safe: code that may run in server threads (tiles,
+# point-store builds) opens and reads files under this lock, one thread at a time
+NETCDF_LOCK = threading.RLock()
+
+
+def to_celsius(values, units='K'):
+    '''Temperatures in degC: Kelvin data are converted, data already in Celsius are returned as is'''
+    return values if units in CELSIUS_UNITS else values - 273.15
+
+
+def read_nan(var, index=slice(None), dtype=np.float64):
+    '''var[index] of a netCDF4 variable as dtype, with fill and missing values as NaN so their cells are skipped'''
+    return np.ma.filled(np.ma.asarray(var[index]).astype(dtype), np.nan)
+
+
+def celsius(da):
+    '''to_celsius for an xarray DataArray, using its units attribute'''
+    return to_celsius(da, da.attrs.get('units', 'K'))
+
+
+class ClimateData:
+
+    '''
+    A CMIP6 NetCDF file opened once, with lazy accessors.
+    Nothing is read from disk until it is asked for, and each product is
+    materialized at most once:
+            ---> lon, lat, time: raw coordinate arrays
+            ---> datevar: decoded cftime dates
+            ---> ts_var: the on-disk variable, read slice by slice when indexed
+            ---> ts: the whole variable as a numpy array
+            ---> ds: xarray view sharing the same file handle
+            ---> lonlat_grid, annual, product(...): derived products
+    '''
+
+    def __init__(self, data_fn, variable='ts'):
+        import netCDF4 as netcdf
+
+        self.data_fn = data_fn
+        self.variable = variable
+        self.ncset = netcdf.Dataset(data_fn, mode='r')
+        self.ncset.set_auto_mask(False)
+
+    @cached_property
+    def lon(self):
+        return self.ncset['lon'][:]
+
+    @cached_property
+    def lat(self):
+        return self.ncset['lat'][:]
+
+    @cached_property
+    def time(self):
+        return self.ncset['time'][:]
+
+    @cached_property
+    def datevar(self):
+        import cftime
+
+        time = self.ncset['time']
+        t_cal = getattr(time, 'calendar', u"360_day")
+        return cftime.num2date(self.time, units=time.units, calendar=t_cal)
+
+    @property
+    def ts_var(self):
+        return self.ncset[self.variable]
+
+    @cached_property
+    def ts(self):
+        return self.ts_var[:]
+
+    @cached_property
+    def ds(self):
+        import xarray as xr
+
+        ds = xr.open_dataset(xr.backends.NetCDF4DataStore(self.ncset))
+        ds.encoding['source'] = self.data_fn
+        return ds
+
+    @cached_property
+    def lonlat_grid(self):
+        return np.meshgrid(self.lon, self.lat)
+
+    def product(self, product, **params):
+        '''Derived product (see products.py), computed once and persisted to disk'''
+        from products import get_product
+
+        return get_product(self.ds, product, variable=self.variable, **params)
+
+    @property
+    def annual(self):
+        return self.product('annual').to_dataset(name=self.variable)
+
+    def close(self):
+        self.ncset.close()
+        _loaded.pop(self.data_fn, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_loaded = {}
+
+
+def load_data(data_fn, variable='ts'):
+    '''ClimateData for a file, opened once per process'''
+    if data_fn not in _loaded:
+        _loaded[data_fn] = ClimateData(data_fn, variable)
+    return _loaded[data_fn]
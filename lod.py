@@ -0,0 +1,108 @@
+import numpy as np
+
+
+# aggregation levels of the time-series pyramid, finest first
+LEVELS = ('monthly', 'seasonal', 'annual', 'decadal')
+
+# most points sent to the browser for one trace
+MAX_POINTS = 1000
+
+
+def decimal_years(dates):
+    '''cftime dates as fractional years, for any calendar'''
+    return np.array([d.year + (d.month - 1 + (d.day - 0.5) / d.daysinmonth) / 12 for d in dates])
+
+
+def level_groups(dates, level):
+
+    '''
+    Group index of every time step at an aggregation level.
+    Seasons are meteorological (DJF, MAM, JJA, SON), December counting
+    towards the following year's winter.
+    returns
+            ---> groups: (time,) index of each step's group, ngroups
+    '''
+
+    years = np.array([d.year for d in dates])
+    months = np.array([d.month for d in dates])
+    if level == 'monthly':
+        keys = years*12 + months - 1
+    elif level == 'seasonal':
+        keys = (years + (months == 12))*4 + (months % 12)//3
+    elif level == 'annual':
+        keys = years
+    elif level == 'decadal':
+        keys = years//10
+    else:
+        raise ValueError(f'Unknown level {level}, expected one of {LEVELS}')
+    _, groups = np.unique(keys, return_inverse=True)
+    return groups, int(groups.max()) + 1
+
+
+def aggregation_matrix(groups, ngroups):
+    '''Sparse (ngroups, time) matrix averaging time steps into their groups'''
+    from scipy import sparse
+
+    counts = np.bincount(groups, minlength=ngroups)
+    nt = len(groups)
+    return sparse.csr_matrix((1.0 / counts[groups], (groups, np.arange(nt))), shape=(ngroups, nt))
+
+
+def aggregate(matrix, values):
+    '''Group means of the rows of a (n, time) array with an aggregation_matrix, over the finite steps only'''
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.isfinite(values)
+    if valid.all():
+        return (matrix @ values.T).T
+    total = (matrix @ np.where(valid, values, 0.0).T).T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / (matrix @ valid.T.astype(np.float64)).T
+
+
+def lttb(x, y, n_out):
+
+    '''
+    Largest-Triangle-Three-Buckets downsampling of (x, y) to n_out points,
+    keeping the first and last points and the visual shape of the line.
+    '''
+
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for k in range(n_out - 2):
+        lo, hi = edges[k], edges[k+1]
+        # average of the next bucket (or the last point) is the third vertex
+        nlo, nhi = hi, edges[k+2] if k + 2 < len(edges) else n
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx)*(y[lo:hi] - y[a]) - (x[a] - x[lo:hi])*(cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[k+1] = a
+    return x[keep], y[keep]
+
+
+def choose_level(level_x, x0=None, x1=None, max_points=MAX_POINTS):
+    '''Finest level with at most max_points points in the [x0, x1] view'''
+    for level in LEVELS:
+        x = level_x[level]
+        n = np.count_nonzero((x >= (x0 if x0 is not None else -np.inf)) & (x <= (x1 if x1 is not None else np.inf)))
+        if n <= max_points:
+            return level
+    return LEVELS[-1]
+
+
+def view(x, y, x0=None, x1=None, max_points=MAX_POINTS):
+    '''Points of (x, y) inside [x0, x1], LTTB-downsampled to at most max_points'''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if x0 is not None or x1 is not None:
+        # keep one point either side so the line runs to the edges of the view
+        lo = max(np.searchsorted(x, x0) - 1, 0) if x0 is not None else 0
+        hi = min(np.searchsorted(x, x1, side='right') + 1, len(x)) if x1 is not None else len(x)
+        x, y = x[lo:hi], y[lo:hi]
+    return lttb(x, y, max_points)
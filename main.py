@@ -9,7 +9,6 @@ Key analysis is performed on the SSP5-8.5 data with a brief comparison with SSP1
 
 # Import required libraries
 
-from netCDF4 import Dataset as netcdf
 from scipy import signal
 from pylab import *
 import numpy as np
@@ -29,9 +28,17 @@ import matplotlib.dates as mdates
 from matplotlib import pyplot as plt
 import xarray as xr
 from retrieve_data import retrieve_data
+from pipeline import run_stage
 from math import floor, ceil
-from plots import plot_monthly_trends, get_coords, plot_cities
+from plots import plot_monthly_trends, plot_cities
+from get_coords import get_coords_batch
+from grid_index import GridIndex
 from cal_trend import cal_trend
+from load_data import celsius, load_data
+from products import get_product
+from regrid import regrid
+from regions import regional_means_file, subset, time_slice
+from lod import decimal_years
 
 
 
@@ -49,46 +56,29 @@ MODEL = 'hadgem3_gc31_ll'
 DATE = '2015-01-01/2099-12-31'
 
 
-# retrieve data
-data_fn = retrieve_data(TEMP_RES, EXPERIMENT, VARIABLE, MODEL, DATE)
-ncset = netcdf(data_fn, mode='r')
+# retrieve data (skipped while the request and the download code are unchanged,
+# see pipeline.py; report.py renders the figures below incrementally)
+data_fn, _ = run_stage('ingest', retrieve_data,
+                       dict(temp_res=TEMP_RES, experiment=EXPERIMENT, variable=VARIABLE, model=MODEL, date=DATE),
+                       code=('download_manager',))
+climate = load_data(data_fn)
 
 
 # check which variables are in the netcdf file
-print(ncset.variables)
-ncset.set_auto_mask(False)
+print(climate.ncset.variables)
 
 
-# read variables
-lon = ncset['lon'][:]
-lat = ncset['lat'][:]
-t = ncset['time'][:]
-ts = ncset['ts'][:]
-nctime = ncset.variables['time'][:]
-t_unit = ncset.variables['time'].units
-ncset.close()
-
-try:
-    t_cal = ncset.variables['time'].calendar
-    t_cal = nctime.calendar
-except AttributeError:
-    t_cal = u"360_day"
-
-datevar = cftime.num2date(nctime, units=t_unit, calendar=t_cal)
-
-
-# lon lat on a grid
-[lon, lat] = np.meshgrid(lon, lat)
+# read variables: only what is used below is read from disk
+datevar = climate.datevar
 
 # print first and last dates, for later reference
 print(datevar[0])
 print(datevar[-1])
 
-# load data
-ds = xr.open_dataset(data_fn)
+# load data (shares the file handle opened above)
+ds = climate.ds
 lat = ds.lat
 lon = ds.lon
-ds_y = ds.groupby('time.year').mean(dim='time')
 
 
 
@@ -100,7 +90,17 @@ ds_y = ds.groupby('time.year').mean(dim='time')
 plot_monthly_trends(ds, datevar)
 
 cities = ["Jerusalem", "Cincinnati", "Stockholm"]
-plot_cities(cities)
+plot_cities(ds, cities)
+
+# coordinates of each city (geocoded once, then served from the cache);
+# every analysis below reads all cities with one pointwise selection
+location_1, location_2, location_3 = cities
+lon_cities, lat_cities = get_coords_batch(cities)
+grid = GridIndex.from_dataset(ds)
+
+
+def select_cities(da):
+    return grid.select(da, lon_cities, lat_cities, dim='city', labels=cities)
 
 
 ### 7) Selecting a sub-part of your data
@@ -112,12 +112,22 @@ plot_cities(cities)
 
 
 
-# Mask the original arrays (ts) and create a new smaller array (ts_region):
+# Cut the box around Iceland (regions.REGIONS['iceland']) for 2015-2099 in one indexing step:
+# only the box is read from disk, with no intermediate copies
 
-ts_region = ts[idx_tim_region, :, :][:, idx_lat_region, :][:, :, idx_lon_region]
+tim_region = time_slice(datevar, 2015, 2099)
+lon_region, lat_region, ts_region = subset(climate.ts_var, lon, lat, 'iceland', tim_region)
+dates_region = datevar[tim_region]
 print(ts_region.shape)
 print(dates_region.shape)
 
+# area-weighted (cos lat) mean series (degC) of several regions, all in one pass over the file
+regions = ['global', 'northern_hemisphere', 'southern_hemisphere', 'arctic', 'iceland']
+region_ts = regional_means_file(data_fn, regions)
+plt.figure()
+plt.plot(decimal_years(datevar), region_ts)
+plt.legend(regions, loc='lower right')
+plt.title('SSP5_8.5 area-weighted regional mean temperature (degC)')
 
 
 
@@ -127,14 +137,9 @@ print(dates_region.shape)
 
 
 
-# plot temperature anomaly data for selected cities
-def remove_time_mean(x):
-    return x - x.mean(dim='time')
-
-monthly_annual_anom = ds.ts.groupby('time.month').apply(remove_time_mean)
-monthly_annual_anom.sel(lon=lon1, lat=lat1, method = 'nearest').plot.line(x="time")
-monthly_annual_anom.sel(lon=lon2, lat=lat2, method = 'nearest').plot.line(x="time")
-monthly_annual_anom.sel(lon=lon3, lat=lat3, method = 'nearest').plot.line(x="time")
+# plot temperature anomaly data for selected cities (anomaly cube computed once and cached)
+monthly_annual_anom = climate.product('anomaly')
+select_cities(monthly_annual_anom).plot.line(x="time", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.legend(labels,loc='lower right')
 plt.title('Compare SSP5_8.5 temperature anomaly record for ' + labels[0] +', '+ labels[1]+ ', and ' +labels[2])
@@ -147,9 +152,7 @@ plt.title('Compare SSP5_8.5 temperature anomaly record for ' + labels[0] +', '+
 # timeseries for a given month
 month=8 #9:September
 month_name = 'September'
-(ds.ts.sel(lon=lon1, lat=lat1,time=ds['time.month']==month, method = 'nearest')-273.15).plot.line(x="time")
-(ds.ts.sel(lon=lon2, lat=lat2,time=ds['time.month']==month, method = 'nearest')-273.15).plot.line(x="time")
-(ds.ts.sel(lon=lon3, lat=lat3,time=ds['time.month']==month, method = 'nearest')-273.15).plot.line(x="time")
+celsius(select_cities(ds.ts.sel(time=ds['time.month']==month))).plot.line(x="time", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.legend(labels,loc='lower right')
 plt.title(month_name + ' trends for ' + labels[0] +', '+ labels[1]+ ', and ' +labels[2])
@@ -160,10 +163,8 @@ plt.title(month_name + ' trends for ' + labels[0] +', '+ labels[1]+ ', and ' +la
 
 # timeseries for a given season
 season_str='JJA' #('DJF','MAM','JJA','SON')
-season_annual = ds['ts'].where(ds['ts']['time.season'] == season_str).groupby('time.year').mean(dim='time')
-season_annual.sel(lon=lon1, lat=lat1, method = 'nearest').plot.line(x="year")
-season_annual.sel(lon=lon2, lat=lat2, method = 'nearest').plot.line(x="year")
-season_annual.sel(lon=lon3, lat=lat3, method = 'nearest').plot.line(x="year")
+season_annual = climate.product('seasonal', season=season_str)
+select_cities(season_annual).plot.line(x="year", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.legend(labels,loc='lower right')
 plt.title('Compare seasonal trends ('+ season_str+')')
@@ -182,19 +183,15 @@ fig.subplots_adjust(hspace=0.1, wspace=0.1)
 ylimits = (5, 30)
 
 ax1 = fig.add_subplot(121, ylim = ylimits)
-year_annual126 = (ds['ts']-273.15).groupby('time.year').mean(dim='time')
-year_annual126.sel(lon=lon1, lat=lat1, method = 'nearest').plot.line(ax = ax1, x="year")
-year_annual126.sel(lon=lon2, lat=lat2, method = 'nearest').plot.line(ax = ax1, x="year")
-year_annual126.sel(lon=lon3, lat=lat3, method = 'nearest').plot.line(ax = ax1, x="year")
+year_annual126 = celsius(climate.product('annual'))
+select_cities(year_annual126).plot.line(ax = ax1, x="year", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.title('SSP5_8.5 Yearly Trends')
 plt.legend(labels,loc='lower right')
 
 ax2 = fig.add_subplot(122, ylim = ylimits)
-year_annual = (ds126['ts']-273.15).groupby('time.year').mean(dim='time')
-year_annual.sel(lon=lon1, lat=lat1, method = 'nearest').plot.line(ax = ax2, x="year")
-year_annual.sel(lon=lon2, lat=lat2, method = 'nearest').plot.line(ax = ax2, x="year")
-year_annual.sel(lon=lon3, lat=lat3, method = 'nearest').plot.line(ax = ax2, x="year")
+year_annual = celsius(get_product(ds126, 'annual'))
+select_cities(year_annual).plot.line(ax = ax2, x="year", hue="city", add_legend=False)
 labels = [location_1,location_2,location_3]
 plt.title('SSP1_2.6 Yearly Trends')
 
@@ -208,14 +205,16 @@ num_years=85
 start_month=0
 num_months=12
 
-ts126_ym=ts126.reshape(num_years,num_months,144,192)
+ts126_ym=ts126.reshape((num_years,num_months)+ts126.shape[1:])
 
 nx126=ts126_ym.shape[2]
 ny126=ts126_ym.shape[3]
-ts126_trend, ts126_trend_ym, ts126_sig_a, ts126_sig_a_ym, ts126_r_a, ts126_r_a_ym, ts126_int_a, int126_a_ym = cal_trend(start_year, num_years, start_month, num_months, nx126, ny126, ts126_ym)
+ts126_trend, ts126_trend_ym, ts126_sig_a, ts126_sig_a_ym, ts126_r_a, ts126_r_a_ym, ts126_int_a, int126_a_ym = cal_trend(start_year, num_years, start_month, num_months, nx126, ny126, ts126_ym, processes=None)
 
-data126=ts126_trend
-ds126_trend = xr.DataArray(data126, coords=[ds126.lat,ds126.lon], dims=["longitude","latitude"])
+# put the SSP1_2.6 trend on the SSP5_8.5 grid so the two maps compare cell by cell
+# (the weights are built once per pair of grids and reused from disk)
+data126=regrid(ts126_trend, ds126.lon.values, ds126.lat.values, ds.lon.values, ds.lat.values, method='conservative')
+ds126_trend = xr.DataArray(data126, coords=[ds.lat,ds.lon], dims=["longitude","latitude"])
 
 
 # plot trend in global temperature change as predicted by SSP5_8.5 and SSP1_2.6
@@ -0,0 +1,78 @@
+import os
+import numpy as np
+
+
+# (time, lat, lon) chunk shape: two years of a 24x32 block, about 74 KB of float32.
+# A map (one time step) touches 36 chunks of a 144x192 grid and a city series
+# 43 chunks of an 85-year monthly record, instead of 1 and 1020 with CDS's
+# one-chunk-per-time-step layout. Uncompressed, HDF5 reads only the selected
+# part of each chunk: maps stay within about 1 ms of the CDS layout and city
+# series get 10x (uncompressed source) to 100x (zlib source) faster, see
+# benchmarks/bench_layout.py.
+CHUNKS = (24, 24, 32)
+
+# zlib level, or None for no compression. Compression halves the file but
+# every read then inflates whole chunks: maps get several times slower and
+# city series lose most of their gain, so it is off by default
+COMPLEVEL = None
+
+
+def optimize_layout(src_fn, dst_fn, variable='ts', chunks=CHUNKS, complevel=COMPLEVEL, celsius=True):
+
+    '''
+    Rewrite a CDS NetCDF file into an analysis-friendly layout:
+    variable chunked as `chunks`, stored as float32 (with zlib+shuffle
+    compression if complevel is given, see COMPLEVEL), and converted from
+    Kelvin to Celsius once (units becomes 'degC').
+    Other variables and all attributes are copied unchanged.
+    The data are streamed one time-chunk at a time.
+    '''
+
+    import netCDF4 as netcdf
+
+    src = netcdf.Dataset(src_fn, mode='r')
+    src.set_auto_mask(False)
+    tmp_fn = dst_fn + '.tmp'
+    dst = netcdf.Dataset(tmp_fn, mode='w', format='NETCDF4')
+
+    dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+    for name, dim in src.dimensions.items():
+        dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+    for name, var in src.variables.items():
+        # _FillValue can only be set when a variable is created
+        attrs = {k: var.getncattr(k) for k in var.ncattrs() if k != '_FillValue'}
+        if name != variable:
+            out = dst.createVariable(name, var.dtype, var.dimensions, fill_value=getattr(var, '_FillValue', None))
+            out.setncatts(attrs)
+            out[:] = var[:]
+            continue
+
+        chunksizes = tuple(min(c, len(src.dimensions[d])) for c, d in zip(chunks, var.dimensions))
+        fill_value = np.float32(var.getncattr('_FillValue')) if '_FillValue' in var.ncattrs() else None
+        compression = {'zlib': True, 'complevel': complevel, 'shuffle': True} if complevel else {}
+        out = dst.createVariable(name, 'f4', var.dimensions, chunksizes=chunksizes, fill_value=fill_value,
+                                 **compression)
+        to_celsius = celsius and attrs.get('units') == 'K'
+        if to_celsius:
+            attrs['units'] = 'degC'
+        out.setncatts(attrs)
+
+        nt = var.shape[0]
+        for t0 in range(0, nt, chunksizes[0]):
+            t1 = min(t0 + chunksizes[0], nt)
+            block = var[t0:t1].astype(np.float32)
+            if to_celsius:
+                valid = block != fill_value if fill_value is not None else Ellipsis
+                block[valid] -= np.float32(273.15)
+            out[t0:t1] = block
+
+    dst.close()
+    src.close()
+    os.replace(tmp_fn, dst_fn)
+    return dst_fn
+
+
+if __name__ == "__main__":
+    import sys
+    optimize_layout(sys.argv[1], sys.argv[2])
@@ -0,0 +1,120 @@
+import hashlib
+import importlib
+import inspect
+import json
+import os
+from cache_utils import SqliteStore, file_fingerprint
+
+
+# checksums and stage records, shared by every run from this directory
+PIPELINE_DB = 'pipeline.sqlite'
+
+
+def file_checksum(fn, db=PIPELINE_DB):
+
+    '''
+    sha256 of a file's contents. The digest is remembered against the file's
+    size and mtime, so an unchanged dataset is only read once.
+    '''
+
+    store = SqliteStore(db, table='checksums')
+    key = f'{os.path.abspath(fn)}:{file_fingerprint(fn)}'
+    digest = store.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(fn, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        store.set(key, digest)
+    return digest
+
+
+def _resolve(code):
+    '''A function, or a 'module' / 'module.attr' name, and the source it stands for'''
+    if not isinstance(code, str):
+        return code
+    try:
+        return importlib.import_module(code)
+    except ImportError:
+        module, attr = code.rsplit('.', 1)
+        return getattr(importlib.import_module(module), attr)
+
+
+def code_hash(*code):
+    '''sha256 of the source of functions or modules (objects or dotted names)'''
+    sha = hashlib.sha256()
+    for obj in code:
+        sha.update(inspect.getsource(_resolve(obj)).encode())
+    return sha.hexdigest()
+
+
+def stage_fingerprint(name, func, params, inputs=(), code=(), db=PIPELINE_DB):
+
+    '''
+    Fingerprint of one run of a stage: its code, its parameters, the contents
+    of any parameter naming an existing file, and the fingerprints of the
+    stages it reads from. A stage needs re-running only when this changes.
+    code: extra functions or modules the stage relies on
+    '''
+
+    files = {k: file_checksum(v, db) for k, v in params.items() if isinstance(v, str) and os.path.isfile(v)}
+    payload = json.dumps({
+        'name': name, 'code': code_hash(func, *code), 'params': params,
+        'files': files, 'inputs': list(inputs),
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class StageCache:
+
+    '''
+    Record of the fingerprint and output files of every stage run, so a stage
+    whose fingerprint is unchanged and whose outputs are still on disk is skipped.
+    namespace: keeps the records of separate pipelines (e.g. output directories) apart
+    '''
+
+    def __init__(self, db=PIPELINE_DB, namespace=''):
+        self.store = SqliteStore(db, table='stages')
+        self.namespace = namespace
+
+    def _key(self, name):
+        return f'{self.namespace}:{name}'
+
+    def lookup(self, name, fingerprint):
+        '''Output files of a previous run with the same fingerprint, or None'''
+        record = self.store.get(self._key(name))
+        if record is None or record['fingerprint'] != fingerprint:
+            return None
+        if not all(os.path.exists(fn) for fn in record['outputs']):
+            return None
+        return record['outputs']
+
+    def record(self, name, fingerprint, outputs, result=None):
+        '''Remember a run of a stage, its output files and its (JSON-serializable) result'''
+        self.store.set(self._key(name), {'fingerprint': fingerprint, 'outputs': list(outputs), 'result': result})
+
+    def result(self, name):
+        '''Result of the last recorded run of a stage'''
+        return self.store.get(self._key(name))['result']
+
+
+def run_stage(name, func, params, inputs=(), code=(), cache=None, db=PIPELINE_DB):
+
+    '''
+    Run func(**params) unless a run with the same fingerprint is recorded,
+    for stages whose result is JSON-serializable (e.g. a file name).
+    returns
+            ---> result, fingerprint (pass it as an input of downstream stages)
+    '''
+
+    cache = StageCache(db) if cache is None else cache
+    fingerprint = stage_fingerprint(name, func, params, inputs, code, db)
+    if cache.lookup(name, fingerprint) is not None:
+        return cache.result(name), fingerprint
+
+    result = func(**params)
+    # a file name result must still exist for the record to be reused
+    outputs = [result] if isinstance(result, str) and os.path.exists(result) else []
+    cache.record(name, fingerprint, outputs, result)
+    return result, fingerprint
@@ -8,6 +8,7 @@ import numpy as np
 import xarray as xr
 import matplotlib.pyplot as plt
 import plotly.express as px
+from load_data import celsius
 
 # %%
 DATA_FN = "hadgem3_gc31_ll_ssp5_8_5_data.nc"
@@ -33,8 +34,8 @@ data_fn = "hadgem3_gc31_ll_ssp5_8_5_data.nc"
 ds = xr.open_dataset(data_fn)
 
 # %%
-temp_closest_coords = (
-    ds.ts.sel(lon=coords[0], lat=coords[1], method='nearest') - 273.15).values
+temp_closest_coords = celsius(
+    ds.ts.sel(lon=coords[0], lat=coords[1], method='nearest')).values
 print(temp_closest_coords)
 timevals = time[:]
 
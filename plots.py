@@ -1,81 +1,120 @@
 from matplotlib import pyplot as plt
 import numpy as np
-from get_coords import get_coords
-
-
-def plot_monthly_trends(ds, datevar):
-    '''plot monthly trends'''
-
-    fig, (ax1, ax2, ax3, ax4) = plt.subplots(4, 3, figsize=(19, 15))
+from get_coords import get_coords, get_coords_batch
+from grid_index import GridIndex
+from point_store import open_point_store
+from products import get_product
+from load_data import celsius, read_nan, to_celsius
+from regions import REGIONS, box_indices, time_slice
+
+
+MONTHS = ['January','February','March','April','May','June','July','August','September','October','November','December']
+
+
+def monthly_differences(var, year_offset=40, start_year=0):
+
+    '''
+    Change of each calendar month between two years of a monthly (time, lat, lon)
+    series starting in January: the two years are read in one indexed slice,
+    viewed as (year, month, lat, lon) and subtracted in one operation.
+    var: numpy array, netCDF4 variable or xarray DataArray
+    returns
+            ---> (12, lat, lon) array, month m of year start_year+year_offset
+                 minus month m of year start_year
+    '''
+
+    first = start_year*12
+    last = (start_year + year_offset)*12
+    if last + 12 > var.shape[0]:
+        raise ValueError(f'year offset {year_offset} from year {start_year} runs past the end of the series')
+    idx = np.r_[first:first+12, last:last+12]
+    # missing values of a netCDF4 variable are read as NaN
+    block = var.isel({var.dims[0]: idx}).values if hasattr(var, 'isel') else read_nan(var, idx)
+    by_year = block.reshape(2, 12, *block.shape[1:])
+    return by_year[1] - by_year[0]
+
+
+def plot_month_grid(fields, lon, lat, vmin=-3, vmax=3, cmap='RdBu_r', label=None, subplot_kw=None, **mesh_kw):
+
+    '''
+    Draw 12 monthly (lat, lon) fields as a 4x3 panel sharing one normalization
+    and one colorbar.
+    subplot_kw / mesh_kw: passed to plt.subplots and to each pcolormesh call,
+    e.g. a cartopy projection and transform
+    returns
+            ---> fig, axes
+    '''
+
+    from matplotlib.colors import Normalize
+
+    # panels share their axes, so only the outer ones carry tick labels
+    share = subplot_kw is None
+    fig, axes = plt.subplots(4, 3, figsize=(19, 15), sharex=share, sharey=share, subplot_kw=subplot_kw)
     fig.subplots_adjust(hspace=0.3, wspace=0.1)
-    list_months=['January','February','March','April','May','June','July','August','September','October','November','December']
-
-    for i in range(3):
-        ax=ax1[i]
-        (ds.ts.isel(time=i+40*12)-ds.ts.isel(time=i)).plot(ax=ax, vmin=-3, vmax=3, extend='both', zorder=-3)
-        ax.set_title(list_months[i])
-
-    for i in range(3):
-        ax=ax2[i]
-        (ds.ts.isel(time=i+3+40*12)-ds.ts.isel(time=i+3)).plot(ax = ax2[i], vmin=-3, vmax=3, extend='both', zorder=-3)
-        ax.set_title(list_months[i+3])
+    norm = Normalize(vmin=vmin, vmax=vmax)
+    for ax, field, month in zip(axes.flat, fields, MONTHS):
+        mesh = ax.pcolormesh(lon, lat, field, norm=norm, cmap=cmap, shading='auto', zorder=-3, **mesh_kw)
+        ax.set_title(month)
+    fig.colorbar(mesh, ax=axes, extend='both', shrink=0.6, label=label)
+    return fig, axes
 
-    for i in range(3):
-        ax=ax3[i]
-        (ds.ts.isel(time=i+6+40*12)-ds.ts.isel(time=i+6)).plot(ax = ax, vmin=-3, vmax=3, extend='both', zorder=-3)
-        ax.set_title(list_months[i+6])
 
-    for i in range(3):
-        ax=ax4[i]
-        (ds.ts.isel(time=i+9+40*12)-ds.ts.isel(time=i+9)).plot(ax = ax4[i], vmin=-3, vmax=3, extend='both', zorder=-3)
-        ax.set_title(list_months[i+9])
+def plot_monthly_trends(ds, datevar, year_offset=40, start_year=0):
+    '''plot monthly trends: change of each month over year_offset years'''
 
-    fig.suptitle('Monthly trends: '+str(datevar[0])+' to '+str(datevar[-1]))
+    diffs = monthly_differences(ds.ts, year_offset, start_year)
+    fig, axes = plot_month_grid(diffs, ds.lon.values, ds.lat.values, label=ds.ts.attrs.get('units'))
+    fig.suptitle('Monthly trends: '+str(datevar[start_year*12])+' to '+str(datevar[(start_year+year_offset)*12+11]))
+    return fig
 
 
 def plot_cities(ds, city):
 
-    coords = get_coords(city)
+    # one city or a list of them, extracted in one read
+    cities = [city] if isinstance(city, str) else list(city)
+    lon, lat = get_coords_batch(cities)
 
     # Get data for coords and plot
-    coords = (ds.ts.sel(lon = coords[0], lat = coords[1], method = 'nearest')-273.15).plot(x="time")
-    labels = city
+    city_ts = GridIndex.from_dataset(ds).select(ds.ts, lon, lat, dim='city', labels=cities)
+    celsius(city_ts).plot.line(x="time", hue="city", add_legend=False)
+    labels = cities
     plt.legend(labels,loc='lower right')
     plt.title(f'SSP5_8.5 temperature projections for {labels}')
 
 
 def plot_cities_annual(ds, cities):
 
-    coords = get_coords(cities)
+    lon, lat = get_coords_batch(cities)
 
-    # timeseries for yearly averages
-    year_annual = (ds['ts']-273.15).groupby('time.year').mean(dim='time')
-    for coord in coords:
-        year_annual.sel(lon = coord[0], lat = coord[1], method = 'nearest').plot.line(x="year")
+    # timeseries for yearly averages, all cities in one read
+    year_annual = celsius(get_product(ds, 'annual'))
+    city_annual = GridIndex.from_dataset(ds).select(year_annual, lon, lat, dim='city', labels=cities)
+    city_annual.plot.line(x="year", hue="city", add_legend=False)
     labels = cities
     plt.legend(labels,loc='lower right')
     plt.title(f'SSP5_5.8 annual trends for {cities}')
 
 
-def subset_data(datevar, lat, lon):
-    # Get indices of time, lat and lon over the area
-    years = np.array([idx.year for idx in datevar])
+def subset_data(datevar, lat, lon, region='global', years=(2015, 2099)):
 
-    idx_lat_region  = (lat>=-90) * (lat<=90.0)
-    idx_lon_region  = (lon>=0) * (lon<=360)
-    idx_tim_region = (years>=2015) * (years<=2099)
-    # lat: -90 - 90
-    # lon: 0 - 360
-    # time: 2015 - 2099
-
-    lat_region = lat[idx_lat_region]
-    lon_region = lon[idx_lon_region]
-    dates_region  = datevar[idx_tim_region]
+    '''
+    Coordinates and dates of a region and period, from index arrays rather
+    than boolean masks (see regions.subset to cut the data itself)
+    region: name of regions.REGIONS or a (lon_min, lon_max, lat_min, lat_max) bbox
+    returns
+            ---> lat_region, lon_region, dates_region
+    '''
 
+    ii, _, lon_region = box_indices(lon, lat, REGIONS[region] if isinstance(region, str) else region)
+    lat_region = np.asarray(lat)[ii]
+    dates_region = datevar[time_slice(datevar, *years)]
     return lat_region, lon_region, dates_region
 
 def get_data_for_city(ds, city, lat, lon):
     coords = get_coords(city)
-    temp_closest_coords = (ds.ts.sel(lon = coords[0], lat = coords[1], method = 'nearest') - 273.15).values
+
+    # one contiguous read from the time-major point store
+    store = open_point_store(ds.encoding['source'])
+    temp_closest_coords = to_celsius(store.get(*coords), store.var_units)
 
     return temp_closest_coords
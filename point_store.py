@@ -0,0 +1,228 @@
+import os
+from functools import cached_property
+import numpy as np
+from cal_trend import iter_tiles, tile_shape, TILE_BUDGET
+from grid_index import GridIndex
+from load_data import NETCDF_LOCK, read_nan
+from lod import LEVELS, aggregate, aggregation_matrix, decimal_years, level_groups
+
+
+def point_store_fn(data_fn):
+    '''File name of the point-series store derived from a dataset'''
+    return os.path.splitext(data_fn)[0] + '_points.npy'
+
+
+def _lod_fn(store_fn):
+    return os.path.splitext(store_fn)[0] + '_lod.npz'
+
+
+def _level_fn(store_fn, level):
+    return os.path.splitext(store_fn)[0] + f'_{level}.npy'
+
+
+def build_point_store(data_fn, out_fn=None, variable='ts', tile_budget=TILE_BUDGET):
+
+    '''
+    Rewrite a (time, lat, lon) variable as a time-major (lat, lon, time) float32
+    array on disk, so the full series of one grid cell is a single contiguous read.
+    Missing (fill) values are stored as NaN.
+    The file is streamed in lat/lon tiles, within tile_budget bytes.
+    Coordinates and time metadata go to a companion _coords.npz file.
+    '''
+
+    import netCDF4 as netcdf
+
+    if out_fn is None:
+        out_fn = point_store_fn(data_fn)
+
+    with netcdf.Dataset(data_fn, mode='r') as ncset:
+        var = ncset[variable]
+        nt, nlat, nlon = var.shape
+
+        # per-process temporary names: concurrent builders of the same store
+        # (e.g. several server workers) never write into each other's files
+        tmp_fn = f'{out_fn}.{os.getpid()}.tmp'
+        series = np.lib.format.open_memmap(tmp_fn, mode='w+', dtype=np.float32, shape=(nlat, nlon, nt))
+        for si, sj in iter_tiles(nlat, nlon, tile_shape(nt, nlat, nlon, tile_budget)):
+            # missing cells are stored as NaN, never as raw fill values
+            series[si, sj, :] = np.moveaxis(read_nan(var, (slice(None), si, sj), np.float32), 0, -1)
+        series.flush()
+        del series
+
+        time = ncset['time']
+        coords_fn = os.path.splitext(out_fn)[0] + '_coords.npz'
+        tmp_coords_fn = f'{coords_fn}.{os.getpid()}.tmp.npz'
+        np.savez(
+            tmp_coords_fn,
+            lon=np.ma.getdata(ncset['lon'][:]), lat=np.ma.getdata(ncset['lat'][:]), time=np.ma.getdata(time[:]),
+            units=time.units, calendar=getattr(time, 'calendar', '360_day'),
+            var_units=getattr(var, 'units', ''))
+    os.replace(tmp_coords_fn, coords_fn)
+    os.replace(tmp_fn, out_fn)
+
+    # any level-of-detail pyramid belonged to the old store
+    if os.path.exists(_lod_fn(out_fn)):
+        os.remove(_lod_fn(out_fn))
+    return out_fn
+
+
+def build_pyramid(store, tile_budget=TILE_BUDGET):
+
+    '''
+    Precompute the level-of-detail pyramid of a point store: the seasonal,
+    annual and decadal means (and monthly means, for sub-monthly data) of
+    every grid cell, each as a (lat, lon, n) float32 array next to the store.
+    The x values (fractional years) of every level go to a _lod.npz file.
+    '''
+
+    nlat, nlon, nt = store.series.shape
+    dates = store.dates
+    x = decimal_years(dates)
+    level_x = {}
+
+    for level in LEVELS:
+        groups, ngroups = level_groups(dates, level)
+        weights = aggregation_matrix(groups, ngroups)
+        level_x[level] = weights @ x
+        if ngroups == nt:
+            # same resolution as the store itself
+            continue
+
+        fn = _level_fn(store.fn, level)
+        tmp_fn = f'{fn}.{os.getpid()}.tmp'
+        out = np.lib.format.open_memmap(tmp_fn, mode='w+', dtype=np.float32, shape=(nlat, nlon, ngroups))
+        for si, sj in iter_tiles(nlat, nlon, tile_shape(nt, nlat, nlon, tile_budget)):
+            block = np.asarray(store.series[si, sj], dtype=np.float64)
+            shape = block.shape[:2]
+            # missing steps (NaN) are left out of their group's mean
+            out[si, sj] = aggregate(weights, block.reshape(-1, nt)).reshape(shape + (ngroups,))
+        out.flush()
+        del out
+        os.replace(tmp_fn, fn)
+
+    tmp_fn = f'{_lod_fn(store.fn)}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_fn, **level_x)
+    os.replace(tmp_fn, _lod_fn(store.fn))
+
+
+class PointStore:
+
+    '''
+    Read-only, memory-mapped point-series store written by build_point_store.
+    series[i, j] is the full time series of grid cell (lat i, lon j).
+    '''
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.series = np.load(fn, mmap_mode='r')
+        with np.load(os.path.splitext(fn)[0] + '_coords.npz') as coords:
+            self.lon = coords['lon']
+            self.lat = coords['lat']
+            self.time = coords['time']
+            self.units = str(coords['units'])
+            self.calendar = str(coords['calendar'])
+            self.var_units = str(coords['var_units'])
+        self.grid = GridIndex(self.lon, self.lat)
+
+    @cached_property
+    def dates(self):
+        import cftime
+        return cftime.num2date(self.time, units=self.units, calendar=self.calendar)
+
+    @cached_property
+    def level_x(self):
+        '''x values (fractional years) of every pyramid level'''
+        with np.load(_lod_fn(self.fn)) as lod:
+            return {level: lod[level] for level in LEVELS}
+
+    @cached_property
+    def _levels(self):
+        levels = {}
+        for level in LEVELS:
+            fn = _level_fn(self.fn, level)
+            levels[level] = np.load(fn, mmap_mode='r') if os.path.exists(fn) else self.series
+        return levels
+
+    def level_series(self, level):
+        '''(lat, lon, n) series of every grid cell at one pyramid level (the store itself at its own resolution)'''
+        return self._levels[level]
+
+    def get_level(self, lon, lat, level):
+        '''(x, y) of the series at the grid cell nearest to (lon, lat), at one pyramid level'''
+        i, j = self.grid.nearest(lon, lat)
+        return self.level_x[level], np.array(self.level_series(level)[i, j])
+
+    def get(self, lon, lat, method='nearest'):
+        '''Time series at the grid cell nearest to (lon, lat), as a (time,) array'''
+        i, j = self.grid.nearest(lon, lat, great_circle=(method == 'great_circle'))
+        return np.array(self.series[i, j])
+
+    def get_many(self, lon, lat, method='nearest'):
+        '''Time series at a batch of points, as a (npoints, time) array'''
+        lon = np.atleast_1d(lon)
+        lat = np.atleast_1d(lat)
+        if method == 'bilinear':
+            i, j, w = self.grid.bilinear(lon, lat)
+            return np.sum(self.series[i, j] * w[..., None], axis=-2)
+        i, j = self.grid.nearest(lon, lat, great_circle=(method == 'great_circle'))
+        return np.array(self.series[i, j])
+
+
+def extract_points(stores, lon, lat, level=None, method='nearest'):
+
+    '''
+    Series of a batch of points from several stores on the same grid, e.g. one
+    per scenario: the points are located once and each store is read with a
+    single vectorized index.
+    level: a pyramid level (see lod.LEVELS) instead of the stored series
+    returns
+            ---> array of shape (npoints, nstores, time)
+    '''
+
+    grid = stores[0].grid
+    for store in stores[1:]:
+        if store.series.shape[:2] != stores[0].series.shape[:2]:
+            raise ValueError(f'{store.fn} is not on the grid of {stores[0].fn}')
+
+    lon = np.atleast_1d(lon)
+    lat = np.atleast_1d(lat)
+    if method == 'bilinear':
+        i, j, w = grid.bilinear(lon, lat)
+    else:
+        i, j = grid.nearest(lon, lat, great_circle=(method == 'great_circle'))
+
+    series = []
+    for store in stores:
+        data = store.series if level is None else store.level_series(level)
+        if method == 'bilinear':
+            series.append(np.sum(data[i, j] * w[..., None], axis=-2))
+        else:
+            series.append(np.array(data[i, j]))
+    return np.stack(series, axis=1)
+
+
+_stores = {}
+
+
+def open_point_store(data_fn, build=True):
+
+    '''
+    PointStore for a dataset, opened once per process. The store is (re)built
+    from data_fn if it is missing or older than the dataset and build is True.
+    '''
+
+    fn = point_store_fn(data_fn)
+    # builds read the NetCDF file, which one thread at a time may do
+    with NETCDF_LOCK:
+        stale = not os.path.exists(fn) or os.path.getmtime(fn) < os.path.getmtime(data_fn)
+        if stale:
+            if not build:
+                return None
+            build_point_store(data_fn, fn)
+            _stores.pop(fn, None)
+        if fn not in _stores:
+            store = PointStore(fn)
+            if not os.path.exists(_lod_fn(fn)):
+                build_pyramid(store)
+            _stores[fn] = store
+        return _stores[fn]
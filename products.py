@@ -0,0 +1,89 @@
+import hashlib
+import os
+
+
+# where derived products are persisted between runs
+PRODUCTS_DIR = 'products'
+
+PRODUCTS = ('annual', 'seasonal', 'monthly_climatology', 'anomaly')
+SEASONS = ('DJF', 'MAM', 'JJA', 'SON')
+
+_memory = {}
+
+
+def _source_fn(ds):
+    return ds.encoding['source']
+
+
+def product_key(ds, product, **params):
+
+    '''
+    Cache key for a derived product: (model_experiment, product, params), plus a
+    fingerprint of the source file so products are recomputed when it changes.
+    '''
+
+    data_fn = _source_fn(ds)
+    stat = os.stat(data_fn)
+    name = os.path.basename(data_fn)
+    source = name[:-len('_data.nc')] if name.endswith('_data.nc') else os.path.splitext(name)[0]
+    fingerprint = hashlib.sha1(f'{os.path.abspath(data_fn)}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:12]
+    parts = [source, product] + [f'{k}-{params[k]}' for k in sorted(params)] + [fingerprint]
+    return '_'.join(parts)
+
+
+def _check(product, params):
+    if product not in PRODUCTS:
+        raise ValueError(f'Unknown product {product}, expected one of {PRODUCTS}')
+    if product == 'seasonal' and params.get('season') not in SEASONS:
+        raise ValueError(f"The seasonal product needs season= one of {SEASONS}, got {params.get('season')}")
+
+
+def compute_product(ds, product, variable='ts', **params):
+
+    '''
+    Compute a derived product over the whole cube
+    annual: yearly means
+    seasonal: yearly means of one season, season='DJF'/'MAM'/'JJA'/'SON'
+    monthly_climatology: mean of each calendar month
+    anomaly: departure from the monthly climatology
+    '''
+
+    _check(product, params)
+    var = ds[variable]
+    if product == 'annual':
+        return var.groupby('time.year').mean(dim='time')
+    if product == 'seasonal':
+        season = params['season']
+        return var.where(var['time.season'] == season).groupby('time.year').mean(dim='time')
+    if product == 'monthly_climatology':
+        return var.groupby('time.month').mean(dim='time')
+    if product == 'anomaly':
+        climatology = get_product(ds, 'monthly_climatology', variable=variable)
+        return (var.groupby('time.month') - climatology).drop_vars('month')
+
+
+def get_product(ds, product, variable='ts', **params):
+
+    '''
+    Derived product for a dataset, computed once and then served from memory
+    or from PRODUCTS_DIR. Point and map queries slice the returned cube.
+    '''
+
+    import xarray as xr
+
+    _check(product, params)
+    key = product_key(ds, product, variable=variable, **params)
+    if key in _memory:
+        return _memory[key]
+
+    fn = os.path.join(PRODUCTS_DIR, key + '.nc')
+    if not os.path.exists(fn):
+        os.makedirs(PRODUCTS_DIR, exist_ok=True)
+        result = compute_product(ds, product, variable=variable, **params)
+        result.attrs.update(ds[variable].attrs)
+        tmp_fn = fn + '.tmp'
+        result.rename(variable).to_netcdf(tmp_fn)
+        os.replace(tmp_fn, fn)
+
+    _memory[key] = xr.open_dataarray(fn)
+    return _memory[key]
@@ -0,0 +1,218 @@
+import hashlib
+from collections import namedtuple
+import numpy as np
+from cache_utils import LRUCache
+from cal_trend import TILE_BUDGET
+from regrid import grid_key
+
+
+# (lon_min, lon_max, lat_min, lat_max) in degrees, in the order of
+# cartopy's set_extent; lon_min > lon_max is fine for a box across the
+# dateline, and either longitude convention works on either grid
+REGIONS = {
+    'global': (-180.0, 180.0, -90.0, 90.0),
+    'northern_hemisphere': (-180.0, 180.0, 0.0, 90.0),
+    'southern_hemisphere': (-180.0, 180.0, -90.0, 0.0),
+    'tropics': (-180.0, 180.0, -23.5, 23.5),
+    'arctic': (-180.0, 180.0, 66.5, 90.0),
+    'antarctic': (-180.0, 180.0, -90.0, -66.5),
+    'iceland': (-40.0, 20.0, 40.0, 80.0),
+    'europe': (-10.0, 40.0, 35.0, 70.0),
+    'north_america': (-170.0, -50.0, 15.0, 75.0),
+    'africa': (-20.0, 52.0, -35.0, 37.0),
+    'australia': (112.0, 154.0, -44.0, -10.0),
+}
+
+# suffixes of a region name restricting it to land or sea cells, e.g. 'europe:land'
+SURFACES = ('land', 'sea')
+
+# cells of a region and their area weights (summing to 1), over the flattened (lat, lon) grid
+RegionMask = namedtuple('RegionMask', ['name', 'cells', 'weights'])
+
+_masks = LRUCache(maxsize=256)
+
+
+def area_weights(lat, lon=None):
+    '''cos(lat) weight of each grid row, or of each (lat, lon) cell if lon is given'''
+    weights = np.cos(np.radians(np.asarray(lat, dtype=np.float64))).clip(0.0, None)
+    if lon is None:
+        return weights
+    return np.broadcast_to(weights[:, None], (len(weights), len(lon)))
+
+
+def _bbox(region):
+    '''(name, bbox, surface) of a region given by name, 'name:surface' or bbox'''
+    if not isinstance(region, str):
+        return tuple(region), tuple(float(v) for v in region), None
+    name, _, surface = region.partition(':')
+    if name in SURFACES and not surface:
+        name, surface = 'global', name
+    if name not in REGIONS:
+        raise ValueError(f'Unknown region {name}, expected one of {tuple(REGIONS)} or a bbox')
+    if surface and surface not in SURFACES:
+        raise ValueError(f'Unknown surface {surface}, expected one of {SURFACES}')
+    return region, REGIONS[name], surface or None
+
+
+def box_indices(lon, lat, bbox):
+
+    '''
+    Rows and columns of the grid inside a bounding box. Longitudes inside the
+    box are returned in the box's convention, ordered west to east, so a box
+    across 0 deg on a 0..360 grid comes out contiguous.
+    returns
+            ---> ii: lat indices, jj: lon indices, box_lon: their longitudes
+    '''
+
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    lon_min, lon_max, lat_min, lat_max = bbox
+    ii = np.flatnonzero((lat >= lat_min) & (lat <= lat_max))
+    span = (lon_max - lon_min) % 360.0 or 360.0
+    offset = (lon - lon_min) % 360.0
+    jj = np.flatnonzero(offset <= span)
+    jj = jj[np.argsort(offset[jj], kind='stable')]
+    return ii, jj, lon_min + offset[jj]
+
+
+def region_mask(lon, lat, region, land_fraction=None):
+
+    '''
+    Compact mask of one region: the flat indices of its cells and their
+    normalized cos(lat) weights. Land and sea regions weight each cell by
+    its land (or sea) fraction, so coastal cells count in part.
+    region: name of REGIONS, 'name:land' / 'name:sea' ('land' and 'sea' alone
+            are global), or a (lon_min, lon_max, lat_min, lat_max) bbox
+    land_fraction: (lat, lon) land fraction, 0..1 or percent (CMIP6 sftlf)
+    '''
+
+    name, bbox, surface = _bbox(region)
+    ii, jj, _ = box_indices(lon, lat, bbox)
+    cells = (ii[:, None] * len(lon) + jj[None, :]).ravel()
+    weights = np.repeat(area_weights(lat)[ii], len(jj))
+    if surface is not None:
+        if land_fraction is None:
+            raise ValueError(f'Region {name} needs a land fraction')
+        fraction = np.asarray(land_fraction, dtype=np.float64).ravel()[cells]
+        fraction = fraction / 100.0 if np.nanmax(land_fraction) > 1.0 else fraction
+        weights = weights * (fraction if surface == 'land' else 1.0 - fraction)
+    keep = weights > 0
+    cells, weights = cells[keep], weights[keep]
+    if not len(cells):
+        raise ValueError(f'Region {name} contains no grid cells')
+    return RegionMask(name, cells.astype(np.int32), weights / weights.sum())
+
+
+def region_masks(lon, lat, regions, land_fraction=None):
+    '''region_mask for each region, computed once per grid (and land fraction)'''
+    land_key = None if land_fraction is None else hashlib.sha1(np.ascontiguousarray(land_fraction, dtype=np.float64).tobytes()).hexdigest()
+    grid = grid_key(lon, lat)
+    masks = []
+    for region in regions:
+        key = (grid, land_key, region if isinstance(region, str) else tuple(region))
+        mask = _masks.get(key)
+        if mask is None:
+            mask = region_mask(lon, lat, region, land_fraction)
+            _masks.set(key, mask)
+        masks.append(mask)
+    return masks
+
+
+def weight_matrix(masks, ncells):
+    '''(nregions, ncells) sparse matrix whose rows are the regions' weights'''
+    from scipy import sparse
+
+    rows = np.concatenate([np.full(len(m.cells), k) for k, m in enumerate(masks)])
+    cols = np.concatenate([m.cells for m in masks])
+    values = np.concatenate([m.weights for m in masks])
+    return sparse.csr_matrix((values, (rows, cols)), shape=(len(masks), ncells))
+
+
+def _apply(matrix, block):
+    '''(nt, nregions) weighted means of a (nt, ncells) block, renormalized over missing cells'''
+    valid = np.isfinite(block)
+    if valid.all():
+        return (matrix @ block.T).T
+    total = (matrix @ np.where(valid, block, 0.0).T).T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / (matrix @ valid.T.astype(np.float64)).T
+
+
+def regional_means(data, lon, lat, regions, land_fraction=None):
+
+    '''
+    Area-weighted mean series of many regions of a (..., lat, lon) array
+    or DataArray, all regions in one sparse product over the data. The grid
+    is only reshaped (a view), never masked or subset copy by copy.
+    returns
+            ---> (..., nregions) array, or a DataArray with a 'region' dim
+    '''
+
+    masks = region_masks(lon, lat, regions, land_fraction)
+    matrix = weight_matrix(masks, len(lat) * len(lon))
+    values = data.values if hasattr(data, 'dims') else np.asarray(data)
+    lead = values.shape[:-2]
+    means = _apply(matrix, values.reshape(-1, len(lat) * len(lon))).reshape(lead + (len(masks),))
+    if hasattr(data, 'dims'):
+        import xarray as xr
+        coords = {k: v for k, v in data.coords.items() if set(v.dims) <= set(data.dims[:-2])}
+        coords['region'] = [m.name if isinstance(m.name, str) else str(m.name) for m in masks]
+        return xr.DataArray(means, coords=coords, dims=data.dims[:-2] + ('region',), name=data.name, attrs=data.attrs)
+    return means
+
+
+def regional_means_file(data_fn, regions, variable='ts', land_fraction=None, tile_budget=TILE_BUDGET):
+
+    '''
+    regional_means of a variable of a NetCDF file in degC, streamed in
+    blocks of time steps sized to tile_budget bytes: one pass over the file
+    for all regions.
+    returns
+            ---> (time, nregions) array
+    '''
+
+    import netCDF4 as netcdf
+    from load_data import to_celsius
+
+    with netcdf.Dataset(data_fn, mode='r') as ncset:
+        lon, lat = np.ma.getdata(ncset['lon'][:]), np.ma.getdata(ncset['lat'][:])
+        var = ncset[variable]
+        masks = region_masks(lon, lat, regions, land_fraction)
+        matrix = weight_matrix(masks, len(lat) * len(lon))
+        nt = var.shape[0]
+        block = max(1, tile_budget // (len(lat) * len(lon) * 8))
+        means = np.empty((nt, len(masks)))
+        for t0 in range(0, nt, block):
+            # missing cells (_FillValue) become NaN, which _apply leaves out of the means
+            values = np.ma.filled(np.ma.asarray(var[t0:t0 + block]).astype(np.float64), np.nan)
+            values = values.reshape(-1, len(lat) * len(lon))
+            means[t0:t0 + block] = _apply(matrix, values)
+        return to_celsius(means, getattr(var, 'units', 'K'))
+
+
+def time_slice(datevar, first_year, last_year):
+    '''Slice of the time steps from first_year to last_year inclusive, of an ordered date array'''
+    years = np.array([date.year for date in datevar])
+    idx = np.flatnonzero((years >= first_year) & (years <= last_year))
+    if not len(idx):
+        return slice(0, 0)
+    return slice(int(idx[0]), int(idx[-1]) + 1)
+
+
+def subset(data, lon, lat, region, time=slice(None)):
+
+    '''
+    Box of a region cut from a (time, lat, lon) numpy array or netCDF4
+    variable in a single indexing step (a netCDF4 variable only reads the box).
+    Boxes across the 0/360 seam are read in increasing longitude index, which
+    is all older netCDF4 versions accept, and put back in box order after.
+    returns
+            ---> box_lon, box_lat, (time, box_lat, box_lon) values
+    '''
+
+    _, bbox, _ = _bbox(region)
+    ii, jj, box_lon = box_indices(lon, lat, bbox)
+    rows = slice(int(ii[0]), int(ii[-1]) + 1) if len(ii) else slice(0, 0)
+    order = np.argsort(jj, kind='stable')
+    values = data[time, rows, jj[order]]
+    return box_lon, np.asarray(lat)[rows], values[..., np.argsort(order)]
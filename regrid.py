@@ -0,0 +1,192 @@
+import hashlib
+import os
+import numpy as np
+from cache_utils import LRUCache
+from grid_index import GridIndex
+
+
+# weight matrices, one file per (method, source grid, target grid)
+REGRID_DIR = 'regrid_weights'
+METHODS = ('bilinear', 'conservative')
+
+_weights = LRUCache(maxsize=16)
+
+
+def grid_key(lon, lat):
+    '''Short digest identifying a lon/lat grid'''
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    return hashlib.sha1(lon.tobytes() + b'|' + lat.tobytes()).hexdigest()[:12]
+
+
+def weights_path(src_lon, src_lat, dst_lon, dst_lat, method='bilinear', weights_dir=REGRID_DIR):
+    return os.path.join(weights_dir, f'{method}_{grid_key(src_lon, src_lat)}_{grid_key(dst_lon, dst_lat)}.npz')
+
+
+def cell_bounds(centres, lo=None, hi=None):
+
+    '''
+    Lower and upper edges of the cells of a 1D coordinate, halfway between
+    centres; the outer edges are extrapolated and clipped to lo..hi.
+    returns
+            ---> (n, 2) array, lower edge first whatever the coordinate's direction
+    '''
+
+    centres = np.asarray(centres, dtype=np.float64)
+    if len(centres) == 1:
+        edges = centres + np.array([-0.5, 0.5]) * (hi - lo if lo is not None and hi is not None else 1.0)
+    else:
+        mid = 0.5 * (centres[1:] + centres[:-1])
+        edges = np.concatenate([[2 * centres[0] - mid[0]], mid, [2 * centres[-1] - mid[-1]]])
+    if lo is not None or hi is not None:
+        edges = np.clip(edges, lo, hi)
+    bounds = np.stack([edges[:-1], edges[1:]], axis=-1)
+    return np.sort(bounds, axis=-1)
+
+
+def _overlap(src, dst, period=None):
+    '''(ndst, nsrc) overlap lengths of two sets of intervals, wrapping around period if given'''
+    shifts = (-period, 0.0, period) if period else (0.0,)
+    total = 0.0
+    for shift in shifts:
+        lo = np.maximum(dst[:, None, 0], src[None, :, 0] + shift)
+        hi = np.minimum(dst[:, None, 1], src[None, :, 1] + shift)
+        total = total + np.clip(hi - lo, 0.0, None)
+    return total
+
+
+def _normalize_rows(matrix):
+    '''Rows summing to 1, so partly covered target cells average what they overlap'''
+    from scipy import sparse
+
+    matrix = sparse.csr_matrix(matrix)
+    sums = np.asarray(matrix.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore'):
+        scale = np.where(sums > 0, 1.0 / sums, 0.0)
+    return sparse.diags(scale) @ matrix
+
+
+def bilinear_weights(src_lon, src_lat, dst_lon, dst_lat):
+    '''(ndst, nsrc) sparse matrix interpolating a source field bilinearly at every target cell centre'''
+    from scipy import sparse
+
+    src = GridIndex(src_lon, src_lat)
+    lon2d, lat2d = np.meshgrid(dst_lon, dst_lat)
+    i, j, w = src.bilinear(lon2d, lat2d)
+    rows = np.repeat(np.arange(lon2d.size), 4)
+    cols = (i * src.nlon + j).ravel()
+    shape = (lon2d.size, src.nlat * src.nlon)
+    # coo sums the duplicate entries of stencils that collapse at the edges
+    return sparse.coo_matrix((w.ravel(), (rows, cols)), shape=shape).tocsr()
+
+
+def conservative_weights(src_lon, src_lat, dst_lon, dst_lat):
+
+    '''
+    (ndst, nsrc) sparse matrix of first-order conservative remapping: each
+    target cell is the area-weighted mean of the source cells it overlaps.
+    On rectilinear grids the overlap areas factor into a latitude part
+    (overlap in sin(lat), proportional to area) and a longitude part, so the
+    matrix is the Kronecker product of two small 1D overlap matrices.
+    '''
+
+    from scipy import sparse
+
+    src = GridIndex(src_lon, src_lat)
+    lat_overlap = _overlap(np.sin(np.radians(cell_bounds(src_lat, -90.0, 90.0))),
+                           np.sin(np.radians(cell_bounds(dst_lat, -90.0, 90.0))))
+    lon_overlap = _overlap(cell_bounds(src_lon), cell_bounds(dst_lon), period=360.0 if src.periodic else None)
+    matrix = sparse.kron(sparse.csr_matrix(lat_overlap), sparse.csr_matrix(lon_overlap))
+    return _normalize_rows(matrix)
+
+
+def weights(src_lon, src_lat, dst_lon, dst_lat, method='bilinear', weights_dir=REGRID_DIR):
+
+    '''
+    Regridding matrix from one lon/lat grid to another, built once and kept
+    on disk (and in memory) for every later call with the same grids.
+    returns
+            ---> (ndst, nsrc) scipy.sparse csr matrix over flattened (lat, lon) cells
+    '''
+
+    from scipy import sparse
+
+    if method not in METHODS:
+        raise ValueError(f'Unknown method {method}, expected one of {METHODS}')
+    fn = weights_path(src_lon, src_lat, dst_lon, dst_lat, method, weights_dir)
+    matrix = _weights.get(fn)
+    if matrix is not None:
+        return matrix
+
+    if os.path.exists(fn):
+        matrix = sparse.load_npz(fn).tocsr()
+    else:
+        build = bilinear_weights if method == 'bilinear' else conservative_weights
+        matrix = build(src_lon, src_lat, dst_lon, dst_lat).tocsr()
+        matrix.eliminate_zeros()
+        os.makedirs(weights_dir, exist_ok=True)
+        tmp_fn = f'{fn}.{os.getpid()}.tmp.npz'
+        sparse.save_npz(tmp_fn, matrix)
+        os.replace(tmp_fn, fn)
+
+    _weights.set(fn, matrix)
+    return matrix
+
+
+def apply_weights(matrix, data, dst_shape):
+
+    '''
+    Regrid a (..., lat, lon) array with a weight matrix as one sparse
+    matrix product over all leading (e.g. time) steps at once.
+    returns
+            ---> (..., dst_nlat, dst_nlon) array
+    '''
+
+    data = np.asarray(data)
+    if data.dtype == np.float32:
+        # single precision data (as stored in the CMIP6 files) stays single precision
+        matrix = matrix.astype(np.float32)
+    lead = data.shape[:-2]
+    flat = data.reshape(-1, data.shape[-2] * data.shape[-1])
+    # (ndst, nsrc) @ (nsrc, nt): the sparse rows run over contiguous time columns
+    out = matrix @ flat.T
+    return np.ascontiguousarray(out.T).reshape(lead + tuple(dst_shape))
+
+
+def regrid(data, src_lon, src_lat, dst_lon, dst_lat, method='bilinear', weights_dir=REGRID_DIR):
+
+    '''
+    Regrid a (..., lat, lon) numpy array or xarray DataArray onto another
+    lon/lat grid. A DataArray keeps its other coordinates and takes the
+    target lon/lat.
+    '''
+
+    matrix = weights(src_lon, src_lat, dst_lon, dst_lat, method, weights_dir)
+    dst_shape = (len(dst_lat), len(dst_lon))
+    if hasattr(data, 'dims'):
+        import xarray as xr
+        lat_dim, lon_dim = data.dims[-2:]
+        values = apply_weights(matrix, data.values, dst_shape)
+        coords = {k: v for k, v in data.coords.items() if lat_dim not in v.dims and lon_dim not in v.dims}
+        coords.update({lat_dim: np.asarray(dst_lat), lon_dim: np.asarray(dst_lon)})
+        return xr.DataArray(values, coords=coords, dims=data.dims, name=data.name, attrs=data.attrs)
+    return apply_weights(matrix, data, dst_shape)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import netCDF4 as netcdf
+
+    src_fn, dst_fn = sys.argv[1], sys.argv[2]
+    method = sys.argv[3] if len(sys.argv) > 3 else 'bilinear'
+    with netcdf.Dataset(src_fn, mode='r') as src, netcdf.Dataset(dst_fn, mode='r') as dst:
+        src.set_auto_mask(False)
+        grids = (src['lon'][:], src['lat'][:], dst['lon'][:], dst['lat'][:])
+        cube = src['ts'][:]
+    t0 = time.perf_counter()
+    weights(*grids, method=method)
+    t1 = time.perf_counter()
+    out = regrid(cube, *grids, method=method)
+    t2 = time.perf_counter()
+    print(f'{method}: weights {t1 - t0:.2f} s, {cube.shape} -> {out.shape} in {t2 - t1:.2f} s')
@@ -0,0 +1,357 @@
+'''
+Batch report: every figure of the analysis for one or more scenarios,
+rendered headless into a directory of PNG/PDF files.
+
+    python report.py [out_dir] [ssp5_8_5,ssp1_2_6]
+
+The report is a list of tasks with explicit dependencies. Data tasks compute
+the shared intermediates (grid, trends, annual means, ...) once and save them
+as .npz files; figure tasks load only the intermediates they depend on and
+save one figure. Tasks run in worker processes with the Agg backend as soon
+as their dependencies are done.
+
+Runs are incremental: a task is skipped when its fingerprint (code, parameters,
+dataset checksums and upstream fingerprints, see pipeline.py) matches the last
+run into the same directory and its files are still there.
+'''
+
+import os
+from collections import namedtuple
+import numpy as np
+from pipeline import PIPELINE_DB, StageCache, stage_fingerprint
+
+
+MODEL = 'hadgem3_gc31_ll'
+SCENARIOS = {'ssp5_8_5': 'SSP5-8.5', 'ssp1_2_6': 'SSP1-2.6'}
+CITIES = ['Jerusalem', 'Cincinnati', 'Stockholm']
+REQUEST = {'temp_res': 'monthly', 'variable': 'surface_temperature', 'date': '2015-01-01/2099-12-31'}
+REPORT_DIR = 'report'
+FORMATS = ('png',)
+
+# one unit of work: func(inputs, **params), inputs mapping each name in deps to its data.
+# Data tasks return a dict of arrays, figure tasks a matplotlib figure.
+# code: other functions or modules ('module' / 'module.attr') the task relies on,
+# so that editing them re-runs it
+Task = namedtuple('Task', ['name', 'func', 'deps', 'params', 'figure', 'code'], defaults=((),))
+
+
+def data_fn(scenario, model=MODEL):
+    return f'{model}_{scenario}_data.nc'
+
+
+#######################################################################
+# data tasks                                                          #
+#######################################################################
+
+
+def ingest_data(inputs, experiment, model, temp_res, variable, date):
+    '''the scenario's data file, downloaded through the data store if missing'''
+    from retrieve_data import retrieve_data
+    return {'data_fn': np.array(retrieve_data(temp_res, experiment, variable, model, date))}
+
+
+def grid_data(inputs, data_fn, variable='ts'):
+    import netCDF4 as netcdf
+    with netcdf.Dataset(data_fn, mode='r') as ncset:
+        var = ncset[variable]
+        return {'lon': ncset['lon'][:], 'lat': ncset['lat'][:], 'units': getattr(var, 'units', 'K')}
+
+
+def trend_data(inputs, data_fn, variable='ts'):
+    '''per-year trend and its significance in percent, 100*(1 - p), of every grid cell, from whole years of monthly data'''
+    import netCDF4 as netcdf
+    from cal_trend import cal_trend_tiled
+
+    with netcdf.Dataset(data_fn, mode='r') as ncset:
+        num_years = ncset[variable].shape[0] // 12
+    trend, _, sig_a, _, _, _, _, _ = cal_trend_tiled(data_fn, 0, num_years, 0, 12, variable=variable)
+    return {'trend': trend, 'sig': sig_a}
+
+
+def annual_data(inputs, data_fn, variable='ts'):
+    '''annual means in degC, streamed one year at a time, over the months that are not missing'''
+    import cftime
+    import netCDF4 as netcdf
+    from load_data import read_nan, to_celsius
+
+    with netcdf.Dataset(data_fn, mode='r') as ncset:
+        var = ncset[variable]
+        nyears = var.shape[0] // 12
+        annual = np.empty((nyears,) + var.shape[1:], dtype=np.float32)
+        for year in range(nyears):
+            months = read_nan(var, slice(year*12, (year+1)*12))
+            # cells missing all year stay NaN, as in the trend maps
+            with np.errstate(invalid='ignore'):
+                annual[year] = np.nansum(months, axis=0) / np.isfinite(months).sum(axis=0)
+        time = ncset['time']
+        dates = cftime.num2date(time[::12][:nyears], units=time.units, calendar=getattr(time, 'calendar', '360_day'))
+        return {'annual': to_celsius(annual, getattr(var, 'units', 'K')), 'years': np.array([d.year for d in dates])}
+
+
+def monthly_diff_data(inputs, data_fn, year_offset=40, variable='ts'):
+    import netCDF4 as netcdf
+    from plots import monthly_differences
+
+    with netcdf.Dataset(data_fn, mode='r') as ncset:
+        return {'diff': monthly_differences(ncset[variable], year_offset), 'year_offset': year_offset}
+
+
+def cities_data(inputs, cities, grid, annual):
+    '''annual series of each city, from the annual means'''
+    from get_coords import get_coords_batch
+    from grid_index import GridIndex
+
+    lon, lat = get_coords_batch(cities)
+    index = GridIndex(inputs[grid]['lon'], inputs[grid]['lat'])
+    return {'series': index.extract(inputs[annual]['annual'], lon, lat).T, 'years': inputs[annual]['years'],
+            'cities': np.array(cities)}
+
+
+#######################################################################
+# figure tasks                                                        #
+#######################################################################
+
+
+def trend_map(inputs, grid, trend, title):
+    from matplotlib import pyplot as plt
+
+    g = inputs[grid]
+    fig, ax = plt.subplots(figsize=(10, 5))
+    mesh = ax.pcolormesh(g['lon'], g['lat'], 10.*inputs[trend]['trend'], vmin=-1, vmax=1, cmap='RdBu_r', shading='auto', rasterized=True)
+    # hatch the cells whose trend is significant at the 5% level
+    ax.contourf(g['lon'], g['lat'], inputs[trend]['sig'] >= 95, levels=[0.5, 1.5], hatches=['..'], colors='none')
+    fig.colorbar(mesh, ax=ax, shrink=0.8, extend='both', label='K/decade')
+    ax.set_title(title)
+    return fig
+
+
+def compare_trend_maps(inputs, grid, trends, titles):
+    '''trend maps side by side, sharing one colour scale'''
+    from matplotlib import pyplot as plt
+
+    g = inputs[grid]
+    fig, axes = plt.subplots(1, len(trends), figsize=(10*len(trends), 5), sharex=True, sharey=True, squeeze=False)
+    for ax, trend, title in zip(axes.flat, trends, titles):
+        mesh = ax.pcolormesh(g['lon'], g['lat'], 10.*inputs[trend]['trend'], vmin=-1, vmax=1, cmap='RdBu_r', shading='auto', rasterized=True)
+        ax.set_title(title)
+    fig.colorbar(mesh, ax=axes, shrink=0.8, extend='both', label='K/decade')
+    return fig
+
+
+def monthly_trends(inputs, grid, monthly_diff, title):
+    from plots import plot_month_grid
+
+    g = inputs[grid]
+    fig, _ = plot_month_grid(inputs[monthly_diff]['diff'], g['lon'], g['lat'], label=str(g['units']), rasterized=True)
+    fig.suptitle(title)
+    return fig
+
+
+def average_diff(inputs, grid, annual, title):
+    '''difference between the last and the first annual mean'''
+    from matplotlib import pyplot as plt
+
+    g = inputs[grid]
+    annual = inputs[annual]
+    fig, ax = plt.subplots(figsize=(10, 5))
+    mesh = ax.pcolormesh(g['lon'], g['lat'], annual['annual'][-1] - annual['annual'][0],
+                         vmin=-3, vmax=3, cmap='RdBu_r', shading='auto', rasterized=True)
+    fig.colorbar(mesh, ax=ax, shrink=0.8, extend='both', label='°C')
+    ax.set_title(f"{title}: {annual['years'][0]} vs {annual['years'][-1]}")
+    return fig
+
+
+def cities_annual(inputs, cities, titles, ylim=None):
+    '''annual series of the same cities, one panel per scenario'''
+    from matplotlib import pyplot as plt
+
+    fig, axes = plt.subplots(1, len(cities), figsize=(10*len(cities), 6), sharey=True, squeeze=False)
+    for ax, name, title in zip(axes.flat, cities, titles):
+        data = inputs[name]
+        ax.plot(data['years'], data['series'].T)
+        ax.legend(list(data['cities']), loc='lower right')
+        ax.set_ylabel('°C')
+        if ylim is not None:
+            ax.set_ylim(ylim)
+        ax.set_title(title)
+    return fig
+
+
+def report_tasks(scenarios=SCENARIOS, cities=CITIES, model=MODEL):
+
+    '''
+    Tasks of the full report for the given scenarios ({name: label}).
+    Intermediates are named '<scenario>:<name>', figures '<scenario>/<name>'
+    and 'compare/<name>' across scenarios.
+    '''
+
+    first = next(iter(scenarios))
+    tasks = [Task('grid', grid_data, (f'{first}:ingest',), {'data_fn': data_fn(first, model)}, False)]
+    for scenario, label in scenarios.items():
+        fn = data_fn(scenario, model)
+        ingest = f'{scenario}:ingest'
+        tasks += [
+            Task(ingest, ingest_data, (), dict(REQUEST, experiment=scenario, model=model), False,
+                 ('retrieve_data', 'download_manager')),
+            Task(f'{scenario}:trend', trend_data, (ingest,), {'data_fn': fn}, False, ('cal_trend',)),
+            Task(f'{scenario}:annual', annual_data, (ingest,), {'data_fn': fn}, False,
+                 ('load_data.read_nan', 'load_data.to_celsius')),
+            Task(f'{scenario}:monthly_diff', monthly_diff_data, (ingest,), {'data_fn': fn}, False,
+                 ('plots.monthly_differences', 'load_data.read_nan')),
+            Task(f'{scenario}:cities', cities_data, ('grid', f'{scenario}:annual'),
+                 {'cities': list(cities), 'grid': 'grid', 'annual': f'{scenario}:annual'}, False, ('grid_index',)),
+
+            Task(f'{scenario}/trend', trend_map, ('grid', f'{scenario}:trend'),
+                 {'grid': 'grid', 'trend': f'{scenario}:trend', 'title': f'Temperature trend (K/decade), {label}'}, True),
+            Task(f'{scenario}/monthly_trends', monthly_trends, ('grid', f'{scenario}:monthly_diff'),
+                 {'grid': 'grid', 'monthly_diff': f'{scenario}:monthly_diff', 'title': f'Monthly trends, {label}'}, True,
+                 ('plots.plot_month_grid',)),
+            Task(f'{scenario}/average_diff', average_diff, ('grid', f'{scenario}:annual'),
+                 {'grid': 'grid', 'annual': f'{scenario}:annual', 'title': f'Annual mean difference, {label}'}, True),
+            Task(f'{scenario}/cities_annual', cities_annual, (f'{scenario}:cities',),
+                 {'cities': [f'{scenario}:cities'], 'titles': [f'{label} yearly trends']}, True),
+        ]
+    if len(scenarios) > 1:
+        trends = [f'{scenario}:trend' for scenario in scenarios]
+        city_series = [f'{scenario}:cities' for scenario in scenarios]
+        tasks += [
+            Task('compare/trend', compare_trend_maps, ('grid',) + tuple(trends),
+                 {'grid': 'grid', 'trends': trends,
+                  'titles': [f'Temperature trend (K/decade), {label}' for label in scenarios.values()]}, True),
+            Task('compare/cities_annual', cities_annual, tuple(city_series),
+                 {'cities': city_series, 'titles': [f'{label} yearly trends' for label in scenarios.values()]}, True),
+        ]
+    return tasks
+
+
+#######################################################################
+# execution                                                           #
+#######################################################################
+
+
+def _safe_name(name):
+    return name.replace(':', '__').replace('/', os.sep)
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _load(fn):
+    with np.load(fn, allow_pickle=False) as data:
+        return {k: data[k] for k in data.files}
+
+
+def run_task(task, dep_fns, out_dir, formats=FORMATS):
+
+    '''
+    Run one task with its dependencies loaded from disk.
+    returns
+            ---> list of files written
+    '''
+
+    inputs = {dep: _load(fn) for dep, fn in dep_fns.items()}
+    result = task.func(inputs, **task.params)
+
+    if task.figure:
+        from matplotlib import pyplot as plt
+        fns = []
+        for fmt in formats:
+            fn = os.path.join(out_dir, _safe_name(task.name) + '.' + fmt)
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            result.savefig(fn, dpi=100, bbox_inches='tight')
+            fns.append(fn)
+        plt.close(result)
+        return fns
+
+    fn = os.path.join(out_dir, 'data', _safe_name(task.name) + '.npz')
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    np.savez(fn + '.tmp.npz', **result)
+    os.replace(fn + '.tmp.npz', fn)
+    return [fn]
+
+
+def build_report(tasks=None, out_dir=REPORT_DIR, formats=FORMATS, max_workers=None, incremental=True, db=PIPELINE_DB):
+
+    '''
+    Run a list of tasks in worker processes, each as soon as all its
+    dependencies are done, and return {task name: files written}.
+    max_workers: worker processes (None = all cores, 1 = no pool)
+    incremental: skip tasks whose fingerprint and files are unchanged since
+                 the last run into out_dir
+    '''
+
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+    tasks = report_tasks() if tasks is None else tasks
+    by_name = {task.name: task for task in tasks}
+    for task in tasks:
+        missing = [dep for dep in task.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f'Task {task.name} depends on unknown tasks {missing}')
+
+    outputs = {}
+    fingerprints = {}
+    pending = list(tasks)
+    cache = StageCache(db, namespace=os.path.abspath(out_dir))
+
+    def ready():
+        # tasks whose dependencies are done, minus those found up to date.
+        # Fingerprints are taken only now, once upstream files exist
+        batch = []
+        while True:
+            found = [task for task in pending if all(dep in outputs for dep in task.deps)]
+            if not found:
+                return batch
+            for task in found:
+                pending.remove(task)
+                params = dict(task.params, formats=list(formats)) if task.figure else task.params
+                fingerprints[task.name] = stage_fingerprint(
+                    task.name, task.func, params, [fingerprints[dep] for dep in task.deps], task.code, db)
+                fns = cache.lookup(task.name, fingerprints[task.name]) if incremental else None
+                if fns is None:
+                    batch.append(task)
+                else:
+                    outputs[task.name] = fns
+            if batch:
+                return batch
+
+    def done(name, fns):
+        outputs[name] = fns
+        cache.record(name, fingerprints[name], fns)
+
+    def dep_fns(task):
+        return {dep: outputs[dep][0] for dep in task.deps}
+
+    if max_workers == 1:
+        _init_worker()
+        while pending:
+            batch = ready()
+            if not batch and pending:
+                raise ValueError(f'Circular dependencies between {[task.name for task in pending]}')
+            for task in batch:
+                done(task.name, run_task(task, dep_fns(task), out_dir, formats))
+        return outputs
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as pool:
+        running = {}
+        while pending or running:
+            for task in ready():
+                running[pool.submit(run_task, task, dep_fns(task), out_dir, formats)] = task.name
+            if not running:
+                if pending:
+                    raise ValueError(f'Circular dependencies between {[task.name for task in pending]}')
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done(running.pop(future), future.result())
+    return outputs
+
+
+if __name__ == "__main__":
+    import sys
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else REPORT_DIR
+    names = sys.argv[2].split(',') if len(sys.argv) > 2 else list(SCENARIOS)
+    outputs = build_report(report_tasks({name: SCENARIOS.get(name, name) for name in names}), out_dir, formats=('png', 'pdf'))
+    print(sum(len(fns) for name, fns in outputs.items() if '/' in name), 'figures written to', out_dir)
@@ -1,4 +1,4 @@
-def retrieve_data(temp_res, experiment, variable, model, date):
+def retrieve_data(temp_res, experiment, variable, model, date, optimize=False):
 
     '''
     Function to retrieve data from the Copernicus Climate Data Store.
@@ -7,46 +7,34 @@ def retrieve_data(temp_res, experiment, variable, model, date):
     variable: 'surface_temperature'
     model: 'hadgem3_gc31_ll'
     date: '2015-01-01/2099-12-31'
+    optimize: rewrite the file chunked, float32 and in degC (see optimize_layout.py)
+    Downloads go through the local data store (see download_manager.py), so
+    a file that is already there is not downloaded again.
     '''
 
-    import cdsapi
-    import zipfile
     import os
+    import shutil
+    from download_manager import DataRequest, fetch
 
-    c = cdsapi.Client()
-
-    file_name = f'./download_{model}_{experiment}.zip'
-
-    c.retrieve(
-        'projections-cmip6',
-        {
-            'format': 'zip',
-            'temporal_resolution': temp_res,
-            'experiment': experiment,
-            'level': 'single_levels',
-            'variable': variable,
-            'model': model,
-            'date': date,
-        },
-        file_name)
-
-    with zipfile.ZipFile(file_name, 'r') as zip_ref:      
-        zip_ref.extractall('data')
-        print("Data files extracted")
-    os.remove(file_name)
-
-    dir = os.fsencode('data')
-    for file in os.listdir(dir):
-        filename = os.fsdecode(file)
-        if filename.endswith('.nc'):
-            os.rename(f'data/{filename}', f'{model}_{experiment}_data.nc')
+    data_fn = f'{model}_{experiment}_data.nc'
+    if not os.path.exists(data_fn):
+        path = fetch(DataRequest(temp_res, experiment, variable, model, date))
+        if optimize:
+            from optimize_layout import optimize_layout
+            optimize_layout(path, data_fn)
         else:
-            os.remove(f'data/{filename}')
-    os.rmdir('data')
+            try:
+                os.link(path, data_fn)
+            except OSError:
+                shutil.copyfile(path, data_fn)
+        print("Data file retrieved")
 
-    data_fn = f'{model}_{experiment}_data.nc'
     return data_fn
 
 
 if __name__ == "__main__":
+    from download_manager import download_all, request_matrix
+
+    # both scenarios at once, in parallel
+    download_all(request_matrix(['hadgem3_gc31_ll'], ['ssp5_8_5', 'ssp1_2_6']))
     retrieve_data('monthly', 'ssp5_8_5', 'surface_temperature', 'hadgem3_gc31_ll', '2015-01-01/2099-12-31')
@@ -0,0 +1,108 @@
+import glob
+import json
+import os
+import time
+from collections import deque
+
+
+# each worker writes its stats here, so any worker can report on all of them
+METRICS_DIR = os.environ.get('DASHBOARD_METRICS_DIR', 'metrics')
+WINDOW = 1000
+
+
+def memory_usage():
+
+    '''
+    Memory of the current process in MB (Linux):
+            ---> rss: resident set, counting shared pages in full
+            ---> pss: proportional set, shared pages split between the processes mapping them
+            ---> shared: resident pages shared with other processes (e.g. the memory-mapped stores)
+    '''
+
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                fields = line.split()
+                if fields[0] in ('Rss:', 'Pss:', 'Shared_Clean:', 'Shared_Dirty:'):
+                    usage[fields[0][:-1]] = int(fields[1]) / 1024
+    except OSError:
+        import resource
+        return {'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    return {'rss': usage['Rss'], 'pss': usage['Pss'],
+            'shared': usage['Shared_Clean'] + usage['Shared_Dirty']}
+
+
+class WorkerMetrics:
+
+    '''Request latencies of one worker over a rolling window, plus its memory usage'''
+
+    def __init__(self, window=WINDOW):
+        self.pid = os.getpid()
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+
+    def record(self, seconds):
+        self.requests += 1
+        self.latencies.append(1000*seconds)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        def pct(q):
+            return latencies[min(len(latencies)-1, int(q*len(latencies)))] if latencies else None
+        return {'pid': self.pid, 'requests': self.requests, 'memory_mb': memory_usage(),
+                'latency_ms': {'p50': pct(0.5), 'p95': pct(0.95), 'max': latencies[-1] if latencies else None},
+                'updated': time.time()}
+
+    def dump(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        fn = os.path.join(METRICS_DIR, f'{self.pid}.json')
+        with open(fn + '.tmp', 'w') as f:
+            json.dump(self.summary(), f)
+        os.replace(fn + '.tmp', fn)
+
+
+def install_metrics(server, dump_every=5.0):
+
+    '''
+    Time every request handled by a Flask server and serve per-worker memory and
+    latency at /metrics. Workers dump their stats at most every dump_every seconds.
+    '''
+
+    from flask import g, jsonify, request
+
+    state = {'metrics': None, 'dumped': 0.0}
+
+    def metrics():
+        # one WorkerMetrics per process, created after the fork
+        if state['metrics'] is None or state['metrics'].pid != os.getpid():
+            state['metrics'] = WorkerMetrics()
+        return state['metrics']
+
+    @server.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @server.after_request
+    def record_latency(response):
+        if request.path != '/metrics':
+            metrics().record(time.perf_counter() - g.request_start)
+            if time.time() - state['dumped'] > dump_every:
+                metrics().dump()
+                state['dumped'] = time.time()
+        return response
+
+    @server.route('/metrics')
+    def report():
+        metrics().dump()
+        workers = []
+        for fn in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+            with open(fn) as f:
+                stats = json.load(f)
+            # skip workers that have exited
+            try:
+                os.kill(stats['pid'], 0)
+            except OSError:
+                continue
+            workers.append(stats)
+        return jsonify(workers=sorted(workers, key=lambda w: w['pid']))
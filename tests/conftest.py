@@ -0,0 +1,43 @@
+import os
+import sys
+
+# the modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def make_dataset(tmp_path):
+
+    '''
+    Factory writing a small monthly (time, lat, lon) CMIP6-like NetCDF file.
+    Cells that are NaN in ts are written as _FillValue.
+    returns
+            ---> make(name, ts, lon=None, lat=None, units='K', calendar='360_day', start=(2015, 1)) -> file name
+    '''
+
+    import netCDF4 as netcdf
+
+    def make(name, ts, lon=None, lat=None, units='K', calendar='360_day', start=(2015, 1)):
+        nt, nlat, nlon = ts.shape
+        lon = np.linspace(0.0, 360.0, nlon, endpoint=False) + 180.0 / nlon if lon is None else lon
+        lat = np.linspace(-90.0, 90.0, nlat + 1)[:-1] + 90.0 / nlat if lat is None else lat
+        fn = str(tmp_path / name)
+        with netcdf.Dataset(fn, mode='w') as ncset:
+            ncset.createDimension('time', None)
+            ncset.createDimension('lat', nlat)
+            ncset.createDimension('lon', nlon)
+            time = ncset.createVariable('time', 'f8', ('time',))
+            time.units = f'days since {start[0]}-{start[1]:02d}-01'
+            time.calendar = calendar
+            time[:] = 15.0 + 30.0 * np.arange(nt)
+            ncset.createVariable('lat', 'f8', ('lat',))[:] = lat
+            ncset.createVariable('lon', 'f8', ('lon',))[:] = lon
+            var = ncset.createVariable('ts', 'f4', ('time', 'lat', 'lon'), fill_value=np.float32(1.0e20))
+            var.units = units
+            var[:] = np.ma.masked_invalid(ts)
+        return fn
+
+    return make
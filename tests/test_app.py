@@ -0,0 +1,140 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('dash')
+import dash
+from dash.exceptions import PreventUpdate
+import app
+
+# cities at grid cell centres of the synthetic dataset; (lat i, lon j) holds 10*i + j degC
+PLACES = {'alpha': (22.5, -75.0), 'beta': (67.5, 15.0), 'gamma': (112.5, 45.0)}
+VALUES = {'Alpha': 0.0, 'Beta': 31.0, 'Gamma': 42.0}
+
+
+def _ts(offset=0.0, nt=120, nlat=6, nlon=8):
+    cells = 10.0 * np.arange(nlat)[:, None] + np.arange(nlon)[None, :]
+    return np.broadcast_to(273.15 + offset + cells, (nt, nlat, nlon)).copy()
+
+
+def _coords(city):
+    coords = PLACES.get(app.normalize_city(city))
+    if coords is None:
+        raise ValueError(f'Could not find coordinates for {city}')
+    return coords
+
+
+def _coords_batch(cities):
+    lon, lat = zip(*(_coords(city) for city in cities))
+    return np.array(lon), np.array(lat)
+
+
+@pytest.fixture
+def data_fns(make_dataset, monkeypatch):
+    data_fns = {'ssp5_8_5': make_dataset('ssp5.nc', _ts()), 'ssp1_2_6': make_dataset('ssp1.nc', _ts(-5.0))}
+    monkeypatch.setattr(app, 'DATA_FNS', data_fns)
+    monkeypatch.setattr(app, 'get_coords', _coords)
+    monkeypatch.setattr(app, 'get_coords_batch', _coords_batch)
+    app.city_series.cache_clear()
+    yield data_fns
+    app.city_series.cache_clear()
+
+
+def _operations(patch):
+    return [(op['operation'], op['location'], op['params'].get('value'))
+            for op in patch.to_plotly_json()['operations']]
+
+
+def test_city_series_follows_the_data_file(data_fns):
+    assert np.allclose(app.city_series('Beta', 'ssp5_8_5', 'annual'), 31.0)
+    assert np.allclose(app.city_series('  beta', 'ssp1_2_6', 'annual'), 26.0)
+
+    # a rewritten data file changes the cache key of every series read from it
+    from netCDF4 import Dataset
+    with Dataset(data_fns['ssp5_8_5'], mode='a') as ncset:
+        ncset['ts'][:] = _ts(2.0)
+    stat = os.stat(data_fns['ssp5_8_5'])
+    os.utime(data_fns['ssp5_8_5'], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert np.allclose(app.city_series('Beta', 'ssp5_8_5', 'annual'), 33.0)
+
+
+def test_full_figure(data_fns):
+    figure = app.update_charts('ssp5_8_5', 'annual', ['Alpha', 'Gamma'], None)
+    assert [trace['name'] for trace in figure['data']] == ['Alpha', 'Gamma']
+    for trace in figure['data']:
+        assert len(trace['x']) == 10 and np.allclose(trace['y'], VALUES[trace['name']])
+    assert app.update_charts('ssp5_8_5', 'annual', [], None)['data'] == []
+
+
+def test_picking_cities_appends_their_traces(data_fns):
+    figure, cities, value, message = app.select_cities(['Alpha', 'Beta', 'Gamma'], ['Alpha'], 'ssp5_8_5', 'annual', None)
+    assert cities == ['Alpha', 'Beta', 'Gamma'] and value is dash.no_update and message == ''
+    operations = _operations(figure)
+    assert [(op, location) for op, location, _ in operations] == [('Append', ['data']), ('Append', ['data'])]
+    assert [trace['name'] for _, _, trace in operations] == ['Beta', 'Gamma']
+    assert np.allclose(operations[1][2]['y'], VALUES['Gamma'])
+
+
+def test_removing_a_city_drops_its_trace(data_fns):
+    figure, cities, _, _ = app.select_cities(['Alpha', 'Gamma'], ['Alpha', 'Beta', 'Gamma'], 'ssp5_8_5', 'annual', None)
+    assert cities == ['Alpha', 'Gamma']
+    assert _operations(figure) == [('Delete', ['data', 1], None)]
+
+
+def test_reordering_redraws_the_figure(data_fns):
+    figure, cities, _, _ = app.select_cities(['Gamma', 'Alpha'], ['Alpha', 'Gamma'], 'ssp5_8_5', 'annual', None)
+    assert cities == ['Gamma', 'Alpha']
+    assert [trace['name'] for trace in figure['data']] == ['Gamma', 'Alpha']
+
+
+def test_unknown_cities_are_dropped_with_a_message(data_fns):
+    figure, cities, value, message = app.select_cities(['Alpha', 'Atlantis', 'Beta'], ['Alpha'], 'ssp5_8_5', 'annual', None)
+    assert cities == value == ['Alpha', 'Beta']
+    assert 'Atlantis' in message
+    assert [trace['name'] for _, _, trace in _operations(figure)] == ['Beta']
+
+    # nothing left to draw: only the selection and the message change
+    figure, cities, value, message = app.select_cities(['Alpha', 'Beta', 'Atlantis'], ['Alpha', 'Beta'], 'ssp5_8_5', 'annual', None)
+    assert figure is dash.no_update and cities is dash.no_update
+    assert value == ['Alpha', 'Beta'] and 'Atlantis' in message
+
+    with pytest.raises(PreventUpdate):
+        app.select_cities(['Alpha', 'Beta'], ['Alpha', 'Beta'], 'ssp5_8_5', 'annual', None)
+
+
+def test_zoom_patches_every_trace(data_fns):
+    cities = ['Alpha', 'Beta']
+    figure, view = app.zoom({'xaxis.range[0]': '2017.0', 'xaxis.range[1]': '2019.0'}, cities, 'ssp5_8_5', 'auto')
+    assert view == [2017.0, 2019.0]
+    operations = _operations(figure)
+    assert [location for _, location, _ in operations] == [
+        ['data', 0, 'x'], ['data', 0, 'y'], ['data', 1, 'x'], ['data', 1, 'y']]
+    x = np.array(operations[0][2])
+    # monthly points of the visible range only
+    assert 20 <= len(x) <= 26 and x.min() >= 2016.9 and x.max() <= 2019.1
+    assert np.allclose(operations[3][2], VALUES['Beta'])
+
+    figure, view = app.zoom({'xaxis.range': [2016, 2020]}, cities, 'ssp5_8_5', 'annual')
+    assert view == [2016.0, 2020.0]
+    figure, view = app.zoom({'xaxis.autorange': True}, cities, 'ssp5_8_5', 'annual')
+    assert view is None and len(_operations(figure)[0][2]) == 10
+    with pytest.raises(PreventUpdate):
+        app.zoom({'dragmode': 'pan'}, cities, 'ssp5_8_5', 'auto')
+
+
+def test_suggestions(monkeypatch):
+    class Gazetteer:
+        def suggest(self, text):
+            return ['London, GB', 'Londrina, BR'] if text.casefold().startswith('lon') else []
+
+    monkeypatch.setattr(app, 'get_gazetteer', lambda: Gazetteer())
+    options = app.update_suggestions('lon', ['Paris'])
+    assert [option['value'] for option in options] == ['Paris', 'London, GB', 'Londrina, BR', 'lon']
+    # a single letter is not looked up, the selection never repeats
+    assert [option['value'] for option in app.update_suggestions('P', ['Paris'])] == ['Paris', 'P']
+    assert [option['value'] for option in app.update_suggestions('Paris', ['Paris'])] == ['Paris']
+    with pytest.raises(PreventUpdate):
+        app.update_suggestions('', [])
+
+    monkeypatch.setattr(app, 'get_gazetteer', lambda: None)
+    assert [option['value'] for option in app.update_suggestions('lon', None)] == ['lon']
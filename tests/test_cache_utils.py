@@ -0,0 +1,104 @@
+import pytest
+import cache_utils
+from cache_utils import LRUCache, SqliteStore, file_fingerprint, memoize
+
+
+class _Clock:
+    '''Stand-in for time.time in cache_utils'''
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache_utils.time, 'time', clock)
+    return clock
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1       # 'b' is now the least recently used
+    cache.set('c', 3)
+    assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_lru_ttl(clock):
+    cache = LRUCache(ttl=10)
+    cache.set('a', 1)
+    clock.now += 10
+    assert cache.get('a') == 1
+    clock.now += 1
+    assert cache.get('a', 'gone') == 'gone' and len(cache) == 0
+
+
+def test_sqlite_store_persists_across_instances(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    SqliteStore(path).set('london', [-0.12, 51.5])
+    assert SqliteStore(path).get('london') == [-0.12, 51.5]
+    assert SqliteStore(path, table='other').get('london') is None
+
+
+def test_sqlite_store_ttl_and_stale_entries(tmp_path, clock):
+    store = SqliteStore(str(tmp_path / 'cache.sqlite'), ttl=10)
+    store.set('a', {'x': 1})
+    clock.now += 11
+    assert store.get('a') is None
+    assert store.get('a', allow_stale=True) == {'x': 1}
+
+
+def test_sqlite_store_evicts_least_recently_used(tmp_path, clock):
+    store = SqliteStore(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    for k, key in enumerate('abc'):
+        clock.now += 1
+        store.set(key, k)
+        if key == 'b':
+            clock.now += 1
+            assert store.get('a') == 0   # 'b' is now the least recently used
+    assert store.get('a') == 0 and store.get('b') is None and store.get('c') == 2
+
+
+def test_memoize_shares_results_through_disk(tmp_path):
+    calls = []
+
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    path = str(tmp_path / 'memo.sqlite')
+    first = memoize(disk_path=path)(square)
+    assert first(3) == 9 and first(3) == 9 and calls == [3]
+    # another process (a fresh decorator) finds the result on disk
+    second = memoize(disk_path=path)(square)
+    assert second(3) == 9 and calls == [3]
+    second.cache_clear()
+    assert first(4) == 16 and second(3) == 9 and calls == [3, 4, 3]
+
+
+def test_memoize_key_function():
+    calls = []
+
+    @memoize(key=lambda city, unit: (city.casefold(), unit))
+    def lookup(city, unit):
+        calls.append(city)
+        return [city, unit]
+
+    assert lookup('London', 'K') == ['London', 'K']
+    assert lookup('LONDON', 'K') == ['London', 'K']
+    assert lookup('London', 'C') == ['London', 'C']
+    assert calls == ['London', 'London']
+
+
+def test_file_fingerprint_changes_with_the_file(tmp_path):
+    fn = tmp_path / 'data.nc'
+    fn.write_bytes(b'1234')
+    before = file_fingerprint(str(fn))
+    fn.write_bytes(b'12345')
+    assert file_fingerprint(str(fn)) != before
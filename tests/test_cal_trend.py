@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import scipy.stats as stats
+from cal_trend import linregress_nd
+
+
+@pytest.fixture
+def cube():
+    rng = np.random.default_rng(0)
+    x = np.arange(30, dtype=np.float64)
+    y = 0.3 * x[:, None, None] + rng.normal(size=(30, 4, 5))
+    y[:, 0, 0] = 7.0          # constant series
+    y[3, 1, 2] = np.nan       # one missing value
+    y[:, 2, 3] = np.nan       # missing cell
+    return x, y
+
+
+def test_linregress_nd_matches_scipy(cube):
+    x, y = cube
+    slope, intercept, r, prob, stderr = linregress_nd(x, y)
+    for i in range(y.shape[1]):
+        for j in range(y.shape[2]):
+            if np.isnan(y[:, i, j]).any():
+                assert np.isnan([slope[i, j], intercept[i, j], r[i, j], prob[i, j]]).all()
+                continue
+            if (i, j) == (0, 0):
+                # scipy's r for a constant series changed across versions; linregress_nd keeps r = 0
+                assert (slope[i, j], intercept[i, j], r[i, j]) == (0.0, 7.0, 0.0)
+                continue
+            expected = stats.linregress(x, y[:, i, j])
+            np.testing.assert_allclose(slope[i, j], expected.slope, atol=1e-12)
+            np.testing.assert_allclose(intercept[i, j], expected.intercept, atol=1e-10)
+            np.testing.assert_allclose(r[i, j], expected.rvalue, atol=1e-12)
+            np.testing.assert_allclose(prob[i, j], expected.pvalue, rtol=1e-8, atol=1e-300)
+            np.testing.assert_allclose(stderr[i, j], expected.stderr, rtol=1e-8, atol=1e-15)
+
+
+def test_linregress_nd_1d_series():
+    x = np.arange(10.0)
+    y = 2.0 * x + 1.0 + np.sin(x)
+    slope, intercept, r, prob, _ = linregress_nd(x, y)
+    expected = stats.linregress(x, y)
+    np.testing.assert_allclose([slope, intercept, r, prob],
+                               [expected.slope, expected.intercept, expected.rvalue, expected.pvalue], rtol=1e-10)
+
+
+def test_tiled_trends_match_in_memory(make_dataset):
+    from cal_trend import cal_trend, cal_trend_tiled, cal_rate_tiled
+
+    rng = np.random.default_rng(1)
+    num_years, nlat, nlon = 6, 5, 7
+    ts = 280.0 + 0.02 * np.arange(num_years * 12)[:, None, None] + rng.normal(size=(num_years * 12, nlat, nlon))
+    ts[:, 1, 2] = np.nan                 # masked cell
+    ts[10, 3, 4] = np.nan                # one missing month
+    fn = make_dataset('tiled_data.nc', ts)
+
+    cube = ts.astype(np.float32).astype(np.float64).reshape(num_years, 12, nlat, nlon)
+    expected = cal_trend(0, num_years, 0, 12, nlat, nlon, cube)
+    # a budget of a few cells forces many tiles
+    tiled = cal_trend_tiled(fn, 0, num_years, 0, 12, tile_budget=num_years * 12 * 8 * 4 * 3)
+    for got, want in zip(tiled, expected):
+        np.testing.assert_allclose(got, want, rtol=1e-10, atol=1e-10)
+    assert np.isnan(tiled[0][1, 2]) and np.isnan(tiled[0][3, 4])
+    assert np.isfinite(np.delete(tiled[0].ravel(), [1 * nlon + 2, 3 * nlon + 4])).all()
+
+    rate = cal_rate_tiled(fn, scale=1.0, tile_budget=num_years * 12 * 8 * 4 * 3)
+    slope = linregress_nd(np.arange(num_years * 12), ts.astype(np.float32).astype(np.float64))[0]
+    np.testing.assert_allclose(rate, slope, rtol=1e-10, atol=1e-12)
+
+
+def _shm_segments():
+    import os
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+
+def test_parallel_trends_identical_to_serial():
+    from cal_trend import cal_trend
+
+    rng = np.random.default_rng(2)
+    num_years, nlat, nlon = 8, 9, 11
+    cube = 0.03 * np.arange(num_years)[:, None, None, None] + rng.normal(size=(num_years, 12, nlat, nlon))
+    cube[:, :, 0, 0] = 1.5               # constant series
+    before = _shm_segments()
+    serial = cal_trend(0, num_years, 0, 12, nlat, nlon, cube, processes=1)
+    # a budget below one row still gives whole-row tiles, several per worker
+    parallel = cal_trend(0, num_years, 0, 12, nlat, nlon, cube, processes=2, tile_budget=num_years * 12 * 8 * 4 * 5)
+    assert len(parallel) == len(serial) == 8
+    for got, want in zip(parallel, serial):
+        np.testing.assert_array_equal(got, want)
+    # the block is unlinked once the workers are done with it
+    assert _shm_segments() == before
@@ -0,0 +1,57 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+ccrs = pytest.importorskip('cartopy.crs')
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'cartopy'))
+import cartopy_plots
+
+
+LON = np.arange(0.0, 360.0, 1.875) + 0.9375
+LAT = np.arange(-90.0, 90.0, 1.25) + 0.625
+
+
+def _field():
+    lon2d, lat2d = np.meshgrid(np.radians(LON), np.radians(LAT))
+    return 280.0 + 20.0 * np.cos(lat2d) + 5.0 * np.sin(3 * lon2d)
+
+
+def _render(projection, method, cached):
+    '''RGB pixels of a global map of the field, drawn through plot_field or by cartopy alone'''
+    fig = plt.figure(figsize=(4, 2), dpi=100)
+    ax = plt.axes(projection=projection)
+    ax.set_global()
+    if cached:
+        cartopy_plots.plot_field(ax, LON, LAT, _field(), method=method, vmin=250, vmax=300)
+    else:
+        kwargs = {'shading': 'auto'} if method == 'pcolormesh' else {}
+        getattr(ax, method)(LON, LAT, _field(), transform=ccrs.PlateCarree(), vmin=250, vmax=300, **kwargs)
+    fig.canvas.draw()
+    pixels = np.asarray(fig.canvas.buffer_rgba())[..., :3].astype(int)
+    plt.close(fig)
+    return pixels
+
+
+@pytest.mark.parametrize('projection, method', [
+    (ccrs.Robinson(), 'pcolormesh'),
+    (ccrs.Mercator(), 'pcolormesh'),
+    (ccrs.RotatedPole(pole_longitude=-177.5, pole_latitude=37.5), 'contourf'),
+])
+def test_cached_map_matches_native(projection, method):
+    cached = _render(projection, method, cached=True)
+    native = _render(projection, method, cached=False)
+    # only antialiased edges may differ
+    assert (np.abs(cached - native).max(axis=-1) > 30).mean() < 0.01
+
+
+def test_seams_fall_back_to_cartopy():
+    rotated = ccrs.RotatedPole(pole_longitude=-177.5, pole_latitude=37.5)
+    x, y, _, projected = cartopy_plots.projected_grid(LON, LAT, rotated)
+    assert not projected
+    assert np.all(np.diff(x, axis=1) > 0) and x.min() >= -180.0
+    assert cartopy_plots.projected_grid(LON, LAT, ccrs.Robinson())[3]
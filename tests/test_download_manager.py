@@ -0,0 +1,148 @@
+import io
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+import download_manager
+from download_manager import DataRequest, fetch, ingest_zip, request_key
+
+
+REQUEST = DataRequest('monthly', 'ssp5_8_5', 'surface_temperature', 'hadgem3_gc31_ll', '2015-01-01/2099-12-31')
+NC_BYTES = os.urandom(200_000)
+
+
+def _zip_bytes():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr('ts_Amon_HadGEM3.nc', NC_BYTES)
+        zf.writestr('provenance.json', '{}')
+    return buf.getvalue()
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+
+    '''Serves one zip, honouring single 'bytes=N-' ranges as the CDS download servers do'''
+
+    def do_GET(self):
+        body = self.server.body
+        self.server.ranges.append(self.headers.get('Range'))
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+    httpd.body = _zip_bytes()
+    httpd.ranges = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _client_factory(server, calls, size=True):
+    '''Stand-in for cdsapi.Client: the result points at the local server'''
+    url = f'http://127.0.0.1:{server.server_address[1]}/result.zip'
+
+    def factory():
+        def retrieve(dataset, request):
+            calls.append(request)
+            return SimpleNamespace(location=url, content_length=len(server.body) if size else None)
+        return SimpleNamespace(retrieve=retrieve)
+    return factory
+
+
+def _read(fn):
+    with open(fn, 'rb') as f:
+        return f.read()
+
+
+def test_fresh_download(server, tmp_path):
+    calls = []
+    path = fetch(REQUEST, str(tmp_path), _client_factory(server, calls))
+    assert _read(path) == NC_BYTES
+    assert len(calls) == 1 and server.ranges == [None]
+    # the job directory is cleaned up once the object is in the store; the
+    # lock next to it stays, so a waiting run never locks a removed directory
+    assert not os.path.exists(tmp_path / 'jobs' / request_key(REQUEST))
+    assert os.listdir(tmp_path / 'jobs') == [request_key(REQUEST) + '.lock']
+
+
+def test_resume_interrupted_download(server, tmp_path):
+    calls = []
+    factory = _client_factory(server, calls)
+    job_dir = tmp_path / 'jobs' / request_key(REQUEST)
+    job_dir.mkdir(parents=True)
+    url = factory().retrieve(None, None).location
+    calls.clear()
+    download_manager._write_json(str(job_dir / 'job.json'), {'location': url, 'size': len(server.body)})
+    (job_dir / 'download.zip.part').write_bytes(server.body[:1000])
+
+    path = fetch(REQUEST, str(tmp_path), factory)
+    assert _read(path) == NC_BYTES
+    # resumed from the remembered location, not requested again
+    assert calls == [] and server.ranges == ['bytes=1000-']
+
+
+def test_complete_part_file_of_unknown_size(server, tmp_path):
+    calls = []
+    factory = _client_factory(server, calls, size=False)
+    job_dir = tmp_path / 'jobs' / request_key(REQUEST)
+    job_dir.mkdir(parents=True)
+    url = factory().retrieve(None, None).location
+    download_manager._write_json(str(job_dir / 'job.json'), {'location': url, 'size': None})
+    (job_dir / 'download.zip.part').write_bytes(server.body)
+
+    # the server answers 416 to a range past the end: the part file is complete
+    path = fetch(REQUEST, str(tmp_path), factory)
+    assert _read(path) == NC_BYTES
+    assert server.ranges == [f'bytes={len(server.body)}-']
+
+
+def test_repeat_run_uses_the_store(server, tmp_path):
+    calls = []
+    factory = _client_factory(server, calls)
+    first = fetch(REQUEST, str(tmp_path), factory)
+    second = fetch(REQUEST, str(tmp_path), factory)
+    assert first == second
+    assert len(calls) == 1 and len(server.ranges) == 1
+
+
+def test_concurrent_runs_of_one_request(server, tmp_path):
+    calls = []
+    factory = _client_factory(server, calls)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        paths = list(pool.map(lambda _: fetch(REQUEST, str(tmp_path), factory), range(4)))
+    assert len(set(paths)) == 1 and _read(paths[0]) == NC_BYTES
+    assert len(calls) == 1 and len(server.ranges) == 1
+
+
+def test_zip_with_several_netcdf_files_is_refused(tmp_path):
+    zip_fn = tmp_path / 'split.zip'
+    with zipfile.ZipFile(zip_fn, 'w') as zf:
+        zf.writestr('ts_Amon_HadGEM3_201501-204912.nc', NC_BYTES[:1000])
+        zf.writestr('ts_Amon_HadGEM3_205001-210012.nc', NC_BYTES[1000:2000])
+    with pytest.raises(ValueError, match='2 NetCDF files'):
+        ingest_zip(str(zip_fn), str(tmp_path / 'store'))
+    assert not os.listdir(tmp_path / 'store' / 'objects')
@@ -0,0 +1,88 @@
+import netCDF4 as netcdf
+import numpy as np
+import pytest
+from ensemble import Ensemble
+
+
+def _members(make_dataset, n=4, shape=(30, 6, 8), seed=0):
+    rng = np.random.default_rng(seed)
+    data = 280.0 + 10.0 * rng.standard_normal((n,) + shape)
+    ensemble = Ensemble()
+    for k in range(n):
+        ensemble.add(f'model{k}', 'ssp5_8_5', make_dataset(f'model{k}.nc', data[k]))
+    # the files store float32 in K, the summaries are in degC
+    return ensemble, data.astype(np.float32).astype(np.float64) - 273.15
+
+
+def test_mean_spread_matches_numpy(make_dataset):
+    ensemble, data = _members(make_dataset)
+    # blocks that do not divide the time axis
+    result = ensemble.mean_spread('ssp5_8_5', block=7)
+    np.testing.assert_allclose(result['mean'], data.mean(axis=0), rtol=1e-6)
+    np.testing.assert_allclose(result['spread'], data.std(axis=0, ddof=1), rtol=1e-5)
+
+
+def test_mean_spread_of_one_member(make_dataset):
+    ensemble, data = _members(make_dataset, n=1)
+    result = ensemble.mean_spread('ssp5_8_5')
+    np.testing.assert_allclose(result['mean'], data[0], rtol=1e-6)
+    assert np.isnan(result['spread']).all()
+
+
+def test_percentiles_match_numpy(make_dataset, tmp_path):
+    ensemble, data = _members(make_dataset, n=5)
+    q = (5, 50, 95)
+    expected = np.moveaxis(np.percentile(data, q, axis=0), 0, 1)
+    # a budget of a few time steps per chunk
+    result = ensemble.percentiles('ssp5_8_5', q=q, budget=3 * 5 * 6 * 8 * 8)
+    np.testing.assert_allclose(result['percentile'], expected, rtol=1e-6)
+
+    out_fn = ensemble.percentiles('ssp5_8_5', q=q, out_fn=str(tmp_path / 'percentiles.nc'))
+    with netcdf.Dataset(out_fn) as ncset:
+        np.testing.assert_allclose(ncset['q'][:], q)
+        np.testing.assert_allclose(ncset['percentile'][:], expected, rtol=1e-6)
+
+
+def test_start_month_uses_the_file_calendar(make_dataset):
+    ensemble, _ = _members(make_dataset, n=2)
+    # day 59 is 30 February in a 360-day year but 1 March in the standard
+    # calendar: a file without a calendar attribute is read as 360-day
+    for k, member in enumerate(ensemble.members()):
+        with netcdf.Dataset(member.data_fn, mode='a') as ncset:
+            time = ncset['time']
+            time.units = 'days since 2015-01-01'
+            time[:] = 59.0 + 30.0 * np.arange(len(time))
+            if k == 0:
+                time.delncattr('calendar')
+    assert ensemble.mean_spread('ssp5_8_5')['mean'].shape == (30, 6, 8)
+
+
+def test_members_must_start_in_the_same_month(make_dataset):
+    ensemble, data = _members(make_dataset, n=1)
+    ensemble.add('late', 'ssp5_8_5', make_dataset('late.nc', data[0], start=(2016, 1)))
+    with pytest.raises(ValueError):
+        ensemble.mean_spread('ssp5_8_5')
+
+
+@pytest.mark.filterwarnings('ignore:All-NaN slice', 'ignore:Degrees of freedom', 'ignore:Mean of empty slice',
+                            'ignore:invalid value')
+def test_missing_members_are_left_out(make_dataset):
+    rng = np.random.default_rng(2)
+    data = 280.0 + 10.0 * rng.standard_normal((4, 10, 6, 8))
+    data[0, :, 1, 1] = np.nan           # one member missing
+    data[:3, :, 2, 2] = np.nan          # only one member left
+    data[:, :, 3, 3] = np.nan           # all missing
+    ensemble = Ensemble()
+    for k in range(4):
+        ensemble.add(f'model{k}', 'ssp5_8_5', make_dataset(f'model{k}.nc', data[k]))
+    stored = data.astype(np.float32).astype(np.float64) - 273.15
+
+    result = ensemble.mean_spread('ssp5_8_5', block=4)
+    np.testing.assert_allclose(result['mean'], np.nanmean(stored, axis=0), rtol=1e-6)
+    np.testing.assert_allclose(result['spread'], np.nanstd(stored, axis=0, ddof=1), rtol=1e-5)
+    assert np.isfinite(result['mean'][:, 2, 2]).all() and np.isnan(result['spread'][:, 2, 2]).all()
+    assert np.isnan(result['mean'][:, 3, 3]).all()
+
+    q = (5, 50, 95)
+    percentiles = ensemble.percentiles('ssp5_8_5', q=q)['percentile']
+    np.testing.assert_allclose(percentiles, np.moveaxis(np.nanpercentile(stored, q, axis=0), 0, 1), rtol=1e-6)
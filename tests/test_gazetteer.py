@@ -0,0 +1,79 @@
+import zipfile
+import pytest
+from gazetteer import Gazetteer, build_gazetteer, normalize_name
+
+
+# (name, asciiname, lat, lon, country, population)
+PLACES = [
+    ('London', 'London', 51.50853, -0.12574, 'GB', 8961989),
+    ('London', 'London', 42.98339, -81.23304, 'CA', 346765),
+    ('Londrina', 'Londrina', -23.31028, -51.16278, 'BR', 471832),
+    ('Reykjavík', 'Reykjavik', 64.13548, -21.89541, 'IS', 118918),
+    ('São Paulo', 'Sao Paulo', -23.5475, -46.63611, 'BR', 10021295),
+    ('Stockholm', 'Stockholm', 59.32938, 18.06871, 'SE', 1515017),
+    ('Cincinnati', 'Cincinnati', 39.12711, -84.51439, 'US', 309317),
+]
+
+
+def _row(k, name, ascii_name, lat, lon, country, population):
+    '''One line of a GeoNames cities*.txt dump (19 tab-separated fields)'''
+    fields = [str(k), name, ascii_name, '', str(lat), str(lon), 'P', 'PPL', country,
+              '', '', '', '', '', str(population), '', '', 'Europe/London', '2024-01-01']
+    return '\t'.join(fields)
+
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    txt = '\n'.join(_row(k, *place) for k, place in enumerate(PLACES)) + '\n'
+    zip_fn = tmp_path / 'cities500.zip'
+    with zipfile.ZipFile(zip_fn, 'w') as zf:
+        zf.writestr('cities500.txt', txt)
+    return Gazetteer(build_gazetteer(str(zip_fn), str(tmp_path / 'gazetteer.npz')))
+
+
+def test_build_from_txt_and_zip(tmp_path, gazetteer):
+    txt_fn = tmp_path / 'cities500.txt'
+    txt_fn.write_text('\n'.join(_row(k, *place) for k, place in enumerate(PLACES)), encoding='utf-8')
+    from_txt = Gazetteer(build_gazetteer(str(txt_fn), str(tmp_path / 'from_txt.npz')))
+    assert len(from_txt) == len(gazetteer) == len(PLACES)
+    assert from_txt.lookup('Stockholm') == gazetteer.lookup('Stockholm')
+
+
+def test_normalize_name():
+    assert normalize_name('  São   PAULO ') == 'sao paulo'
+    assert normalize_name('Reykjavík') == normalize_name('reykjavik')
+
+
+def test_exact_lookup(gazetteer):
+    # the most populous place of a name wins
+    assert gazetteer.lookup('London') == pytest.approx((-0.12574, 51.50853), abs=1e-4)
+    assert gazetteer.lookup('london') == gazetteer.lookup('LONDON') == gazetteer.lookup('London')
+    # accented names and their ASCII spelling find the same place
+    assert gazetteer.lookup('Reykjavík') == gazetteer.lookup('reykjavik') == pytest.approx((-21.89541, 64.13548), abs=1e-4)
+    assert gazetteer.lookup('sao paulo') == gazetteer.lookup('São Paulo')
+
+
+def test_country_disambiguation(gazetteer):
+    assert gazetteer.lookup('London, CA') == pytest.approx((-81.23304, 42.98339), abs=1e-4)
+    assert gazetteer.lookup('London, gb') == pytest.approx((-0.12574, 51.50853), abs=1e-4)
+    assert gazetteer.lookup('London, FR') is None
+
+
+def test_unknown_names(gazetteer):
+    assert gazetteer.lookup('Atlantis') is None
+    assert gazetteer.exact('Lond') == []
+    assert gazetteer.suggest('Qwzx') == []
+
+
+def test_prefix_suggestions(gazetteer):
+    # distinct places, most populous first, with their country
+    assert gazetteer.suggest('lon') == ['London, GB', 'Londrina, BR', 'London, CA']
+    assert gazetteer.suggest('Lon', limit=1) == ['London, GB']
+    assert gazetteer.suggest('são') == ['São Paulo, BR']
+
+
+def test_fuzzy_suggestions(gazetteer):
+    # no prefix match: close spellings instead
+    assert gazetteer.suggest('Stokholm') == ['Stockholm, SE']
+    assert gazetteer.suggest('Cincinati') == ['Cincinnati, US']
+    assert gazetteer.suggest('Rekjavik') == ['Reykjavík, IS']
@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+import pytest
+from geopy.exc import GeocoderTimedOut
+import get_coords
+
+
+class _Geocoder:
+    '''Stand-in for Nominatim, counting the lookups that leave the process'''
+
+    def __init__(self, places):
+        self.places = places
+        self.calls = []
+        self.down = False
+
+    def geocode(self, city):
+        self.calls.append(city)
+        if self.down:
+            raise GeocoderTimedOut('timed out')
+        coords = self.places.get(city.casefold())
+        return None if coords is None else SimpleNamespace(longitude=coords[0], latitude=coords[1])
+
+
+@pytest.fixture
+def geocoder(tmp_path, monkeypatch):
+    geocoder = _Geocoder({'london': (-0.12, 51.5), 'paris': (2.35, 48.86)})
+    monkeypatch.setattr(get_coords, 'GEOCODE_DB', str(tmp_path / 'geocode.sqlite'))
+    monkeypatch.setattr(get_coords, '_stores', {})
+    monkeypatch.setattr(get_coords, '_geolocator', geocoder)
+    monkeypatch.setattr(get_coords, 'get_gazetteer', lambda: None)
+    get_coords._memory.clear()
+    get_coords._misses.clear()
+    yield geocoder
+    get_coords._memory.clear()
+    get_coords._misses.clear()
+
+
+def test_repeat_lookups_stay_in_process(geocoder):
+    assert get_coords.get_coords('London') == (-0.12, 51.5)
+    assert get_coords.get_coords('  london ') == (-0.12, 51.5)
+    assert geocoder.calls == ['London']
+    # a fresh process finds the city in the shared SQLite cache
+    get_coords._memory.clear()
+    assert get_coords.get_coords('LONDON') == (-0.12, 51.5)
+    assert geocoder.calls == ['London']
+
+
+def test_unknown_cities_are_cached_for_a_while(geocoder, monkeypatch):
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            get_coords.get_coords('Atlantis')
+    assert geocoder.calls == ['Atlantis']
+    # shared with other processes too
+    get_coords._misses.clear()
+    with pytest.raises(ValueError):
+        get_coords.get_coords('atlantis')
+    assert geocoder.calls == ['Atlantis']
+
+    # after GEOCODE_MISS_TTL the geocoder is asked again
+    get_coords._misses.clear()
+    monkeypatch.setattr(get_coords._get_store('geocode_miss'), 'ttl', -1)
+    with pytest.raises(ValueError):
+        get_coords.get_coords('Atlantis')
+    assert geocoder.calls == ['Atlantis', 'Atlantis']
+
+
+def test_stale_entry_when_the_geocoder_is_down(geocoder, monkeypatch):
+    assert get_coords.get_coords('Paris') == (2.35, 48.86)
+    get_coords._memory.clear()
+    monkeypatch.setattr(get_coords._get_store(), 'ttl', -1)      # every entry expired
+    geocoder.down = True
+    assert get_coords.get_coords('Paris') == (2.35, 48.86)
+    with pytest.raises(GeocoderTimedOut):
+        get_coords.get_coords('London')
+
+
+def test_gazetteer_first(geocoder, monkeypatch):
+    gazetteer = SimpleNamespace(lookup=lambda city: (10.0, 20.0) if city == 'Springfield' else None)
+    monkeypatch.setattr(get_coords, 'get_gazetteer', lambda: gazetteer)
+    assert get_coords.get_coords('Springfield') == (10.0, 20.0)
+    assert get_coords.get_coords('London') == (-0.12, 51.5)
+    assert geocoder.calls == ['London']
+    lon, lat = get_coords.get_coords_batch(['Springfield', 'London'])
+    assert list(lon) == [10.0, -0.12] and list(lat) == [20.0, 51.5]
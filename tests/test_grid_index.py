@@ -0,0 +1,39 @@
+import numpy as np
+from grid_index import GridIndex
+
+
+LON = np.arange(0.9375, 360.0, 1.875)        # HadGEM3-like 0..360 grid
+LAT = np.linspace(-89.375, 89.375, 144)
+
+
+def test_nearest_wraps_across_the_dateline_and_zero():
+    grid = GridIndex(LON, LAT)
+    assert grid.periodic
+    # -180..180 input on a 0..360 grid
+    _, j = grid.nearest(np.array([-0.5, 0.5, -179.5, 179.5, 360.1]), np.zeros(5))
+    np.testing.assert_array_equal(LON[j], [359.0625, 0.9375, 180.9375, 179.0625, 0.9375])
+
+
+def test_nearest_same_cell_in_either_convention():
+    grid = GridIndex(LON, LAT)
+    lon = np.random.default_rng(0).uniform(-180.0, 180.0, 200)
+    lat = np.random.default_rng(1).uniform(-90.0, 90.0, 200)
+    np.testing.assert_array_equal(grid.nearest(lon, lat), grid.nearest(lon % 360.0, lat))
+
+
+def test_bilinear_across_the_seam():
+    grid = GridIndex(LON, LAT)
+    # halfway between the last column (359.0625) and the first (0.9375)
+    i, j, w = grid.bilinear(np.array([0.0, -0.46875]), np.array([0.0, 0.0]))
+    assert set(j[0]) == {0, len(LON) - 1}
+    np.testing.assert_allclose(w.sum(axis=-1), 1.0)
+    # a field linear in longitude through the seam interpolates exactly
+    field = np.broadcast_to(np.where(LON > 180.0, LON - 360.0, LON), (len(LAT), len(LON)))
+    np.testing.assert_allclose(grid.extract(field, [0.0, -0.46875, 0.5], [10.0, -20.0, 0.0], method='bilinear'),
+                               [0.0, -0.46875, 0.5], atol=1e-12)
+
+
+def test_descending_latitudes():
+    grid = GridIndex(LON, LAT[::-1])
+    i, _ = grid.nearest(np.array([10.0]), np.array([89.0]))
+    assert i[0] == 0
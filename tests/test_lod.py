@@ -0,0 +1,78 @@
+import cftime
+import numpy as np
+import pytest
+from lod import aggregation_matrix, level_groups, lttb, view
+
+
+def _lttb_reference(x, y, n_out):
+    '''Point-by-point LTTB (Steinarsson 2013) over the same buckets as lod.lttb'''
+    n = len(x)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = [0]
+    for k in range(n_out - 2):
+        nxt = range(edges[k+1], edges[k+2] if k + 2 < len(edges) else n)
+        cx = sum(x[i] for i in nxt) / len(nxt)
+        cy = sum(y[i] for i in nxt) / len(nxt)
+        a = keep[-1]
+        best, best_area = None, -1.0
+        for i in range(edges[k], edges[k+1]):
+            area = 0.5 * abs((x[a] - cx) * (y[i] - y[a]) - (x[a] - x[i]) * (cy - y[a]))
+            if area > best_area:
+                best, best_area = i, area
+        keep.append(best)
+    keep.append(n - 1)
+    return np.asarray(keep)
+
+
+def test_lttb_matches_reference():
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(0, 100, 1000))
+    y = np.cumsum(rng.normal(size=1000))
+    for n_out in (3, 10, 97, 500):
+        xs, ys = lttb(x, y, n_out)
+        keep = _lttb_reference(x, y, n_out)
+        assert len(xs) == n_out
+        np.testing.assert_array_equal(xs, x[keep])
+        np.testing.assert_array_equal(ys, y[keep])
+
+
+def test_lttb_keeps_endpoints_and_spikes():
+    x = np.arange(1000.0)
+    y = np.zeros(1000)
+    y[[137, 612]] = [5.0, -5.0]
+    xs, ys = lttb(x, y, 20)
+    assert xs[0] == 0 and xs[-1] == 999
+    assert np.all(np.diff(xs) > 0)
+    assert {137.0, 612.0} <= set(xs)
+
+
+@pytest.mark.parametrize('n_out', [2, 1000, 5000])
+def test_lttb_passes_short_series_through(n_out):
+    x, y = np.arange(1000.0), np.arange(1000.0) ** 2
+    xs, ys = lttb(x, y, n_out)
+    assert xs is x and ys is y
+
+
+def test_view_keeps_a_point_either_side():
+    x = np.arange(100.0)
+    xs, _ = view(x, x, 10.5, 20.5, max_points=1000)
+    np.testing.assert_array_equal(xs, np.arange(10.0, 22.0))
+
+
+def test_level_groups_and_aggregation():
+    dates = [cftime.Datetime360Day(2015 + m // 12, m % 12 + 1, 16) for m in range(24)]
+    values = np.arange(24.0)
+
+    groups, ngroups = level_groups(dates, 'annual')
+    assert ngroups == 2
+    np.testing.assert_allclose(aggregation_matrix(groups, ngroups) @ values, [5.5, 17.5])
+
+    # December joins the following winter: JF 2015, MAM, JJA, SON, DJF, ..., D 2016
+    groups, ngroups = level_groups(dates, 'seasonal')
+    assert ngroups == 9
+    means = aggregation_matrix(groups, ngroups) @ values
+    np.testing.assert_allclose(means[:5], [0.5, 3.0, 6.0, 9.0, 12.0])
+    assert means[-1] == 23.0
+
+    with pytest.raises(ValueError):
+        level_groups(dates, 'weekly')
@@ -0,0 +1,97 @@
+import os
+import pytest
+from pipeline import StageCache, file_checksum, run_stage, stage_fingerprint
+
+calls = []
+
+
+def scale(src, out_dir, factor=2):
+    '''Stage writing factor * each number of src to a file in out_dir'''
+    # the output is not a parameter: a parameter naming an existing file is an input
+    calls.append(src)
+    out = os.path.join(out_dir, 'out.txt')
+    with open(src) as f:
+        values = [float(line) * factor for line in f]
+    with open(out, 'w') as f:
+        f.write('\n'.join(map(str, values)))
+    return out
+
+
+def total(src):
+    calls.append(src)
+    with open(src) as f:
+        return sum(float(line) for line in f)
+
+
+@pytest.fixture
+def paths(tmp_path):
+    calls.clear()
+    src = tmp_path / 'src.txt'
+    src.write_text('1\n2\n3\n')
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    return str(src), str(out_dir / 'out.txt'), str(tmp_path / 'pipeline.sqlite')
+
+
+def _run(src, out, db, factor=2):
+    scaled, fingerprint = run_stage('scale', scale, {'src': src, 'out_dir': os.path.dirname(out), 'factor': factor}, db=db)
+    return run_stage('total', total, {'src': scaled}, inputs=[fingerprint], db=db)
+
+
+def test_unchanged_stages_are_skipped(paths):
+    src, out, db = paths
+    assert _run(src, out, db)[0] == 12.0 and len(calls) == 2
+    result, fingerprint = _run(src, out, db)
+    assert result == 12.0 and len(calls) == 2
+    assert fingerprint == _run(src, out, db)[1]
+
+
+def test_changed_inputs_rerun_downstream(paths):
+    src, out, db = paths
+    _run(src, out, db)
+    # same size, new contents: the checksum, not the size, decides
+    with open(src, 'w') as f:
+        f.write('4\n5\n6\n')
+    os.utime(src, ns=(os.stat(src).st_atime_ns, os.stat(src).st_mtime_ns + 10**9))
+    assert _run(src, out, db)[0] == 30.0 and len(calls) == 4
+
+
+def test_changed_parameters_rerun(paths):
+    src, out, db = paths
+    _run(src, out, db)
+    assert _run(src, out, db, factor=3)[0] == 18.0 and len(calls) == 4
+    # back to the first parameters: their record was replaced
+    assert _run(src, out, db)[0] == 12.0 and len(calls) == 6
+
+
+def test_deleted_outputs_rerun(paths):
+    src, out, db = paths
+    _run(src, out, db)
+    os.remove(out)
+    assert _run(src, out, db)[0] == 12.0 and os.path.exists(out)
+    # scale ran again; total's input checksum is unchanged, so it did not
+    assert calls == [src, out, src]
+
+
+def test_stage_cache_namespaces(paths):
+    src, out, db = paths
+    fingerprint = stage_fingerprint('scale', scale, {'src': src, 'out_dir': os.path.dirname(out)}, db=db)
+    first, second = StageCache(db, namespace='a'), StageCache(db, namespace='b')
+    first.record('scale', fingerprint, [src], result=src)
+    assert first.lookup('scale', fingerprint) == [src] and first.result('scale') == src
+    assert second.lookup('scale', fingerprint) is None
+    assert first.lookup('scale', 'other') is None
+
+
+def test_file_checksum_is_remembered(paths, monkeypatch):
+    src, _, db = paths
+    digest = file_checksum(src, db)
+    import builtins
+    real_open = builtins.open
+
+    def no_reads(fn, *args, **kwargs):
+        if fn == src:
+            raise AssertionError('file read twice')
+        return real_open(fn, *args, **kwargs)
+    monkeypatch.setattr(builtins, 'open', no_reads)
+    assert file_checksum(src, db) == digest
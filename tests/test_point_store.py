@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from point_store import PointStore, build_point_store, build_pyramid, extract_points
+
+
+def _store(make_dataset, tmp_path, ts):
+    fn = build_point_store(make_dataset('data.nc', ts), str(tmp_path / 'data_points.npy'))
+    store = PointStore(fn)
+    build_pyramid(store)
+    return store
+
+
+def test_series_are_time_major_with_missing_values_as_nan(make_dataset, tmp_path):
+    rng = np.random.default_rng(0)
+    ts = 280.0 + rng.standard_normal((36, 6, 8))
+    ts[:, 1, 2] = np.nan
+    ts[5, 3, 3] = np.nan
+    store = _store(make_dataset, tmp_path, ts)
+    np.testing.assert_array_equal(store.series, np.moveaxis(ts.astype(np.float32), 0, -1))
+    assert np.isnan(store.series[1, 2]).all()
+
+
+@pytest.mark.filterwarnings('ignore:Mean of empty slice')
+def test_pyramid_means_skip_missing_steps(make_dataset, tmp_path):
+    rng = np.random.default_rng(1)
+    ts = 280.0 + rng.standard_normal((36, 6, 8))
+    ts[5, 3, 3] = np.nan
+    ts[:, 1, 2] = np.nan
+    store = _store(make_dataset, tmp_path, ts)
+    stored = ts.astype(np.float32).astype(np.float64)
+
+    annual = store.level_series('annual')
+    assert annual.shape == (6, 8, 3)
+    np.testing.assert_allclose(annual, np.nanmean(stored.reshape(3, 12, 6, 8), axis=1).transpose(1, 2, 0), rtol=1e-6)
+    # a cell with one missing month still has a mean, an all-missing cell has none
+    assert np.isfinite(annual[3, 3]).all()
+    assert np.isnan(annual[1, 2]).all()
+    np.testing.assert_allclose(store.level_x['annual'], [2015.5, 2016.5, 2017.5], atol=0.01)
+
+
+def test_extract_points_at_a_level(make_dataset, tmp_path):
+    ts = 280.0 + np.arange(36.0)[:, None, None] + np.zeros((36, 6, 8))
+    store = _store(make_dataset, tmp_path, ts)
+    lon, lat = store.lon[[1, 5]], store.lat[[2, 4]]
+    series = extract_points([store, store], lon, lat, level='decadal')
+    assert series.shape == (2, 2, 1)
+    np.testing.assert_allclose(series, 280.0 + 17.5)
+    np.testing.assert_allclose(extract_points([store], lon, lat)[0, 0], ts[:, 2, 1])
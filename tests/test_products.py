@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+import products
+
+xr = pytest.importorskip('xarray')
+
+
+@pytest.fixture
+def source(make_dataset, tmp_path, monkeypatch):
+    monkeypatch.setattr(products, 'PRODUCTS_DIR', str(tmp_path / 'products'))
+    products._memory.clear()
+    # 3 years of 280 K plus the month number, +1 K each year
+    month = np.arange(36) % 12
+    ts = 280.0 + month + np.arange(36) // 12
+    fn = make_dataset('model_ssp_data.nc', np.broadcast_to(ts[:, None, None], (36, 4, 6)).copy())
+    yield fn
+    products._memory.clear()
+
+
+def _open(fn):
+    return xr.open_dataset(fn)
+
+
+def test_products(source):
+    ds = _open(source)
+    annual = products.get_product(ds, 'annual')
+    np.testing.assert_allclose(annual.isel(lat=0, lon=0), [285.5, 286.5, 287.5], rtol=1e-6)
+    assert annual.attrs['units'] == 'K'
+    # December, January and February of the same year
+    djf = products.get_product(ds, 'seasonal', season='DJF')
+    np.testing.assert_allclose(djf.isel(lat=0, lon=0), [284.0, 285.0, 286.0], rtol=1e-6)
+    climatology = products.get_product(ds, 'monthly_climatology')
+    np.testing.assert_allclose(climatology.isel(lat=0, lon=0), 281.0 + np.arange(12), rtol=1e-6)
+    anomaly = products.get_product(ds, 'anomaly')
+    np.testing.assert_allclose(anomaly.isel(lat=0, lon=0), np.repeat([-1.0, 0.0, 1.0], 12), atol=1e-4)
+
+
+@pytest.mark.parametrize('product, params', [
+    ('seasonal', {}),
+    ('seasonal', {'season': 'winter'}),
+    ('decadal', {}),
+])
+def test_invalid_products(source, product, params):
+    with pytest.raises(ValueError):
+        products.get_product(_open(source), product, **params)
+    assert not os.path.exists(products.PRODUCTS_DIR) or not os.listdir(products.PRODUCTS_DIR)
+
+
+def test_persisted_products_are_reused(source, monkeypatch):
+    first = products.get_product(_open(source), 'annual').values
+    products._memory.clear()
+
+    def fail(*args, **kwargs):
+        raise AssertionError('product computed twice')
+    monkeypatch.setattr(products, 'compute_product', fail)
+    np.testing.assert_array_equal(products.get_product(_open(source), 'annual').values, first)
+
+
+def test_products_are_rebuilt_when_the_source_changes(source):
+    products.get_product(_open(source), 'annual')
+    from netCDF4 import Dataset
+    with Dataset(source, mode='a') as ncset:
+        ncset['ts'][:] = ncset['ts'][:] + 10.0
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    annual = products.get_product(_open(source), 'annual')
+    np.testing.assert_allclose(annual.isel(lat=0, lon=0), [295.5, 296.5, 297.5], rtol=1e-6)
+    assert len(os.listdir(products.PRODUCTS_DIR)) == 2
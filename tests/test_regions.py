@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from regions import box_indices, region_mask, regional_means, regional_means_file, subset
+
+
+def _data(shape=(14, 18, 24), seed=0):
+    rng = np.random.default_rng(seed)
+    ts = 280.0 + 10.0 * rng.standard_normal(shape)
+    # missing cells, e.g. sea ice in an ocean-only field
+    ts[:, 2:5, 3:9] = np.nan
+    ts[4, 10, 10] = np.nan
+    return ts
+
+
+def _reference(ts, lon, lat, bbox):
+    '''cos(lat)-weighted mean of the finite cells of a box, step by step'''
+    ii, jj, _ = box_indices(lon, lat, bbox)
+    box = ts[:, ii][:, :, jj]
+    w = np.broadcast_to(np.cos(np.radians(lat[ii]))[:, None], box.shape[1:])
+    return np.array([np.nansum(step * w) / w[np.isfinite(step)].sum() for step in box])
+
+
+def test_file_means_skip_fill_values(make_dataset):
+    ts = _data()
+    fn = make_dataset('data.nc', ts)
+    lon = np.linspace(0.0, 360.0, 24, endpoint=False) + 7.5
+    lat = np.linspace(-90.0, 90.0, 19)[:-1] + 5.0
+    regions = ['global', 'southern_hemisphere', (-40.0, 20.0, 40.0, 80.0)]
+    # blocks of a few time steps, so the fill values are read block by block
+    means = regional_means_file(fn, regions, tile_budget=3 * 18 * 24 * 8)
+    assert np.isfinite(means).all()
+    stored = ts.astype(np.float32).astype(np.float64) - 273.15
+    for k, region in enumerate(regions):
+        bbox = (-180.0, 180.0, -90.0, 0.0) if region == 'southern_hemisphere' else region
+        bbox = (-180.0, 180.0, -90.0, 90.0) if region == 'global' else bbox
+        np.testing.assert_allclose(means[:, k], _reference(stored, lon, lat, bbox), rtol=1e-10)
+
+
+def test_in_memory_means_match_the_file(make_dataset):
+    ts = _data()
+    fn = make_dataset('data.nc', ts)
+    lon = np.linspace(0.0, 360.0, 24, endpoint=False) + 7.5
+    lat = np.linspace(-90.0, 90.0, 19)[:-1] + 5.0
+    stored = ts.astype(np.float32).astype(np.float64) - 273.15
+    np.testing.assert_allclose(regional_means(stored, lon, lat, ['global', 'tropics']),
+                               regional_means_file(fn, ['global', 'tropics']), rtol=1e-10)
+
+
+def test_box_across_the_dateline_on_either_convention():
+    lat = np.arange(-88.75, 90.0, 2.5)
+    for lon in (np.arange(0.0, 360.0, 2.5), np.arange(-180.0, 180.0, 2.5)):
+        _, jj, box_lon = box_indices(lon, lat, (170.0, -170.0, -10.0, 10.0))
+        np.testing.assert_allclose(box_lon, np.arange(170.0, 190.1, 2.5))
+        np.testing.assert_allclose(np.mod(lon[jj], 360.0), np.mod(box_lon, 360.0))
+
+
+def test_land_regions():
+    lon, lat = np.arange(0.0, 360.0, 30.0), np.arange(-75.0, 90.0, 30.0)
+    land = np.zeros((len(lat), len(lon)))
+    land[:, :3] = 100.0
+    mask = region_mask(lon, lat, 'land', land)
+    assert set(mask.cells % len(lon)) == {0, 1, 2}
+    assert mask.weights.sum() == pytest.approx(1.0)
+    with pytest.raises(ValueError):
+        region_mask(lon, lat, 'europe:land')
+
+
+def test_subset_across_the_seam_reads_sorted_indices(make_dataset):
+    import netCDF4 as netcdf
+
+    ts = _data()
+    lon = np.linspace(0.0, 360.0, 24, endpoint=False) + 7.5
+    lat = np.linspace(-90.0, 90.0, 19)[:-1] + 5.0
+    stored = np.ma.masked_invalid(ts.astype(np.float32))
+
+    class Variable:
+        '''netCDF4 variable refusing the unsorted indices older versions reject'''
+
+        def __init__(self, var):
+            self.var = var
+
+        def __getitem__(self, index):
+            assert (np.diff(index[-1]) > 0).all()
+            return self.var[index]
+
+    with netcdf.Dataset(make_dataset('data.nc', ts)) as ncset:
+        box_lon, box_lat, values = subset(Variable(ncset['ts']), lon, lat, 'iceland', slice(2, 5))
+    # -40 to 20 degrees: the box starts west of the seam
+    np.testing.assert_allclose(box_lon, np.arange(-37.5, 20.0, 15.0))
+    ii, jj, _ = box_indices(lon, lat, (-40.0, 20.0, 40.0, 80.0))
+    assert not (np.diff(jj) > 0).all()
+    np.testing.assert_array_equal(box_lat, lat[ii])
+    np.testing.assert_array_equal(values, stored[2:5][:, ii][:, :, jj])
+    assert np.ma.getmaskarray(values).sum() == np.ma.getmaskarray(stored[2:5][:, ii][:, :, jj]).sum()
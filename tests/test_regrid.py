@@ -0,0 +1,85 @@
+import os
+import numpy as np
+import pytest
+import regrid
+from regrid import apply_weights, weights
+
+
+def _grid(nlon, nlat, lon0=0.0):
+    '''centres and cell areas (in sr) of a regular global grid'''
+    lon_edges = lon0 + np.linspace(0.0, 360.0, nlon + 1)
+    lat_edges = np.linspace(-90.0, 90.0, nlat + 1)
+    lon = 0.5 * (lon_edges[1:] + lon_edges[:-1])
+    lat = 0.5 * (lat_edges[1:] + lat_edges[:-1])
+    area = np.outer(np.diff(np.sin(np.radians(lat_edges))), np.radians(np.diff(lon_edges)))
+    return lon, lat, area
+
+
+@pytest.fixture(autouse=True)
+def _fresh_cache():
+    regrid._weights.clear()
+    yield
+    regrid._weights.clear()
+
+
+def _field(lon, lat, seed=0):
+    rng = np.random.default_rng(seed)
+    lon2d, lat2d = np.meshgrid(np.radians(lon), np.radians(lat))
+    return 280.0 + 20.0 * np.cos(lat2d) + 5.0 * np.sin(3 * lon2d) + rng.standard_normal(lon2d.shape)
+
+
+@pytest.mark.parametrize('dst', [(30, 20, 0.0), (100, 72, -180.0), (200, 150, 1.3)])
+def test_conservative_preserves_the_global_integral(tmp_path, dst):
+    src_lon, src_lat, src_area = _grid(48, 36)
+    dst_lon, dst_lat, dst_area = _grid(*dst)
+    data = _field(src_lon, src_lat)
+    matrix = weights(src_lon, src_lat, dst_lon, dst_lat, 'conservative', str(tmp_path))
+    out = apply_weights(matrix, data, dst_area.shape)
+    np.testing.assert_allclose((out * dst_area).sum(), (data * src_area).sum(), rtol=1e-12)
+    # a weighted mean never leaves the range of the source values
+    assert out.min() >= data.min() - 1e-9 and out.max() <= data.max() + 1e-9
+
+
+@pytest.mark.parametrize('method', regrid.METHODS)
+def test_constant_field_is_preserved(tmp_path, method):
+    src_lon, src_lat, _ = _grid(48, 36)
+    dst_lon, dst_lat, _ = _grid(100, 72, -180.0)
+    out = regrid.regrid(np.full((3, 36, 48), 271.5), src_lon, src_lat, dst_lon, dst_lat, method, str(tmp_path))
+    assert out.shape == (3, 72, 100)
+    np.testing.assert_allclose(out, 271.5, rtol=1e-12)
+
+
+@pytest.mark.parametrize('method', regrid.METHODS)
+def test_same_grid_is_identity(tmp_path, method):
+    lon, lat, _ = _grid(48, 36)
+    data = _field(lon, lat)
+    out = regrid.regrid(data, lon, lat, lon, lat, method, str(tmp_path))
+    np.testing.assert_allclose(out, data, rtol=1e-12)
+
+
+def test_weights_round_trip_through_disk(tmp_path):
+    src_lon, src_lat, _ = _grid(48, 36)
+    dst_lon, dst_lat, _ = _grid(30, 20)
+    built = weights(src_lon, src_lat, dst_lon, dst_lat, 'conservative', str(tmp_path))
+    assert weights(src_lon, src_lat, dst_lon, dst_lat, 'conservative', str(tmp_path)) is built
+    assert os.listdir(tmp_path) == [os.path.basename(regrid.weights_path(src_lon, src_lat, dst_lon, dst_lat,
+                                                                         'conservative', str(tmp_path)))]
+
+    regrid._weights.clear()
+    loaded = weights(src_lon, src_lat, dst_lon, dst_lat, 'conservative', str(tmp_path))
+    assert loaded is not built
+    assert (loaded != built).nnz == 0
+
+
+def test_single_precision_stays_single(tmp_path):
+    src_lon, src_lat, _ = _grid(48, 36)
+    dst_lon, dst_lat, _ = _grid(30, 20)
+    data = _field(src_lon, src_lat).astype(np.float32)
+    out = regrid.regrid(data, src_lon, src_lat, dst_lon, dst_lat, 'bilinear', str(tmp_path))
+    assert out.dtype == np.float32
+
+
+def test_unknown_method(tmp_path):
+    lon, lat, _ = _grid(48, 36)
+    with pytest.raises(ValueError):
+        weights(lon, lat, lon, lat, 'nearest', str(tmp_path))
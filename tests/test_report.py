@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from report import annual_data, monthly_diff_data
+
+
+@pytest.mark.filterwarnings('ignore:Mean of empty slice')
+def test_annual_means_skip_missing_months(make_dataset):
+    rng = np.random.default_rng(0)
+    ts = 280.0 + rng.standard_normal((36, 4, 6))
+    ts[:, 0, 0] = np.nan
+    ts[13, 2, 3] = np.nan
+    data = annual_data({}, make_dataset('data.nc', ts))
+    expected = np.nanmean(ts.astype(np.float32).astype(np.float64).reshape(3, 12, 4, 6), axis=1) - 273.15
+    # annual means are kept in float32, in K, before the conversion
+    np.testing.assert_allclose(data['annual'], expected, atol=1e-4)
+    assert np.isnan(data['annual'][:, 0, 0]).all() and np.isfinite(data['annual'][:, 1:]).all()
+    np.testing.assert_array_equal(data['years'], [2015, 2016, 2017])
+
+
+def test_monthly_differences_keep_missing_cells_missing(make_dataset):
+    ts = 280.0 + np.arange(36.0)[:, None, None] + np.zeros((36, 4, 6))
+    ts[3, 1, 1] = np.nan
+    diff = monthly_diff_data({}, make_dataset('data.nc', ts), year_offset=2)['diff']
+    assert np.isnan(diff[3, 1, 1])
+    np.testing.assert_allclose(np.delete(diff.ravel(), 3 * 24 + 7), 24.0)
@@ -0,0 +1,72 @@
+import io
+import numpy as np
+import pytest
+import tiles
+
+flask = pytest.importorskip('flask')
+
+
+@pytest.fixture
+def client(make_dataset, tmp_path):
+    ts = np.full((3, 18, 24), 290.0)
+    ts[1] += 2.0
+    # missing cells over the whole northern half
+    ts[:, 9:] = np.nan
+    server = flask.Flask(__name__)
+    tiles.install_tiles(server, {'ssp': make_dataset('data.nc', ts)}, tiles_dir=str(tmp_path / 'tiles'))
+    tiles._fields.clear()
+    yield server.test_client()
+    tiles._fields.clear()
+
+
+def _rgba(png):
+    from matplotlib.image import imread
+    return imread(io.BytesIO(png), format='png')
+
+
+def test_tile_is_a_png_with_missing_cells_transparent(client):
+    response = client.get('/tiles/ssp/temperature/1/0/0/0.png')
+    assert response.status_code == 200 and response.mimetype == 'image/png'
+    rgba = _rgba(response.data)
+    assert rgba.shape == (tiles.TILE_SIZE, tiles.TILE_SIZE, 4)
+    # north of the equator is missing, south is 16.85 degC
+    assert (rgba[:100, :, 3] == 0).all()
+    assert (rgba[-100:, :, 3] == 1).all()
+    assert 'max-age=3600' in response.headers['Cache-Control']
+
+    difference = _rgba(client.get('/tiles/ssp/difference/1/0/0/0.png').data)
+    assert (difference[:100, :, 3] == 0).all() and (difference[-100:, :, 3] == 1).all()
+
+
+@pytest.mark.parametrize('url', [
+    '/tiles/ssp/temperature/3/0/0/0.png',
+    '/tiles/ssp/temperature/0/1/2/0.png',
+    '/tiles/ssp/pressure/0/0/0/0.png',
+    '/tiles/other/temperature/0/0/0/0.png',
+])
+def test_missing_tiles_are_404(client, url):
+    assert client.get(url).status_code == 404
+
+
+def test_tiles_are_served_from_disk(client, monkeypatch):
+    first = client.get('/tiles/ssp/temperature/0/1/1/1.png').data
+    tiles._fields.clear()
+
+    def fail(*args, **kwargs):
+        raise AssertionError('tile rendered twice')
+    monkeypatch.setattr(tiles, 'render_tile', fail)
+    monkeypatch.setattr(tiles, 'get_field', fail)
+    response = client.get('/tiles/ssp/temperature/0/1/1/1.png')
+    assert response.status_code == 200 and response.data == first
+
+
+def test_concurrent_requests(client):
+    from concurrent.futures import ThreadPoolExecutor
+
+    urls = [f'/tiles/ssp/{field}/{time}/1/{x}/{y}.png'
+            for field in ('temperature', 'difference') for time in (0, 2) for x in (0, 1) for y in (0, 1)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        first = list(pool.map(lambda url: client.get(url).data, urls))
+    tiles._fields.clear()
+    assert all(png.startswith(b'\x89PNG') for png in first)
+    assert [client.get(url).data for url in urls] == first
@@ -0,0 +1,208 @@
+import hashlib
+import io
+import os
+import numpy as np
+from cache_utils import LRUCache, file_fingerprint
+from grid_index import GridIndex
+
+
+# rendered tiles, one directory per source file version
+TILES_DIR = 'tiles'
+TILE_SIZE = 256
+MAX_ZOOM = 8
+
+# colour scale of each field: (vmin, vmax, colormap)
+# temperature: degC at one time step
+# difference: degC change of one time step since the first one
+# trend: degC/decade linear trend over the whole record
+FIELDS = {
+    'temperature': (-30.0, 35.0, 'RdYlBu_r'),
+    'difference': (-5.0, 5.0, 'RdBu_r'),
+    'trend': (-1.0, 1.0, 'RdBu_r'),
+}
+
+_fields = LRUCache(maxsize=32)
+
+
+def source_dir(data_fn, tiles_dir=TILES_DIR):
+    '''Tile directory of a dataset, changing whenever the file does'''
+    fingerprint = hashlib.sha1(f'{os.path.abspath(data_fn)}:{file_fingerprint(data_fn)}'.encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(data_fn))[0]
+    return os.path.join(tiles_dir, f'{name}_{fingerprint}')
+
+
+def tile_path(data_fn, field, time, z, x, y, tiles_dir=TILES_DIR):
+    return os.path.join(source_dir(data_fn, tiles_dir), field, str(time), str(z), str(x), f'{y}.png')
+
+
+def get_field(data_fn, field, time=0, variable='ts', tiles_dir=TILES_DIR):
+
+    '''
+    (lat, lon) map of one field in degC, kept in memory for the next tiles.
+    The trend map is a full pass over the file, so it is also saved next to the tiles.
+    '''
+
+    import netCDF4 as netcdf
+    from load_data import NETCDF_LOCK, read_nan, to_celsius
+
+    if field not in FIELDS:
+        raise ValueError(f'Unknown field {field}, expected one of {tuple(FIELDS)}')
+    if field == 'trend':
+        time = 0
+    key = (os.path.abspath(data_fn), file_fingerprint(data_fn), field, time)
+    values = _fields.get(key)
+    if values is not None:
+        return values
+
+    with NETCDF_LOCK:
+        # another thread may have read the field while this one waited
+        values = _fields.get(key)
+        if values is not None:
+            return values
+        if field == 'trend':
+            fn = os.path.join(source_dir(data_fn, tiles_dir), 'trend.npy')
+            if os.path.exists(fn):
+                values = np.load(fn)
+            else:
+                from cal_trend import cal_rate_tiled
+                values = cal_rate_tiled(data_fn, scale=120.0, variable=variable)
+                os.makedirs(os.path.dirname(fn), exist_ok=True)
+                tmp_fn = f'{fn}.{os.getpid()}.tmp.npy'
+                np.save(tmp_fn, values)
+                os.replace(tmp_fn, fn)
+        else:
+            with netcdf.Dataset(data_fn, mode='r') as ncset:
+                var = ncset[variable]
+                if not 0 <= time < var.shape[0]:
+                    raise ValueError(f'time index {time} outside 0..{var.shape[0] - 1}')
+                # missing cells are NaN, drawn transparent by render_tile
+                values = read_nan(var, time)
+                if field == 'difference':
+                    values = values - read_nan(var, 0)
+                else:
+                    values = to_celsius(values, getattr(var, 'units', 'K'))
+
+        _fields.set(key, values)
+    return values
+
+
+def tile_lonlat(z, x, y, size=TILE_SIZE):
+    '''Longitudes of the pixel columns and latitudes of the pixel rows of a Web Mercator tile'''
+    n = 2**z
+    lon = (x + (np.arange(size) + 0.5)/size)/n*360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi*(1 - 2*(y + (np.arange(size) + 0.5)/size)/n))))
+    return lon, lat
+
+
+def render_tile(values, grid, field, z, x, y, size=TILE_SIZE):
+
+    '''
+    PNG bytes of one XYZ tile of a (lat, lon) field, sampled at the nearest
+    grid cell. Rows and columns of a Mercator tile are lines of constant latitude
+    and longitude, so the cells are looked up per row and per column and
+    combined with one outer index.
+    '''
+
+    from matplotlib import colormaps
+    from matplotlib.colors import Normalize
+    from matplotlib.image import imsave
+
+    lon, lat = tile_lonlat(z, x, y, size)
+    _, j = grid.nearest(lon, np.zeros_like(lon))
+    i, _ = grid.nearest(np.zeros_like(lat), lat)
+    pixels = values[np.ix_(i, j)]
+
+    vmin, vmax, cmap = FIELDS[field]
+    rgba = colormaps[cmap](Normalize(vmin=vmin, vmax=vmax)(pixels), bytes=True)
+    rgba[~np.isfinite(pixels)] = 0
+
+    buf = io.BytesIO()
+    imsave(buf, rgba, format='png')
+    return buf.getvalue()
+
+
+def get_tile(data_fn, field, time, z, x, y, variable='ts', tiles_dir=TILES_DIR):
+
+    '''
+    Path of a PNG tile, rendered on first request and served from disk after.
+    returns
+            ---> file name of the tile
+    '''
+
+    n = 2**z
+    if not (0 <= z <= MAX_ZOOM and 0 <= x < n and 0 <= y < n):
+        raise ValueError(f'No tile {z}/{x}/{y}')
+    if field == 'trend':
+        time = 0
+
+    fn = tile_path(data_fn, field, time, z, x, y, tiles_dir)
+    if os.path.exists(fn):
+        return fn
+
+    values = get_field(data_fn, field, time, variable, tiles_dir)
+    grid = _grid(data_fn)
+    png = render_tile(values, grid, field, z, x, y)
+
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp_fn = f'{fn}.{os.getpid()}.tmp'
+    with open(tmp_fn, 'wb') as f:
+        f.write(png)
+    os.replace(tmp_fn, fn)
+    return fn
+
+
+_grids = {}
+
+
+def _grid(data_fn):
+    import netCDF4 as netcdf
+    from load_data import NETCDF_LOCK
+
+    if data_fn not in _grids:
+        with NETCDF_LOCK, netcdf.Dataset(data_fn, mode='r') as ncset:
+            _grids[data_fn] = GridIndex(ncset['lon'][:], ncset['lat'][:])
+    return _grids[data_fn]
+
+
+def prerender(data_fn, field, times=(0,), max_zoom=3, variable='ts', tiles_dir=TILES_DIR):
+    '''Render every tile of zoom levels 0..max_zoom for the given time steps ahead of time'''
+    count = 0
+    for time in times:
+        for z in range(max_zoom + 1):
+            for x in range(2**z):
+                for y in range(2**z):
+                    get_tile(data_fn, field, time, z, x, y, variable, tiles_dir)
+                    count += 1
+    return count
+
+
+def install_tiles(server, data_fns, tiles_dir=TILES_DIR):
+
+    '''
+    Serve tiles of several datasets from a Flask server at
+    /tiles/<name>/<field>/<time>/<z>/<x>/<y>.png, name being a key of data_fns.
+    '''
+
+    from flask import abort, send_file
+
+    @server.route('/tiles/<name>/<field>/<int:time>/<int:z>/<int:x>/<int:y>.png')
+    def tile(name, field, time, z, x, y):
+        if name not in data_fns or field not in FIELDS or not os.path.exists(data_fns[name]):
+            abort(404)
+        try:
+            fn = get_tile(data_fns[name], field, time, z, x, y, tiles_dir=tiles_dir)
+        except ValueError:
+            abort(404)
+        # the URL does not change with the source file version (only the
+        # directory on disk does), so browsers cache a tile for an hour and
+        # then revalidate it against its ETag rather than keep it forever
+        return send_file(os.path.abspath(fn), mimetype='image/png', max_age=3600, conditional=True)
+
+    return tile
+
+
+if __name__ == "__main__":
+    import sys
+    data_fn, field = sys.argv[1], sys.argv[2]
+    times = [int(t) for t in sys.argv[3].split(',')] if len(sys.argv) > 3 else [0]
+    print(prerender(data_fn, field, times), 'tiles')
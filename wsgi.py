@@ -0,0 +1,12 @@
+'''
+WSGI entry point for serving the dashboard in production, e.g.
+
+    gunicorn -c gunicorn.conf.py wsgi:server
+'''
+
+from app import app, preload_stores
+from serving_metrics import install_metrics
+
+preload_stores()
+install_metrics(app.server)
+server = app.server